@@ -0,0 +1,58 @@
+"""Purges deleted accounts.
+
+Deleting an account only sets `users_table.deleted_at`, which locks the user out at
+once. The purge then handles the account's links in chunks of ACCOUNT_DELETE_BATCH_SIZE,
+each chunk a single set-based UPDATE or DELETE in its own transaction. So no link rows
+are loaded into memory, and no transaction grows with the size of the account. With
+ACCOUNT_DELETE_LINKS=anonymize (the default) the links keep working without an owner;
+with `delete` they are removed and dropped from every cache. The user row is deleted
+with the last chunk.
+
+The purge runs every ACCOUNT_PURGE_INTERVAL_SECONDS and right after each deletion.
+Accounts still marked deleted after a restart are picked up by the next run.
+"""
+import asyncio
+import os
+from dotenv import load_dotenv
+
+from . import crud
+from .database import AsyncSessionLocal
+
+load_dotenv()
+
+ACCOUNT_DELETE_LINKS = os.getenv("ACCOUNT_DELETE_LINKS", "anonymize")
+ACCOUNT_DELETE_BATCH_SIZE = int(os.getenv("ACCOUNT_DELETE_BATCH_SIZE", "1000"))
+ACCOUNT_PURGE_INTERVAL_SECONDS = float(os.getenv("ACCOUNT_PURGE_INTERVAL_SECONDS", "60"))
+
+if ACCOUNT_DELETE_LINKS not in ("anonymize", "delete"):
+    raise ValueError(f"Unknown ACCOUNT_DELETE_LINKS: {ACCOUNT_DELETE_LINKS!r}")
+
+purge_requested = asyncio.Event()
+
+
+async def purge_deleted_accounts() -> int:
+    async with AsyncSessionLocal() as db:
+        user_ids = await crud.get_deleted_user_ids(db)
+
+    for user_id in user_ids:
+        await purge_account(user_id)
+    return len(user_ids)
+
+
+async def purge_account(user_id: int):
+    delete_links = ACCOUNT_DELETE_LINKS == "delete"
+    while True:
+        async with AsyncSessionLocal() as db:
+            short_codes = await crud.detach_user_links(db, user_id, ACCOUNT_DELETE_BATCH_SIZE, delete_links)
+            done = len(short_codes) < ACCOUNT_DELETE_BATCH_SIZE
+            if done:
+                await crud.purge_db_user(db, user_id)
+            await db.commit()
+
+        # Anonymized links redirect as before, so only deleted ones leave the caches.
+        if delete_links:
+            await crud.links_removed(short_codes)
+        if done:
+            return
+        # Let requests run between chunks.
+        await asyncio.sleep(0)
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import os
+import string
+from typing import Dict, List
+from dotenv import load_dotenv
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from . import models, utils
+
+load_dotenv()
+
+SHORT_CODE_STRATEGY = os.getenv("SHORT_CODE_STRATEGY", "random")
+SHORT_CODE_KEY = os.getenv("SHORT_CODE_KEY") or os.getenv("SECRET_KEY") or ""
+
+# Fixed on purpose: changing it would make new blocks overlap ones already handed out.
+BLOCK_SIZE = 1000
+
+ALPHABET = string.ascii_letters + string.digits
+CODE_LENGTH = 8
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+
+
+def encode_base62(number: int, length: int = CODE_LENGTH) -> str:
+    chars = []
+    for _ in range(length):
+        number, remainder = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[remainder])
+    return "".join(reversed(chars))
+
+
+def decode_base62(code: str) -> int:
+    number = 0
+    for char in code:
+        number = number * len(ALPHABET) + ALPHABET.index(char)
+    return number
+
+
+class FeistelPermutation:
+    """Keyed, reversible permutation of [0, CODE_SPACE).
+
+    A balanced Feistel network permutes 48-bit integers; values that land outside the
+    code space are walked through the network again until they fall back inside it.
+    """
+
+    HALF_BITS = 24
+    HALF_MASK = (1 << HALF_BITS) - 1
+
+    def __init__(self, key: str, rounds: int = 4):
+        self._key = hashlib.sha256(key.encode()).digest()
+        self._rounds = rounds
+
+    def _round(self, value: int, round_index: int) -> int:
+        digest = hashlib.blake2b(
+            value.to_bytes(3, "big") + bytes([round_index]), key=self._key, digest_size=3
+        ).digest()
+        return int.from_bytes(digest, "big")
+
+    def _encrypt(self, number: int) -> int:
+        left, right = number >> self.HALF_BITS, number & self.HALF_MASK
+        for round_index in range(self._rounds):
+            left, right = right, left ^ self._round(right, round_index)
+        return (left << self.HALF_BITS) | right
+
+    def _decrypt(self, number: int) -> int:
+        left, right = number >> self.HALF_BITS, number & self.HALF_MASK
+        for round_index in reversed(range(self._rounds)):
+            left, right = right ^ self._round(left, round_index), left
+        return (left << self.HALF_BITS) | right
+
+    def permute(self, number: int) -> int:
+        number = self._encrypt(number)
+        while number >= CODE_SPACE:
+            number = self._encrypt(number)
+        return number
+
+    def invert(self, number: int) -> int:
+        number = self._decrypt(number)
+        while number >= CODE_SPACE:
+            number = self._decrypt(number)
+        return number
+
+
+class RandomCodeAllocator:
+    async def allocate(self, db: AsyncSession, count: int) -> List[str]:
+        return utils.generate_short_codes(count)
+
+    async def close(self):
+        pass
+
+
+class SequenceCodeAllocator:
+    """Hands out codes for IDs reserved in blocks of BLOCK_SIZE from a database sequence.
+
+    Each sequence value `hi` reserves the IDs [hi * BLOCK_SIZE, (hi + 1) * BLOCK_SIZE)
+    for this worker alone, so distinct IDs (and therefore codes) never collide and
+    workers only touch the database once per block.
+    """
+
+    def __init__(self, permutation: FeistelPermutation, block_size: int = BLOCK_SIZE):
+        self.permutation = permutation
+        self.block_size = block_size
+        self._blocks: List[int] = []
+        self._next_id = 0
+        self._block_end = 0
+        self._lock = asyncio.Lock()
+        self._counter_engines: Dict[URL, AsyncEngine] = {}
+
+    async def _reserve_blocks(self, db: AsyncSession, count: int):
+        if db.bind.dialect.name == "sqlite":
+            await self._reserve_blocks_from_counter(db, count)
+            return
+
+        result = await db.execute(
+            select(func.next_value(models.short_code_block_seq))
+            .select_from(func.generate_series(1, count))
+        )
+        self._blocks.extend(result.scalars())
+
+    async def _reserve_blocks_from_counter(self, db: AsyncSession, count: int):
+        counter = models.short_code_block_counter
+        # Committed on a connection of its own, like a sequence, so blocks stay reserved
+        # even if the request's transaction rolls back.
+        async with self._counter_engine(db.bind.url).begin() as conn:
+            await conn.execute(
+                sqlite.insert(counter).values(id=1, last_block=0).on_conflict_do_nothing(index_elements=[counter.c.id])
+            )
+            result = await conn.execute(
+                update(counter)
+                .where(counter.c.id == 1)
+                .values(last_block=counter.c.last_block + count)
+                .returning(counter.c.last_block)
+            )
+            last_block = result.scalar_one()
+        # Like the sequence, the first block handed out is 1.
+        self._blocks.extend(range(last_block - count + 1, last_block + 1))
+
+    def _counter_engine(self, url: URL) -> AsyncEngine:
+        # Not the app's writer pool: the request's session may hold its only connection.
+        # The request has written nothing yet when blocks run out (see crud.create_db_urls_bulk),
+        # so this connection never waits on the request's own lock.
+        engine = self._counter_engines.get(url)
+        if engine is None:
+            engine = self._counter_engines[url] = create_async_engine(url, poolclass=NullPool)
+        return engine
+
+    async def close(self):
+        for engine in self._counter_engines.values():
+            await engine.dispose()
+        self._counter_engines.clear()
+
+    async def allocate(self, db: AsyncSession, count: int) -> List[str]:
+        ids: List[int] = []
+        async with self._lock:
+            while len(ids) < count:
+                if self._next_id >= self._block_end:
+                    if not self._blocks:
+                        missing = count - len(ids)
+                        await self._reserve_blocks(db, -(-missing // self.block_size))
+                    hi = self._blocks.pop(0)
+                    self._next_id, self._block_end = hi * self.block_size, (hi + 1) * self.block_size
+
+                take = min(count - len(ids), self._block_end - self._next_id)
+                ids.extend(range(self._next_id, self._next_id + take))
+                self._next_id += take
+
+        return [encode_base62(self.permutation.permute(code_id)) for code_id in ids]
+
+
+if SHORT_CODE_STRATEGY == "sequence":
+    code_allocator = SequenceCodeAllocator(FeistelPermutation(SHORT_CODE_KEY))
+elif SHORT_CODE_STRATEGY == "random":
+    code_allocator = RandomCodeAllocator()
+else:
+    raise ValueError(f"Unknown SHORT_CODE_STRATEGY: {SHORT_CODE_STRATEGY!r}")
@@ -0,0 +1,209 @@
+"""Bloom filter of existing short codes.
+
+With BLOOM_FILTER_ENABLED, each worker builds a Bloom filter of every short code at
+startup. A redirect for a code the filter has never seen gets a 404 without a database
+lookup. Codes created by this worker are added right away. With SHARED_CACHE_URL set,
+codes created by other workers arrive on the shared cache's invalidation channel and are
+added right away too. Otherwise they are picked up by an incremental scan every
+BLOOM_FILTER_REFRESH_SECONDS. Until then they 404 on this worker, so keep the refresh
+interval short when running several workers without a shared cache.
+
+Each refresh scans url_ids above the highest one seen BLOOM_FILTER_LOOKBACK_SECONDS ago,
+not just since the last refresh. A transaction that draws low IDs and commits after
+newer ones, like a large batch create or an import chunk, is still picked up as long
+as it commits within the lookback.
+
+A Bloom filter can't forget, so deleted links stay "maybe present" and fall through to
+the database (and the negative cache). The filter is rebuilt from scratch every
+BLOOM_FILTER_REBUILD_SECONDS to drop them and to resize it as the table grows.
+"""
+import asyncio
+import hashlib
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from . import metrics, models
+from .database import ScanSessionLocal
+
+load_dotenv()
+
+BLOOM_FILTER_ENABLED = os.getenv("BLOOM_FILTER_ENABLED", "false").lower() == "true"
+BLOOM_FILTER_CAPACITY = int(os.getenv("BLOOM_FILTER_CAPACITY", "1000000"))
+BLOOM_FILTER_ERROR_RATE = float(os.getenv("BLOOM_FILTER_ERROR_RATE", "0.001"))
+BLOOM_FILTER_REFRESH_SECONDS = float(os.getenv("BLOOM_FILTER_REFRESH_SECONDS", "2"))
+BLOOM_FILTER_REBUILD_SECONDS = float(os.getenv("BLOOM_FILTER_REBUILD_SECONDS", "3600"))
+BLOOM_FILTER_LOOKBACK_SECONDS = float(os.getenv("BLOOM_FILTER_LOOKBACK_SECONDS", "60"))
+
+SCAN_CHUNK_SIZE = 10000
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str):
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: str):
+        # Only count keys that set a new bit, so re-adding a key doesn't inflate the estimate.
+        changed = False
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not self._bits[position >> 3] & mask:
+                self._bits[position >> 3] |= mask
+                changed = True
+        if changed:
+            self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def estimated_false_positive_rate(self) -> float:
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+
+class ShortCodeFilter:
+    """The worker's current BloomFilter plus the bookkeeping needed to keep it up to date.
+
+    Until the first build finishes every code is let through to the database.
+    """
+
+    def __init__(self):
+        self.bloom: Optional[BloomFilter] = None
+        # (time, highest url_id seen so far) after each scan in the lookback, oldest first.
+        # Every ID below a watermark was drawn before its time.
+        self.watermarks: Deque[Tuple[float, int]] = deque()
+        self.rejected = 0
+        self.false_positives = 0
+        self._added_during_rebuild: Optional[List[str]] = None
+
+    def add(self, short_code: str):
+        if self.bloom is not None:
+            self.bloom.add(short_code)
+        if self._added_during_rebuild is not None:
+            self._added_during_rebuild.append(short_code)
+
+    def might_contain(self, short_code: str) -> bool:
+        if self.bloom is None or short_code in self.bloom:
+            return True
+        self.rejected += 1
+        return False
+
+    def record_false_positive(self):
+        if self.bloom is not None:
+            self.false_positives += 1
+
+    def rescan_from(self, now: float, lookback: float) -> int:
+        """The newest watermark at least `lookback` seconds old, or the oldest one kept."""
+        while len(self.watermarks) > 1 and self.watermarks[1][0] <= now - lookback:
+            self.watermarks.popleft()
+        return self.watermarks[0][1] if self.watermarks else 0
+
+    def record_scan(self, now: float, highest: int):
+        if self.watermarks:
+            highest = max(highest, self.watermarks[-1][1])
+        self.watermarks.append((now, highest))
+
+    def observed_false_positive_rate(self) -> float:
+        absent = self.rejected + self.false_positives
+        return self.false_positives / absent if absent else 0.0
+
+
+code_filter = ShortCodeFilter()
+
+if BLOOM_FILTER_ENABLED:
+    metrics.add_collected(
+        "bloom_filter_memory_bytes", "Memory used by the short code Bloom filter's bit array.",
+        lambda: code_filter.bloom.memory_bytes() if code_filter.bloom is not None else 0
+    )
+    metrics.add_collected(
+        "bloom_filter_entries", "Distinct short codes in the Bloom filter.",
+        lambda: code_filter.bloom.count if code_filter.bloom is not None else 0
+    )
+    metrics.add_collected(
+        "bloom_filter_estimated_false_positive_rate", "False-positive rate expected from the filter's fill.",
+        lambda: code_filter.bloom.estimated_false_positive_rate() if code_filter.bloom is not None else 0
+    )
+    metrics.add_collected(
+        "bloom_filter_observed_false_positive_rate",
+        "Share of unknown codes the filter let through to the database.",
+        code_filter.observed_false_positive_rate
+    )
+    metrics.add_collected(
+        "bloom_filter_rejected_total", "Lookups answered with 404 by the Bloom filter.",
+        lambda: code_filter.rejected, metric_type="counter"
+    )
+    metrics.add_collected(
+        "bloom_filter_false_positives_total", "Lookups the filter let through that found no link.",
+        lambda: code_filter.false_positives, metric_type="counter"
+    )
+
+
+@metrics.track_queries
+async def scan_short_codes(bloom: BloomFilter, after_id: int) -> int:
+    """Add the codes of every link with url_id > `after_id`; return the highest url_id seen."""
+    highest = after_id
+    async with ScanSessionLocal() as db:
+        result = await db.stream(
+            select(models.URL.url_id, models.URL.short_code)
+            .filter(models.URL.url_id > after_id)
+            .order_by(models.URL.url_id)
+            .execution_options(yield_per=SCAN_CHUNK_SIZE)
+        )
+        async for rows in result.partitions():
+            for url_id, short_code in rows:
+                bloom.add(short_code)
+            highest = max(highest, rows[-1].url_id)
+    return highest
+
+
+_scan_lock = asyncio.Lock()
+
+async def rebuild_code_filter():
+    async with _scan_lock:
+        await _rebuild()
+
+async def refresh_code_filter():
+    async with _scan_lock:
+        if code_filter.bloom is None:
+            await _rebuild()
+            return
+
+        after_id = code_filter.rescan_from(time.monotonic(), BLOOM_FILTER_LOOKBACK_SECONDS)
+        highest = await scan_short_codes(code_filter.bloom, after_id)
+        code_filter.record_scan(time.monotonic(), highest)
+
+
+async def _rebuild():
+    previous = code_filter.bloom
+    capacity = max(BLOOM_FILTER_CAPACITY, 2 * previous.count if previous is not None else 0)
+    bloom = BloomFilter(capacity, BLOOM_FILTER_ERROR_RATE)
+
+    code_filter._added_during_rebuild = []
+    try:
+        highest = await scan_short_codes(bloom, 0)
+        for short_code in code_filter._added_during_rebuild:
+            bloom.add(short_code)
+    finally:
+        code_filter._added_during_rebuild = None
+
+    code_filter.bloom = bloom
+    # Earlier watermarks stay, so refreshes keep looking back past the rebuild.
+    code_filter.record_scan(time.monotonic(), highest)
@@ -0,0 +1,120 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple, Optional
+from dotenv import load_dotenv
+
+from . import metrics
+
+load_dotenv()
+
+URL_CACHE_MAX_SIZE = int(os.getenv("URL_CACHE_MAX_SIZE", "10000"))
+URL_CACHE_TTL_SECONDS = float(os.getenv("URL_CACHE_TTL_SECONDS", "300"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+NEGATIVE_CACHE_MAX_SIZE = int(os.getenv("NEGATIVE_CACHE_MAX_SIZE", "100000"))
+NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv("NEGATIVE_CACHE_TTL_SECONDS", "10"))
+
+# Stored in user_cache for deleted accounts so their tokens are rejected without a lookup.
+DELETED_USER = object()
+
+
+class CachedURL(NamedTuple):
+    url_id: int
+    target_url: str
+    owned_by: Optional[int]
+    redirect_type: str = "temporary"
+    cache_max_age: Optional[int] = None
+    # Unix timestamp, so expiry checks on cached entries are a float comparison.
+    expires_at: Optional[float] = None
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after `ttl` seconds.
+
+    A `max_size` of 0 disables the cache: every lookup is a miss and nothing is stored.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.max_size <= 0:
+            return
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Any], bool]):
+        stale = [key for key, (_, value) in self._data.items() if predicate(value)]
+        for key in stale:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+url_cache = TTLCache(max_size=URL_CACHE_MAX_SIZE, ttl=URL_CACHE_TTL_SECONDS)
+user_cache = TTLCache(max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+# Short codes recently looked up and not found.
+negative_cache = TTLCache(max_size=NEGATIVE_CACHE_MAX_SIZE, ttl=NEGATIVE_CACHE_TTL_SECONDS)
+
+_caches = {("url",): url_cache, ("user",): user_cache, ("negative",): negative_cache}
+
+metrics.add_collected(
+    "cache_hits_total", "In-process cache hits.",
+    lambda: {labels: cache.hits for labels, cache in _caches.items()}, ("cache",), "counter"
+)
+metrics.add_collected(
+    "cache_misses_total", "In-process cache misses.",
+    lambda: {labels: cache.misses for labels, cache in _caches.items()}, ("cache",), "counter"
+)
+metrics.add_collected(
+    "cache_evictions_total", "Entries evicted to stay within the cache size limit.",
+    lambda: {labels: cache.evictions for labels, cache in _caches.items()}, ("cache",), "counter"
+)
+metrics.add_collected(
+    "cache_entries", "Entries currently held in the cache.",
+    lambda: {labels: len(cache) for labels, cache in _caches.items()}, ("cache",)
+)
@@ -0,0 +1,88 @@
+"""Deferred click counting.
+
+With CLICK_AGGREGATION enabled, redirects only bump a per-worker in-memory counter.
+The counters are written to `urls_table` as set-based `clicks = clicks + delta`
+updates every CLICK_FLUSH_INTERVAL_SECONDS, as soon as CLICK_FLUSH_BATCH_SIZE
+distinct links are pending, and once more on shutdown.
+
+Loss guarantee: a flush that fails is merged back into the buffer and retried, so
+clicks are only lost if the worker process dies. In that case the loss is bounded by
+the clicks that worker buffered since its last successful flush, i.e. at most one
+flush interval of its redirect traffic.
+
+With SHARED_CACHE_CLICKS, redirects count clicks in the shared cache instead, and
+`drain_shared_clicks` moves those counts into the database (see shared_cache.py).
+"""
+import asyncio
+import os
+from typing import Dict
+from dotenv import load_dotenv
+
+from . import crud, metrics
+from .database import AsyncSessionLocal
+from .shared_cache import shared_cache
+
+load_dotenv()
+
+CLICK_AGGREGATION = os.getenv("CLICK_AGGREGATION", "false").lower() == "true"
+CLICK_FLUSH_INTERVAL_SECONDS = float(os.getenv("CLICK_FLUSH_INTERVAL_SECONDS", "1"))
+CLICK_FLUSH_BATCH_SIZE = int(os.getenv("CLICK_FLUSH_BATCH_SIZE", "1000"))
+
+
+class ClickBuffer:
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.flush_requested = asyncio.Event()
+        self._pending: Dict[int, int] = {}
+
+    def add(self, url_id: int, count: int = 1):
+        self._pending[url_id] = self._pending.get(url_id, 0) + count
+        if len(self._pending) >= self.batch_size:
+            self.flush_requested.set()
+
+    def drain(self) -> Dict[int, int]:
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, deltas: Dict[int, int]):
+        for url_id, count in deltas.items():
+            self._pending[url_id] = self._pending.get(url_id, 0) + count
+
+    def __len__(self):
+        return len(self._pending)
+
+
+click_buffer = ClickBuffer(batch_size=CLICK_FLUSH_BATCH_SIZE)
+
+metrics.add_collected(
+    "click_buffer_pending_links", "Links with buffered clicks waiting to be flushed.",
+    lambda: len(click_buffer)
+)
+
+
+async def flush_clicks():
+    deltas = click_buffer.drain()
+    if not deltas:
+        return
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await crud.add_clicks_bulk(db, deltas, batch_size=CLICK_FLUSH_BATCH_SIZE)
+            await db.commit()
+    except BaseException:
+        click_buffer.restore(deltas)
+        raise
+
+
+async def drain_shared_clicks():
+    deltas = await shared_cache.take_clicks()
+    if not deltas:
+        return
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await crud.add_clicks_bulk(db, deltas, batch_size=CLICK_FLUSH_BATCH_SIZE)
+            await db.commit()
+    except BaseException:
+        await shared_cache.add_clicks(deltas)
+        raise
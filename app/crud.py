@@ -1,16 +1,107 @@
-from typing import Optional
+import datetime
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, delete, case, or_, bindparam, Row
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
-from . import models, utils, schemas, password_utils
+from . import models, schemas, password_utils, jwt_utils
+from .metrics import track_queries, record_redirect
+from .cache import url_cache, user_cache, negative_cache, CachedURL, DELETED_USER
+from .allocator import code_allocator, SequenceCodeAllocator
+from .bloom import code_filter
+from . import shared_index
+from .shared_cache import shared_cache
+from .utils import hash_url, normalize_url, is_valid_short_code, to_timestamp
 
-async def get_url_by_short_code(db: AsyncSession, short_code: str):
-    result = await db.execute(
-        select(models.URL).filter(models.URL.short_code == short_code)
+load_dotenv()
+
+BULK_INSERT_CHUNK_SIZE = 5000
+LINK_DEDUP_ENABLED = os.getenv("LINK_DEDUP_ENABLED", "false").lower() == "true"
+PERMANENT_REDIRECT_MAX_AGE = int(os.getenv("PERMANENT_REDIRECT_MAX_AGE", "86400"))
+# 0 keeps anonymous links forever.
+ANONYMOUS_LINK_TTL_SECONDS = int(os.getenv("ANONYMOUS_LINK_TTL_SECONDS", "0"))
+
+# Columns returned for links created or matched in bulk.
+LINK_COLUMNS = (
+    models.URL.url_id,
+    models.URL.target_url,
+    models.URL.short_code,
+    models.URL.clicks,
+    models.URL.created_at,
+    models.URL.owned_by,
+    models.URL.redirect_type,
+    models.URL.cache_max_age,
+    models.URL.expires_at,
+)
+
+# Statements for the per-request hot paths, built once at import. Running the same
+# statement object lets SQLAlchemy reuse its compiled form without rebuilding it or
+# recomputing its cache key, and Core statements on the table return plain rows
+# without ORM object loading or identity-map bookkeeping.
+urls = models.URL.__table__
+
+# Same columns, in the same order, as CachedURL.
+REDIRECT_COLUMNS = (
+    urls.c.url_id,
+    urls.c.target_url,
+    urls.c.owned_by,
+    urls.c.redirect_type,
+    urls.c.cache_max_age,
+    urls.c.expires_at,
+)
+
+SELECT_LINK_BY_SHORT_CODE = (
+    select(*(urls.c[column.key] for column in LINK_COLUMNS))
+    .where(urls.c.short_code == bindparam("code"))
+)
+COUNT_CLICK_BY_ID = (
+    update(urls)
+    .where(urls.c.url_id == bindparam("link_id"))
+    .values(clicks=urls.c.clicks + 1)
+)
+# Resolves a link and counts the click in one round trip. Expired links don't match,
+# so they are neither counted nor redirected.
+COUNT_CLICK_BY_SHORT_CODE = (
+    update(urls)
+    .where(
+        urls.c.short_code == bindparam("code"),
+        or_(urls.c.expires_at.is_(None), urls.c.expires_at > bindparam("now")),
     )
-    return result.scalars().first()
+    .values(clicks=urls.c.clicks + 1)
+    .returning(*REDIRECT_COLUMNS)
+)
+SELECT_ACTIVE_USER_BY_ID = (
+    select(models.User)
+    .where(models.User.id == bindparam("user_id"), models.User.deleted_at.is_(None))
+)
 
+def dialect_insert(db: AsyncSession, table):
+    """An INSERT supporting ON CONFLICT clauses on the session's database."""
+    if db.bind.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+async def read_or_primary(read_db: AsyncSession, db: AsyncSession, query, *args):
+    """Run a read-only crud `query` on the replica session, retrying on the primary when
+    the replica has no row yet (e.g. it was written moments ago and hasn't replicated)."""
+    result = await query(read_db, *args)
+    if read_db is not db:
+        # Hand the replica connection back before touching the primary.
+        await read_db.commit()
+        if result is None:
+            result = await query(db, *args)
+    return result
+
+@track_queries
+async def get_url_by_short_code(db: AsyncSession, short_code: str) -> Optional[Row]:
+    result = await db.execute(SELECT_LINK_BY_SHORT_CODE, {"code": short_code})
+    return result.first()
+
+@track_queries
 async def get_user_by_email(db: AsyncSession, email: str):
     result = await db.execute(
         select(models.User).filter(models.User.email == email)
@@ -18,45 +109,482 @@ async def get_user_by_email(db: AsyncSession, email: str):
     return result.scalars().first()
 
 
+@track_queries
 async def get_user_by_id(db: AsyncSession, user_id: int):
+    # Still an ORM object: the user cache merges it into later sessions.
+    result = await db.execute(SELECT_ACTIVE_USER_BY_ID, {"user_id": user_id})
+    return result.scalars().first()
+
+async def get_user_by_id_cached(
+    db: AsyncSession, user_id: int, read_db: Optional[AsyncSession] = None
+):
+    cached_user = user_cache.get(user_id)
+    if cached_user is DELETED_USER:
+        return None
+    if cached_user is not None:
+        return await db.merge(cached_user, load=False)
+
+    user = await read_or_primary(read_db or db, db, get_user_by_id, user_id)
+    if user is not None:
+        user_cache.set(user_id, user)
+    return user
+
+@track_queries
+async def get_urls_by_owner(
+    db: AsyncSession, owner_id: int, after_id: Optional[int] = None, limit: int = 100
+) -> List[models.URL]:
+    query = select(models.URL).filter(models.URL.owned_by == owner_id)
+    if after_id is not None:
+        query = query.filter(models.URL.url_id > after_id)
+
+    result = await db.execute(query.order_by(models.URL.url_id).limit(limit))
+    return list(result.scalars())
+
+@track_queries
+async def get_urls_by_owner_and_short_codes(db: AsyncSession, owner_id: int, short_codes: List[str]) -> List[Row]:
     result = await db.execute(
-        select(models.User).filter(models.User.id == user_id)
+        select(*LINK_COLUMNS)
+        .where(models.URL.short_code.in_(short_codes), models.URL.owned_by == owner_id)
     )
-    return result.scalars().first()
+    return list(result.all())
 
-async def get_url_by_short_code_and_lock(db: AsyncSession, short_code: str):
+@track_queries
+async def get_top_urls_by_owner(db: AsyncSession, owner_id: int, limit: int = 10) -> List[Row]:
+    # Walks ix_urls_owned_by_clicks (owned_by, clicks, url_id) backwards, ties included,
+    # and stops after `limit` rows without a sort.
     result = await db.execute(
-        select(models.URL)
-        .filter(models.URL.short_code == short_code)
-        .with_for_update()
+        select(*LINK_COLUMNS)
+        .where(models.URL.owned_by == owner_id)
+        .order_by(models.URL.clicks.desc(), models.URL.url_id.desc())
+        .limit(limit)
     )
-    return result.scalars().first()
+    return list(result.all())
+
+async def stream_urls_by_owner(db: AsyncSession, owner_id: int, chunk_size: int = 1000):
+    result = await db.stream(
+        select(
+            models.URL.url_id,
+            models.URL.target_url,
+            models.URL.short_code,
+            models.URL.clicks,
+            models.URL.created_at,
+        )
+        .filter(models.URL.owned_by == owner_id)
+        .order_by(models.URL.url_id)
+        .execution_options(yield_per=chunk_size)
+    )
+    async for rows in result.partitions():
+        yield rows
+
+
+async def resolve_short_code(
+    db: AsyncSession, short_code: str, read_db: Optional[AsyncSession] = None, count_click: bool = False
+) -> Optional[CachedURL]:
+    """Resolve a short code for a redirect. With `count_click`, the click is also counted
+    in the database, in the same statement as the lookup when the link isn't cached;
+    the caller commits."""
+    cached_url, counted = await lookup_short_code(db, short_code, read_db, count_click)
+    # Expired links stay cached until the sweeper deletes them, so they 404 from the cache.
+    if cached_url is not None and cached_url.expires_at is not None and cached_url.expires_at <= time.time():
+        record_redirect("expired")
+        return None
+    if cached_url is not None and count_click and not counted:
+        await increment_clicks_by_id(db, cached_url.url_id)
+    return cached_url
+
+
+async def lookup_short_code(
+    db: AsyncSession, short_code: str, read_db: Optional[AsyncSession] = None, count_click: bool = False
+) -> Tuple[Optional[CachedURL], bool]:
+    """Find a link in the caches or the database; also returns whether its click was counted."""
+    cached_url = url_cache.get(short_code)
+    if cached_url is not None:
+        record_redirect("cache_hit")
+        return cached_url, False
+
+    if not is_valid_short_code(short_code):
+        record_redirect("invalid")
+        return None, False
+
+    if shared_index.redirect_index is not None:
+        cached_url = shared_index.redirect_index.lookup(short_code)
+        if cached_url is not None:
+            record_redirect("shared_index_hit")
+            return cached_url, False
+
+    if negative_cache.get(short_code) is not None:
+        record_redirect("negative_cache_hit")
+        return None, False
+    if not code_filter.might_contain(short_code):
+        record_redirect("filtered")
+        return None, False
+
+    if shared_cache is not None:
+        cached_url = await shared_cache.get_url(short_code)
+        if cached_url is not None:
+            record_redirect("shared_cache_hit")
+            url_cache.set(short_code, cached_url)
+            return cached_url, False
+
+    if count_click:
+        # The click has to be written to the primary anyway, so skip the replica.
+        db_url = await count_click_by_short_code(db, short_code)
+    else:
+        db_url = await read_or_primary(read_db or db, db, get_url_by_short_code, short_code)
+    if not db_url:
+        record_redirect("not_found")
+        code_filter.record_false_positive()
+        negative_cache.set(short_code, True)
+        return None, False
+
+    record_redirect("db_hit")
+    cached_url = to_cached_url(db_url)
+    # Links missing from the shared index go there, so other workers find them too.
+    redirect_index = shared_index.redirect_index
+    if redirect_index is None or not redirect_index.add(short_code, *cached_url):
+        url_cache.set(short_code, cached_url)
+    if shared_cache is not None:
+        await shared_cache.set_url(short_code, cached_url)
+    return cached_url, count_click
+
+
+def to_cached_url(link) -> CachedURL:
+    return CachedURL(
+        url_id=link.url_id,
+        target_url=link.target_url,
+        owned_by=link.owned_by,
+        redirect_type=link.redirect_type,
+        cache_max_age=link.cache_max_age,
+        expires_at=to_timestamp(link.expires_at),
+    )
+
+
+async def links_created(links):
+    """Make new links resolvable on this worker and, via the shared cache, on others."""
+    for link in links:
+        negative_cache.invalidate(link.short_code)
+        code_filter.add(link.short_code)
+        if shared_index.redirect_index is not None:
+            shared_index.redirect_index.add(link.short_code, *to_cached_url(link))
+    if shared_cache is not None and links:
+        await shared_cache.links_created([link.short_code for link in links])
+
+
+def redirect_max_age(redirect_type: str, cache_max_age: Optional[int]) -> Optional[int]:
+    if redirect_type != "permanent":
+        return None
+    return PERMANENT_REDIRECT_MAX_AGE if cache_max_age is None else cache_max_age
+
+
+def link_expiry(owner_id: Optional[int], expires_at: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    if owner_id is not None or not ANONYMOUS_LINK_TTL_SECONDS:
+        return expires_at
+    latest = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ANONYMOUS_LINK_TTL_SECONDS)
+    return latest if expires_at is None else min(expires_at, latest)
+
+
+async def links_removed(short_codes: List[str]):
+    """Drop removed links from every cache, on this node and, via the shared cache, on others."""
+    for short_code in short_codes:
+        url_cache.invalidate(short_code)
+        if shared_index.redirect_index is not None:
+            shared_index.redirect_index.remove(short_code)
+    if shared_cache is not None and short_codes:
+        await shared_cache.links_removed(short_codes)
+
+
+@track_queries
+async def increment_clicks_by_id(db: AsyncSession, url_id: int):
+    await db.execute(COUNT_CLICK_BY_ID, {"link_id": url_id})
+
+
+@track_queries
+async def count_click_by_short_code(db: AsyncSession, short_code: str) -> Optional[Row]:
+    """Count a click on an unexpired link; returns its REDIRECT_COLUMNS, or None."""
+    result = await db.execute(
+        COUNT_CLICK_BY_SHORT_CODE,
+        {"code": short_code, "now": datetime.datetime.now(datetime.timezone.utc)},
+    )
+    return result.first()
+
+
+@track_queries
+async def add_clicks_bulk(db: AsyncSession, deltas: Dict[int, int], batch_size: int = 1000):
+    url_ids = list(deltas)
+    for start in range(0, len(url_ids), batch_size):
+        batch = {url_id: deltas[url_id] for url_id in url_ids[start:start + batch_size]}
+        await db.execute(
+            update(models.URL)
+            .where(models.URL.url_id.in_(batch))
+            .values(clicks=models.URL.clicks + case(batch, value=models.URL.url_id, else_=0))
+        )
+
 
+@track_queries
+async def get_urls_by_owner_and_hashes(db: AsyncSession, owner_id: int, url_hashes: List[bytes]) -> List[Row]:
+    rows = []
+    for start in range(0, len(url_hashes), BULK_INSERT_CHUNK_SIZE):
+        result = await db.execute(
+            select(*LINK_COLUMNS)
+            .where(
+                models.URL.owned_by == owner_id,
+                models.URL.url_hash.in_(url_hashes[start:start + BULK_INSERT_CHUNK_SIZE]),
+            )
+            .order_by(models.URL.url_id)
+        )
+        rows.extend(result)
+    return rows
 
-async def increment_clicks(db: AsyncSession, db_url: models.URL):
-    db_url.clicks += 1
 
+@track_queries
+async def create_db_url(
+    db: AsyncSession,
+    target_url: str,
+    owner_id: Optional[int] = None,
+    redirect_type: str = "temporary",
+    cache_max_age: Optional[int] = None,
+    expires_at: Optional[datetime.datetime] = None,
+) -> models.URL:
+    url_hash = hash_url(target_url)
+    cache_max_age = redirect_max_age(redirect_type, cache_max_age)
+    expires_at = link_expiry(owner_id, expires_at)
+
+    if LINK_DEDUP_ENABLED and owner_id is not None:
+        result = await db.execute(
+            select(models.URL)
+            .where(
+                models.URL.owned_by == owner_id,
+                models.URL.url_hash == url_hash,
+                models.URL.redirect_type == redirect_type,
+            )
+            .order_by(models.URL.url_id)
+        )
+        normalized = normalize_url(target_url)
+        for existing in result.scalars():
+            if (
+                normalize_url(existing.target_url) == normalized
+                and existing.cache_max_age == cache_max_age
+                and to_timestamp(existing.expires_at) == to_timestamp(expires_at)
+            ):
+                return existing
 
-async def create_db_url(db: AsyncSession, target_url: str, owner_id: Optional[int] = None) -> models.URL:
     for _ in range(5):
-        short_code = utils.generate_short_code()
+        short_code, = await code_allocator.allocate(db, 1)
         db_url = models.URL(
             target_url=target_url, 
             short_code=short_code,
-            owned_by=owner_id
+            url_hash=url_hash,
+            owned_by=owner_id,
+            redirect_type=redirect_type,
+            cache_max_age=cache_max_age,
+            expires_at=expires_at
         )
         db.add(db_url)
         try:
             await db.commit()
             await db.refresh(db_url)
+            await links_created([db_url])
             return db_url
-        except IntegrityError:
+        except IntegrityError as exc:
             await db.rollback()
+            cause = integrity_error_cause(exc)
+            if cause == "owner":
+                reject_missing_owner(owner_id)
+            if cause != "short_code":
+                raise
     raise HTTPException(status_code=500, detail="Could not generate a unique short code.")
 
 
+def integrity_error_cause(exc: IntegrityError) -> Optional[str]:
+    """"short_code" for a taken short code, "owner" for a missing owner, else None."""
+    # psycopg reports SQLSTATEs; SQLite only has the message.
+    sqlstate = getattr(exc.orig, "sqlstate", None)
+    message = str(exc.orig)
+    if sqlstate == "23503" or "FOREIGN KEY constraint failed" in message:
+        # owned_by is the only foreign key on urls_table.
+        return "owner"
+    if (sqlstate == "23505" or "UNIQUE constraint failed" in message) and "short_code" in message:
+        return "short_code"
+    return None
+
+
+def reject_missing_owner(owner_id: int):
+    """The owner's row is gone: the account was purged, but a stateless token for it still
+    verifies on workers that didn't handle the deletion."""
+    user_cache.set(owner_id, DELETED_USER, ttl=jwt_utils.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+
+
+@track_queries
+async def create_db_urls_bulk(
+    db: AsyncSession, urls: List[schemas.URLCreate], owner_id: Optional[int] = None
+) -> List[Row]:
+    target_urls = [str(url.target_url) for url in urls]
+    policies = [
+        (
+            url.redirect_type,
+            redirect_max_age(url.redirect_type, url.cache_max_age),
+            link_expiry(owner_id, url.expires_at),
+        )
+        for url in urls
+    ]
+    url_hashes = [hash_url(target_url) for target_url in target_urls]
+    created: Dict[int, Row] = {}
+    pending = list(range(len(target_urls)))
+    # Positions whose URL repeats an earlier one in the batch, mapped to that first position.
+    duplicate_of: Dict[int, int] = {}
+
+    if LINK_DEDUP_ENABLED and owner_id is not None:
+        # The hash narrows the lookup; comparing normalized URLs rules out digest collisions.
+        # A link only matches one with the same redirect policy and expiry.
+        existing: Dict[tuple, Row] = {}
+        for row in await get_urls_by_owner_and_hashes(db, owner_id, list(set(url_hashes))):
+            key = (normalize_url(row.target_url), row.redirect_type, row.cache_max_age, to_timestamp(row.expires_at))
+            existing.setdefault(key, row)
+
+        first_position: Dict[tuple, int] = {}
+        pending = []
+        for position, target_url in enumerate(target_urls):
+            redirect_type, cache_max_age, expires_at = policies[position]
+            key = (normalize_url(target_url), redirect_type, cache_max_age, to_timestamp(expires_at))
+            if key in existing:
+                created[position] = existing[key]
+            elif key in first_position:
+                duplicate_of[position] = first_position[key]
+            else:
+                first_position[key] = position
+                pending.append(position)
+
+    existing_links = dict(created)
+    new_positions = pending
+    # On SQLite the sequence allocator reserves blocks on a connection of its own, which
+    # would wait on this transaction's write lock. There, a clash rolls back and starts the
+    # batch over, so codes are only drawn before anything is written.
+    restart_on_clash = db.bind.dialect.name == "sqlite" and isinstance(code_allocator, SequenceCodeAllocator)
+    for _ in range(5):
+        codes = await code_allocator.allocate(db, len(new_positions)) if new_positions else []
+        position_by_code = dict(zip(codes, new_positions))
+        rows = [
+            {
+                "target_url": target_urls[position],
+                "short_code": code,
+                "url_hash": url_hashes[position],
+                "owned_by": owner_id,
+                "clicks": 0,
+                "redirect_type": policies[position][0],
+                "cache_max_age": policies[position][1],
+                "expires_at": policies[position][2],
+            }
+            for code, position in position_by_code.items()
+        ]
+
+        for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+            try:
+                result = await db.execute(
+                    dialect_insert(db, models.URL)
+                    .values(rows[start:start + BULK_INSERT_CHUNK_SIZE])
+                    .on_conflict_do_nothing(index_elements=[models.URL.short_code])
+                    .returning(*LINK_COLUMNS)
+                )
+            except IntegrityError as exc:
+                await db.rollback()
+                if integrity_error_cause(exc) == "owner":
+                    reject_missing_owner(owner_id)
+                raise
+            for row in result:
+                created[position_by_code.pop(row.short_code)] = row
+
+        if not position_by_code:
+            await db.commit()
+            await links_created(list(created.values()))
+            for position, first in duplicate_of.items():
+                created[position] = created[first]
+            return [created[position] for position in range(len(target_urls))]
+
+        if restart_on_clash:
+            await db.rollback()
+            created = dict(existing_links)
+            new_positions = pending
+        else:
+            # Only the rows whose codes were taken get new ones; the others stay inserted.
+            new_positions = list(position_by_code.values())
+
+    await db.rollback()
+    raise HTTPException(status_code=500, detail="Could not generate unique short codes.")
+
+
+@track_queries
+async def delete_expired_links(db: AsyncSession, now: datetime.datetime, limit: int) -> List[str]:
+    """Delete up to `limit` links that expired before `now`; returns their short codes."""
+    expired = (
+        select(models.URL.url_id)
+        .where(models.URL.expires_at <= now)
+        .order_by(models.URL.expires_at)
+        .limit(limit)
+    )
+    result = await db.execute(
+        delete(models.URL)
+        .where(models.URL.url_id.in_(expired.scalar_subquery()))
+        .returning(models.URL.short_code)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars())
+
+
+@track_queries
+async def insert_click_events(db: AsyncSession, events: List[dict]):
+    for start in range(0, len(events), BULK_INSERT_CHUNK_SIZE):
+        await db.execute(
+            dialect_insert(db, models.click_events).values(events[start:start + BULK_INSERT_CHUNK_SIZE])
+        )
+
+
+@track_queries
+async def add_click_rollups(
+    db: AsyncSession, rollups: Dict[Tuple[str, str, datetime.datetime], int]
+):
+    rows = [
+        {"short_code": short_code, "granularity": granularity, "bucket_start": bucket_start, "clicks": count}
+        for (short_code, granularity, bucket_start), count in rollups.items()
+    ]
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        stmt = dialect_insert(db, models.ClickRollup).values(rows[start:start + BULK_INSERT_CHUNK_SIZE])
+        await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[
+                    models.ClickRollup.short_code,
+                    models.ClickRollup.granularity,
+                    models.ClickRollup.bucket_start,
+                ],
+                set_={"clicks": models.ClickRollup.clicks + stmt.excluded.clicks},
+            )
+        )
+
+
+@track_queries
+async def get_click_series(
+    db: AsyncSession,
+    short_code: str,
+    granularity: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+) -> List[Row]:
+    result = await db.execute(
+        select(models.ClickRollup.bucket_start, models.ClickRollup.clicks)
+        .filter(
+            models.ClickRollup.short_code == short_code,
+            models.ClickRollup.granularity == granularity,
+            models.ClickRollup.bucket_start >= start,
+            models.ClickRollup.bucket_start < end,
+        )
+        .order_by(models.ClickRollup.bucket_start)
+    )
+    return result.all()
+
+
+@track_queries
 async def create_db_user(db: AsyncSession, user: schemas.UserAccount) -> models.User:
-    hashed_password = password_utils.hash_password(user.password)
+    hashed_password = await password_utils.hash_password(user.password)
     
     db_user = models.User(
         username=user.username, 
@@ -64,9 +592,76 @@ async def create_db_user(db: AsyncSession, user: schemas.UserAccount) -> models.
         password=hashed_password
     )
     db.add(db_user)
+    await db.flush()
+    # IDs can be reused on some backends, so never let a new account inherit a tombstone.
+    user_cache.invalidate(db_user.id)
 
     return db_user
 
+@track_queries
 async def delete_db_user(db: AsyncSession, user: models.User):
-    await db.delete(user)
-    await db.commit()
\ No newline at end of file
+    """Mark the account deleted. Its links and row are removed by accounts.purge_deleted_accounts."""
+    user_id = user.id
+    await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(deleted_at=datetime.datetime.now(datetime.timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    url_cache.invalidate_where(lambda cached_url: cached_url.owned_by == user_id)
+    user_cache.set(user_id, DELETED_USER, ttl=jwt_utils.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    if shared_cache is not None:
+        await shared_cache.user_deleted(user_id)
+
+@track_queries
+async def get_existing_user_ids(db: AsyncSession, user_ids: List[int]) -> Set[int]:
+    """The IDs in `user_ids` that belong to accounts that exist and aren't deleted."""
+    existing = set()
+    for start in range(0, len(user_ids), BULK_INSERT_CHUNK_SIZE):
+        result = await db.execute(
+            select(models.User.id).where(
+                models.User.id.in_(user_ids[start:start + BULK_INSERT_CHUNK_SIZE]),
+                models.User.deleted_at.is_(None),
+            )
+        )
+        existing.update(result.scalars())
+    return existing
+
+@track_queries
+async def get_deleted_user_ids(db: AsyncSession) -> List[int]:
+    result = await db.execute(
+        select(models.User.id).where(models.User.deleted_at.is_not(None)).order_by(models.User.id)
+    )
+    return list(result.scalars())
+
+@track_queries
+async def get_account_deletion_status(db: AsyncSession, user_id: int) -> Optional[str]:
+    """"pending" until the purge deletes the user row, then "done"; None if the account
+    was never deleted."""
+    result = await db.execute(select(models.User.deleted_at).where(models.User.id == user_id))
+    row = result.first()
+    if row is None:
+        return "done"
+    return "pending" if row.deleted_at is not None else None
+
+@track_queries
+async def detach_user_links(db: AsyncSession, user_id: int, limit: int, delete_links: bool) -> List[str]:
+    """Anonymize, or delete, up to `limit` of a user's links; returns their short codes."""
+    chunk = select(models.URL.url_id).where(models.URL.owned_by == user_id).limit(limit)
+    statement = delete(models.URL) if delete_links else update(models.URL).values(owned_by=None)
+    result = await db.execute(
+        statement
+        .where(models.URL.url_id.in_(chunk.scalar_subquery()))
+        .returning(models.URL.short_code)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars())
+
+@track_queries
+async def purge_db_user(db: AsyncSession, user_id: int):
+    await db.execute(
+        delete(models.User)
+        .where(models.User.id == user_id, models.User.deleted_at.is_not(None))
+        .execution_options(synchronize_session=False)
+    )
@@ -1,5 +1,7 @@
 import os
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
 load_dotenv()
@@ -10,10 +12,106 @@ DB_PORT = os.getenv("DB_PORT")
 DB_HOST = os.getenv("DB_HOST")
 DB_NAME = os.getenv("DB_NAME")
 
-SQLALCHEMY_DATABASE_URL = (
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or (
     f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
+# Optional read replica for read-only queries; falls back to the primary when unset.
+SQLALCHEMY_READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
 
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+# psycopg prepares a statement server-side after it ran this many times; "none" disables
+# prepared statements (needed behind PgBouncer in transaction pooling mode).
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "5")
+DB_PREPARED_MAX = int(os.getenv("DB_PREPARED_MAX", "100"))
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "500"))
 
-AsyncSessionLocal = async_sessionmaker(bind= engine, expire_on_commit=False, class_=AsyncSession)
\ No newline at end of file
+# Embedded SQLite mode (DATABASE_URL=sqlite+aiosqlite:///path/to/file.db).
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+
+if SQLITE_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+    raise ValueError(f"Unknown SQLITE_SYNCHRONOUS: {SQLITE_SYNCHRONOUS!r}")
+
+
+def is_sqlite_file(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def create_engine_from_url(database_url: str, sqlite_role: str = "writer"):
+    """Create an engine; for a SQLite file, `sqlite_role` picks the single writer
+    connection or the pool of read-only connections."""
+    url = make_url(database_url)
+    engine_kwargs = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "query_cache_size": DB_QUERY_CACHE_SIZE,
+    }
+
+    if url.get_backend_name() != "sqlite" or (is_sqlite_file(url) and sqlite_role == "reader"):
+        engine_kwargs.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    elif is_sqlite_file(url):
+        # SQLite allows one writer at a time. A one-connection pool queues writers in
+        # the app, in order, rather than letting them fail with "database is locked".
+        engine_kwargs.update(pool_size=1, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT)
+
+    if url.get_driver_name() == "psycopg":
+        prepare_threshold = None if DB_PREPARE_THRESHOLD.lower() == "none" else int(DB_PREPARE_THRESHOLD)
+        engine_kwargs["connect_args"] = {"prepare_threshold": prepare_threshold}
+
+    async_engine = create_async_engine(url, **engine_kwargs)
+
+    if url.get_driver_name() == "psycopg":
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def set_prepared_max(dbapi_connection, connection_record):
+            dbapi_connection.driver_connection.prepared_max = DB_PREPARED_MAX
+
+    if url.get_backend_name() == "sqlite":
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            # WAL lets readers run alongside the writer; NORMAL only syncs at checkpoints.
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA foreign_keys=ON")
+            if sqlite_role == "reader":
+                cursor.execute("PRAGMA query_only=ON")
+            cursor.close()
+
+    return async_engine
+
+
+engine = create_engine_from_url(SQLALCHEMY_DATABASE_URL)
+primary_is_sqlite_file = is_sqlite_file(make_url(SQLALCHEMY_DATABASE_URL))
+
+# Long streaming scans of the primary (exports, Bloom filter and shared index builds).
+# On a SQLite file they get read-only connections, so a slow reader never holds the
+# single writer connection until its last row.
+scan_engine = engine
+if primary_is_sqlite_file:
+    scan_engine = create_engine_from_url(SQLALCHEMY_DATABASE_URL, sqlite_role="reader")
+
+if SQLALCHEMY_READ_DATABASE_URL:
+    read_engine = create_engine_from_url(SQLALCHEMY_READ_DATABASE_URL)
+elif primary_is_sqlite_file:
+    # Reads get their own connections to the same file, so they never queue behind writes.
+    read_engine = scan_engine
+else:
+    read_engine = engine
+
+AsyncSessionLocal = async_sessionmaker(bind= engine, expire_on_commit=False, class_=AsyncSession)
+ReadSessionLocal = async_sessionmaker(bind=read_engine, expire_on_commit=False, class_=AsyncSession)
+ScanSessionLocal = async_sessionmaker(bind=scan_engine, expire_on_commit=False, class_=AsyncSession)
@@ -1,22 +1,71 @@
+import os
+from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional
+from typing import NamedTuple, Optional, Union
 from jose import JWTError, jwt
 
-from .database import AsyncSessionLocal
+from .database import AsyncSessionLocal, ReadSessionLocal, engine, read_engine
+from .cache import user_cache, DELETED_USER
 from . import crud, models, jwt_utils
 
+load_dotenv()
+
+# "database" loads the user row for every authenticated request,
+# "stateless" trusts the `sub` claim of a valid token.
+AUTH_MODE = os.getenv("AUTH_MODE", "database")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/login", auto_error=False)
 
+
+class Principal(NamedTuple):
+    id: int
+
+
+class LazySession:
+    """Stands in for an AsyncSession and only creates it when the request first uses it.
+
+    Redirects served from a cache with clicks counted in memory, and 404s answered by the
+    negative cache or Bloom filter, then skip creating and closing sessions they never
+    use. Connections are checked out later still, by the session's first statement.
+    """
+
+    def __init__(self, session_factory):
+        self._session_factory = session_factory
+        self._session: Optional[AsyncSession] = None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = self._session_factory()
+        return getattr(self._session, name)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._session is not None:
+            await self._session.__aexit__(*exc_info)
+
+
 async def get_db():
-    async with AsyncSessionLocal() as session:
+    async with LazySession(AsyncSessionLocal) as session:
         yield session
 
-async def get_current_user(
-    token: Optional[str] = Depends(oauth2_scheme), 
-    db: AsyncSession = Depends(get_db)
-) -> Optional[models.User]:
+async def get_read_db(db: AsyncSession = Depends(get_db)):
+    # Without a replica, reads share the request's primary session (and connection).
+    if read_engine is engine:
+        yield db
+        return
+
+    async with LazySession(ReadSessionLocal) as session:
+        yield session
+
+def get_token_user_id(token: Optional[str]) -> Optional[int]:
     if token is None:
         return None
 
@@ -30,16 +79,56 @@ async def get_current_user(
     except JWTError:
         return None
 
-    user = await crud.get_user_by_id(db, user_id=int(user_id))
+    return int(user_id)
+
+async def get_current_user(
+    token: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
+) -> Optional[models.User]:
+    user_id = get_token_user_id(token)
+    if user_id is None:
+        return None
+
+    if AUTH_MODE == "stateless":
+        return await crud.get_user_by_id_cached(db, user_id=user_id, read_db=read_db)
+
+    user = await crud.read_or_primary(read_db, db, crud.get_user_by_id, user_id)
     return user
 
-async def get_current_active_user(
-    current_user: Optional[models.User] = Depends(get_current_user),
-) -> models.User:
+async def get_current_principal(
+    token: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
+) -> Optional[Union[Principal, models.User]]:
+    if AUTH_MODE != "stateless":
+        return await get_current_user(token=token, db=db, read_db=read_db)
+
+    user_id = get_token_user_id(token)
+    if user_id is None or user_cache.get(user_id) is DELETED_USER:
+        return None
+
+    return Principal(id=user_id)
+
+def _require_authenticated(current_user):
     if current_user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_current_active_user(
+    current_user: Optional[models.User] = Depends(get_current_user),
+) -> models.User:
+    return _require_authenticated(current_user)
+
+async def get_token_subject(token: Optional[str] = Depends(oauth2_scheme)) -> int:
+    """The user ID a valid token was issued to, even if that account has since been deleted."""
+    return _require_authenticated(get_token_user_id(token))
+
+async def get_current_active_principal(
+    current_principal: Optional[Union[Principal, models.User]] = Depends(get_current_principal),
+) -> Union[Principal, models.User]:
+    return _require_authenticated(current_principal)
@@ -0,0 +1,151 @@
+"""Click event log.
+
+With CLICK_EVENTS_ENABLED, every redirect puts a ClickEvent on an in-memory queue.
+A background writer drains the queue every CLICK_EVENTS_FLUSH_INTERVAL_SECONDS (or as
+soon as CLICK_EVENTS_BATCH_SIZE events are waiting). It bulk-inserts the raw events into
+`click_events` and adds per-hour and per-day counts to `click_rollups` in the same
+transaction. The stats endpoint's time-series mode reads only the rollups.
+
+When the queue is full, new events are dropped and counted rather than slowing down
+redirects.
+"""
+import asyncio
+import datetime
+import os
+from collections import Counter
+from typing import List, NamedTuple, Optional
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, metrics
+from .database import AsyncSessionLocal
+
+load_dotenv()
+
+CLICK_EVENTS_ENABLED = os.getenv("CLICK_EVENTS_ENABLED", "false").lower() == "true"
+CLICK_EVENTS_QUEUE_SIZE = int(os.getenv("CLICK_EVENTS_QUEUE_SIZE", "100000"))
+CLICK_EVENTS_BATCH_SIZE = int(os.getenv("CLICK_EVENTS_BATCH_SIZE", "5000"))
+CLICK_EVENTS_FLUSH_INTERVAL_SECONDS = float(os.getenv("CLICK_EVENTS_FLUSH_INTERVAL_SECONDS", "1"))
+
+GRANULARITIES = ("hour", "day")
+
+
+class ClickEvent(NamedTuple):
+    occurred_at: datetime.datetime
+    short_code: str
+    referrer: Optional[str]
+    user_agent: Optional[str]
+
+
+class ClickEventQueue:
+    def __init__(self, max_size: int, batch_size: int):
+        self.batch_size = batch_size
+        self.flush_requested = asyncio.Event()
+        self.dropped = 0
+        self._queue: "asyncio.Queue[ClickEvent]" = asyncio.Queue(maxsize=max_size)
+
+    def put(self, event: ClickEvent):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return
+
+        if self._queue.qsize() >= self.batch_size:
+            self.flush_requested.set()
+
+    def drain(self, limit: int) -> List[ClickEvent]:
+        events = []
+        while len(events) < limit:
+            try:
+                events.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return events
+
+    def requeue(self, events: List[ClickEvent]):
+        for event in events:
+            self.put(event)
+
+    def __len__(self):
+        return self._queue.qsize()
+
+
+click_event_queue = ClickEventQueue(
+    max_size=CLICK_EVENTS_QUEUE_SIZE, batch_size=CLICK_EVENTS_BATCH_SIZE
+)
+
+metrics.add_collected(
+    "click_events_queued", "Click events waiting to be written.",
+    lambda: len(click_event_queue)
+)
+metrics.add_collected(
+    "click_events_dropped_total", "Click events dropped because the queue was full.",
+    lambda: click_event_queue.dropped, metric_type="counter"
+)
+
+
+def record_click_event(short_code: str, referrer: Optional[str], user_agent: Optional[str]):
+    click_event_queue.put(
+        ClickEvent(
+            occurred_at=datetime.datetime.now(datetime.timezone.utc),
+            short_code=short_code,
+            referrer=referrer,
+            user_agent=user_agent,
+        )
+    )
+
+
+def bucket_start(moment: datetime.datetime, granularity: str) -> datetime.datetime:
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        moment = moment.replace(hour=0)
+    return moment
+
+
+_known_partitions = set()
+
+async def ensure_partitions(db: AsyncSession, events: List[ClickEvent]) -> set:
+    if db.bind.dialect.name != "postgresql":
+        return set()
+
+    created = set()
+    for month_start in {event.occurred_at.date().replace(day=1) for event in events}:
+        if month_start in _known_partitions:
+            continue
+
+        next_month = (month_start + datetime.timedelta(days=32)).replace(day=1)
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS click_events_y{month_start:%Y}m{month_start:%m} "
+            f"PARTITION OF click_events "
+            f"FOR VALUES FROM ('{month_start.isoformat()} 00:00:00+00') TO ('{next_month.isoformat()} 00:00:00+00')"
+        ))
+        created.add(month_start)
+    return created
+
+
+async def write_click_events(events: List[ClickEvent]):
+    rollups = Counter(
+        (event.short_code, granularity, bucket_start(event.occurred_at, granularity))
+        for event in events
+        for granularity in GRANULARITIES
+    )
+
+    async with AsyncSessionLocal() as db:
+        created_partitions = await ensure_partitions(db, events)
+        await crud.insert_click_events(db, [event._asdict() for event in events])
+        await crud.add_click_rollups(db, rollups)
+        await db.commit()
+
+    _known_partitions.update(created_partitions)
+
+
+async def flush_click_events():
+    while len(click_event_queue):
+        events = click_event_queue.drain(CLICK_EVENTS_BATCH_SIZE)
+        try:
+            await write_click_events(events)
+        except BaseException:
+            click_event_queue.requeue(events)
+            raise
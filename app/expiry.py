@@ -0,0 +1,36 @@
+"""Deletes expired links.
+
+Every LINK_SWEEP_INTERVAL_SECONDS the sweeper deletes links whose `expires_at` has
+passed, at most LINK_SWEEP_BATCH_SIZE rows per transaction. Each batch picks its rows
+through the `expires_at` index and commits on its own, so no lock is held for long and
+autovacuum can keep up between batches. Deleted codes are dropped from every cache.
+"""
+import asyncio
+import datetime
+import os
+from dotenv import load_dotenv
+
+from . import crud
+from .database import AsyncSessionLocal
+
+load_dotenv()
+
+LINK_SWEEP_ENABLED = os.getenv("LINK_SWEEP_ENABLED", "true").lower() == "true"
+LINK_SWEEP_INTERVAL_SECONDS = float(os.getenv("LINK_SWEEP_INTERVAL_SECONDS", "60"))
+LINK_SWEEP_BATCH_SIZE = int(os.getenv("LINK_SWEEP_BATCH_SIZE", "1000"))
+
+
+async def sweep_expired_links() -> int:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    deleted = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            short_codes = await crud.delete_expired_links(db, now, LINK_SWEEP_BATCH_SIZE)
+            await db.commit()
+
+        await crud.links_removed(short_codes)
+        deleted += len(short_codes)
+        if len(short_codes) < LINK_SWEEP_BATCH_SIZE:
+            return deleted
+        # Let redirects run between batches.
+        await asyncio.sleep(0)
@@ -1,10 +1,30 @@
-from fastapi import FastAPI
-from .database import engine
+from typing import Literal, Optional
+from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from .database import engine, read_engine, scan_engine, is_sqlite_file
 from .models import Base
 from .routers import links, users
+from . import accounts, bloom, clicks, events, expiry, metrics, profiler, shared_cache, shared_index, tasks
+from .allocator import code_allocator
 
 app = FastAPI()
 
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engine(engine, "primary")
+    if read_engine is not engine:
+        metrics.instrument_engine(read_engine, "read")
+    if scan_engine is not engine and scan_engine is not read_engine:
+        metrics.instrument_engine(scan_engine, "scan")
+
+if profiler.PROFILER_ENABLED:
+    app.add_middleware(profiler.ProfilerMiddleware)
+    profiler.instrument_engine(engine)
+    if read_engine is not engine:
+        profiler.instrument_engine(read_engine)
+    if scan_engine is not engine and scan_engine is not read_engine:
+        profiler.instrument_engine(scan_engine)
+
 app.include_router(
     users.router,
     prefix="/users",
@@ -21,6 +41,95 @@ async def on_startup():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+    # A real replica gets its schema from the primary; only a separate SQLite file used
+    # as a stand-in replica needs its own tables. Read-only connections can't create any.
+    if read_engine is not engine and read_engine is not scan_engine and is_sqlite_file(read_engine.url):
+        async with read_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    if shared_index.SHARED_INDEX_PATH:
+        await shared_index.open_index()
+        tasks.start_periodic(shared_index.refresh_index, shared_index.SHARED_INDEX_CHECK_SECONDS)
+
+    if profiler.PROFILER_ENABLED:
+        profiler.sampler.start()
+
+    if bloom.BLOOM_FILTER_ENABLED:
+        await bloom.rebuild_code_filter()
+        tasks.start_periodic(bloom.refresh_code_filter, bloom.BLOOM_FILTER_REFRESH_SECONDS)
+        tasks.start_periodic(bloom.rebuild_code_filter, bloom.BLOOM_FILTER_REBUILD_SECONDS)
+
+    if shared_cache.shared_cache is not None:
+        tasks.start_forever(shared_cache.shared_cache.listen)
+        if shared_cache.SHARED_CACHE_CLICKS:
+            tasks.start_periodic(clicks.drain_shared_clicks, shared_cache.SHARED_CACHE_CLICK_DRAIN_SECONDS)
+
+    # Also resumes purges interrupted by a restart.
+    accounts.purge_requested.set()
+    tasks.start_periodic(
+        accounts.purge_deleted_accounts,
+        accounts.ACCOUNT_PURGE_INTERVAL_SECONDS,
+        wake_event=accounts.purge_requested
+    )
+
+    if expiry.LINK_SWEEP_ENABLED:
+        tasks.start_periodic(expiry.sweep_expired_links, expiry.LINK_SWEEP_INTERVAL_SECONDS)
+
+    if clicks.CLICK_AGGREGATION:
+        tasks.start_periodic(
+            clicks.flush_clicks,
+            clicks.CLICK_FLUSH_INTERVAL_SECONDS,
+            wake_event=clicks.click_buffer.flush_requested
+        )
+
+    if events.CLICK_EVENTS_ENABLED:
+        tasks.start_periodic(
+            events.flush_click_events,
+            events.CLICK_EVENTS_FLUSH_INTERVAL_SECONDS,
+            wake_event=events.click_event_queue.flush_requested
+        )
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await tasks.stop_all()
+
+    if profiler.PROFILER_ENABLED:
+        profiler.sampler.stop()
+
+    if clicks.CLICK_AGGREGATION:
+        await clicks.flush_clicks()
+
+    if events.CLICK_EVENTS_ENABLED:
+        await events.flush_click_events()
+
+    if shared_cache.SHARED_CACHE_CLICKS:
+        await clicks.drain_shared_clicks()
+
+    if shared_cache.shared_cache is not None:
+        await shared_cache.shared_cache.close()
+
+    shared_index.close_index()
+    await code_allocator.close()
+
 @app.get("/")
 async def root():
-    return {"message": "URL Shortener API is running."}
\ No newline at end of file
+    return {"message": "URL Shortener API is running."}
+
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+if profiler.PROFILER_ENABLED and profiler.PROFILER_ADMIN_TOKEN:
+    @app.get("/admin/profiles", include_in_schema=False, dependencies=[Depends(profiler.require_admin_token)])
+    async def get_profiles(
+        profile_id: Optional[int] = Query(None, alias="id"),
+        profile_format: Literal["json", "collapsed"] = Query("json", alias="format"),
+    ):
+        selected = profiler.find_profiles(profile_id)
+        if profile_id is not None and not selected:
+            raise HTTPException(status_code=404, detail="Profile not found!")
+
+        if profile_format == "collapsed":
+            return PlainTextResponse(profiler.render_collapsed(selected))
+        return [profile.summary() for profile in reversed(selected)]
@@ -0,0 +1,243 @@
+"""Prometheus metrics for the running worker.
+
+Counters and histograms are plain dicts updated from the event loop thread (SQLAlchemy
+engine and pool events run there too), so recording a sample takes no locks. Every worker
+process keeps and exposes its own metrics.
+"""
+import contextvars
+import functools
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: LabelValues = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, label_values: LabelValues = (), amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: LabelValues = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # Per label set: [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, label_values: LabelValues, value: float):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for label_values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                labels = _format_labels(self.label_names + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CollectedMetric:
+    """Counter or gauge whose values are read from `collect` at scrape time."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Union[float, Dict[LabelValues, float]]],
+        label_names: LabelValues = (),
+        metric_type: str = "gauge",
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.label_names = label_names
+        self.metric_type = metric_type
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+_registry: list = []
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+def add_collected(
+    name: str, documentation: str, collect, label_names: LabelValues = (), metric_type: str = "gauge"
+):
+    return register(CollectedMetric(name, documentation, collect, label_names, metric_type))
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_LATENCY = register(Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route and status code.",
+    ("method", "route", "status"),
+))
+QUERY_LATENCY = register(Histogram(
+    "db_query_duration_seconds",
+    "Database statement latency by the crud function that issued it.",
+    ("operation",),
+))
+POOL_CHECKOUT_WAIT = register(Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled database connection.",
+    ("pool",),
+))
+REDIRECT_OUTCOMES = register(Counter(
+    "redirect_outcomes_total",
+    "Short-link resolutions by outcome (cache_hit, shared_index_hit, shared_cache_hit, db_hit, not_found, invalid, negative_cache_hit, filtered, expired).",
+    ("outcome",),
+))
+
+_pools: Dict[str, object] = {}
+add_collected(
+    "db_pool_connections_in_use",
+    "Connections currently checked out of each pool.",
+    lambda: {(name,): pool.checkedout() for name, pool in _pools.items() if hasattr(pool, "checkedout")},
+    ("pool",),
+)
+
+current_operation: contextvars.ContextVar[str] = contextvars.ContextVar("current_operation", default="unlabeled")
+
+
+def track_queries(func):
+    """Label the statements a crud coroutine runs with its name in db_query_duration_seconds."""
+    if not METRICS_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_operation.set(func.__name__)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            current_operation.reset(token)
+
+    return wrapper
+
+
+def record_redirect(outcome: str):
+    if METRICS_ENABLED:
+        REDIRECT_OUTCOMES.inc((outcome,))
+
+
+def instrument_engine(async_engine, pool_name: str):
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        QUERY_LATENCY.observe((current_operation.get(),), time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+    # Pool events fire only after a connection was handed out, so time the checkout itself.
+    pool = sync_engine.pool
+    do_get = pool._do_get
+
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe((pool_name,), time.perf_counter() - started)
+
+    pool._do_get = timed_do_get
+    _pools[pool_name] = pool
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.observe(
+                (scope["method"], route.path if route is not None else "unmatched", str(status_code)),
+                time.perf_counter() - started,
+            )
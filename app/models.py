@@ -2,7 +2,7 @@ import datetime
 from . import utils
 
 from typing import List, Optional
-from sqlalchemy import Integer, String, TEXT, TIMESTAMP, func, ForeignKey
+from sqlalchemy import Integer, BigInteger, String, TEXT, LargeBinary, TIMESTAMP, func, text, ForeignKey, Sequence, Table, Column, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -10,29 +10,88 @@ class Base(DeclarativeBase):
     pass
 
 
+short_code_block_seq = Sequence("short_code_block_seq", metadata=Base.metadata)
+
+# Stands in for short_code_block_seq on SQLite, which has no sequences.
+short_code_block_counter = Table(
+    "short_code_block_counter",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("last_block", BigInteger, nullable=False),
+)
+
 
 class User(Base):
     __tablename__ = 'users_table'
+    __table_args__ = (
+        # Only accounts waiting for accounts.purge_deleted_accounts are indexed.
+        Index(
+            "ix_users_pending_deletion", "id",
+            postgresql_where=text("deleted_at IS NOT NULL"), sqlite_where=text("deleted_at IS NOT NULL")
+        ),
+        # On SQLite, never hand out the ID of a deleted row again.
+        {"sqlite_autoincrement": True},
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     username: Mapped[str] = mapped_column(String(50), nullable=False)
     email: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
     password: Mapped[str] = mapped_column(String(100), nullable=False)
+    # Set when the account is deleted; the row goes once its links have been purged.
+    deleted_at: Mapped[Optional[datetime.datetime]] = mapped_column(TIMESTAMP(timezone=True))
 
 
-    urls: Mapped[List['URL']] = relationship(back_populates="owner")
+    # Links are detached in bulk by the purge, never loaded to delete a user.
+    urls: Mapped[List['URL']] = relationship(back_populates="owner", passive_deletes=True)
 
     
 class URL(Base):
     __tablename__ = "urls_table"
+    __table_args__ = (
+        Index("ix_urls_owned_by_url_id", "owned_by", "url_id"),
+        Index("ix_urls_owned_by_url_hash", "owned_by", "url_hash"),
+        Index("ix_urls_owned_by_clicks", "owned_by", "clicks", "url_id"),
+        Index("ix_urls_expires_at", "expires_at"),
+        # The Bloom filter refresh and cursors rely on url_id only growing.
+        {"sqlite_autoincrement": True},
+    )
 
     url_id: Mapped[int] = mapped_column(primary_key=True)
     target_url: Mapped[str] = mapped_column(TEXT, nullable=False)
+    # blake2b-128 digest of the normalized target_url, used to find duplicate links.
+    url_hash: Mapped[Optional[bytes]] = mapped_column(LargeBinary(16))
 
     short_code: Mapped[str] = mapped_column(String(8), unique=True, index=True)
     clicks: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    redirect_type: Mapped[str] = mapped_column(String(10), default="temporary", server_default="temporary", nullable=False)
+    # Seconds browsers and CDNs may cache a permanent redirect; NULL for temporary ones.
+    cache_max_age: Mapped[Optional[int]] = mapped_column(Integer)
     created_at: Mapped[datetime.datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    # NULL for links that never expire; expired rows are deleted by the sweeper in expiry.py.
+    expires_at: Mapped[Optional[datetime.datetime]] = mapped_column(TIMESTAMP(timezone=True))
 
     owned_by: Mapped[Optional[int]] = mapped_column(ForeignKey('users_table.id'))
 
     owner: Mapped[Optional['User']] = relationship(back_populates="urls")
 
+
+# Append-only, range-partitioned by month on PostgreSQL; partitions are created on demand by the event writer.
+click_events = Table(
+    "click_events",
+    Base.metadata,
+    Column("occurred_at", TIMESTAMP(timezone=True), nullable=False),
+    Column("short_code", String(8), nullable=False),
+    Column("referrer", TEXT),
+    Column("user_agent", TEXT),
+    Index("ix_click_events_short_code_occurred_at", "short_code", "occurred_at"),
+    postgresql_partition_by="RANGE (occurred_at)",
+)
+
+
+class ClickRollup(Base):
+    __tablename__ = "click_rollups"
+
+    short_code: Mapped[str] = mapped_column(String(8), primary_key=True)
+    granularity: Mapped[str] = mapped_column(String(8), primary_key=True)
+    bucket_start: Mapped[datetime.datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    clicks: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
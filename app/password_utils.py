@@ -1,9 +1,85 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from . import metrics
 
-def hash_password(password: str):
-    return pwd_context.hash(password[:72])
+load_dotenv()
 
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class BoundedExecutor:
+    """Runs blocking calls on a thread pool, rejecting work once `max_pending` calls are waiting or running."""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.completed = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy, please try again shortly.",
+                    headers={"Retry-After": "1"},
+                )
+            self.pending += 1
+
+        # A call stays pending until its thread is done with it, even if the
+        # awaiting request is cancelled first (e.g. the client disconnected).
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(self._finished)
+        return await asyncio.wrap_future(future)
+
+    def _finished(self, future):
+        with self._lock:
+            self.pending -= 1
+            if not future.cancelled():
+                self.completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "completed": self.completed,
+        }
+
+
+hashing_executor = BoundedExecutor(workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING)
+
+metrics.add_collected(
+    "password_hash_in_flight", "Password hash/verify calls running on the thread pool.",
+    lambda: hashing_executor.stats()["in_flight"]
+)
+metrics.add_collected(
+    "password_hash_queued", "Password hash/verify calls waiting for a free thread.",
+    lambda: hashing_executor.stats()["queued"]
+)
+metrics.add_collected(
+    "password_hash_rejected_total", "Password hash/verify calls rejected with 503.",
+    lambda: hashing_executor.rejected, metric_type="counter"
+)
+
+async def hash_password(password: str):
+    return await hashing_executor.run(pwd_context.hash, password[:72])
+
+async def verify_password(plain_password: str, hashed_password: str):
+    return await hashing_executor.run(pwd_context.verify, plain_password, hashed_password)
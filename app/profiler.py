@@ -0,0 +1,237 @@
+"""Sampling profiler for slow and randomly chosen requests.
+
+With PROFILER_ENABLED=true, a background thread samples the event loop thread's call
+stack every PROFILER_INTERVAL_MS and charges each sample to the request whose task was
+running at that moment. Time a request spends in SQL statements is added up from engine
+events. When the request ends, its profile is kept if it took at least
+PROFILER_SLOW_REQUEST_MS or was picked at random with probability PROFILER_SAMPLE_RATE;
+other profiles are dropped. The last PROFILER_MAX_PROFILES profiles are kept in memory.
+
+Each profile has the request's wall time, its database time, and its CPU time on the
+event loop, estimated from the samples it got. Whatever is left is time spent waiting
+on something else, e.g. a pooled connection or a password hash on the hashing threads.
+Stacks are in the collapsed format ("frame;frame;frame count") that flamegraph.pl,
+speedscope and similar tools read.
+
+With PROFILER_ADMIN_TOKEN set, GET /admin/profiles returns the profiles to requests
+that send the token in the X-Admin-Token header.
+
+When the profiler is disabled, none of this is installed: no middleware, no engine
+events and no sampling thread.
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+from fastapi import Header, HTTPException, status
+from sqlalchemy import event
+
+load_dotenv()
+
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0.01"))
+PROFILER_SLOW_REQUEST_MS = float(os.getenv("PROFILER_SLOW_REQUEST_MS", "500"))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_MAX_PROFILES = int(os.getenv("PROFILER_MAX_PROFILES", "50"))
+# The admin endpoint is only served when this is set.
+PROFILER_ADMIN_TOKEN = os.getenv("PROFILER_ADMIN_TOKEN")
+
+# Frames from here out are the server and event loop, the same in every sample.
+LOOP_CALLBACK_CODE = asyncio.events.Handle._run.__code__
+
+
+class Profile:
+    def __init__(self, profile_id: int, method: str, path: str):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status_code = 500
+        self.started_at = time.time()
+        self.wall_seconds = 0.0
+        self.db_seconds = 0.0
+        self.db_statements = 0
+        self.samples = 0
+        self.reason: Optional[str] = None
+        # Written by the sampling thread only, read once the request is over.
+        self.stacks: Counter = Counter()
+
+    def summary(self) -> dict:
+        cpu_seconds = min(self.samples * PROFILER_INTERVAL_MS / 1000, self.wall_seconds)
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status_code,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "wall_ms": self.wall_seconds * 1000,
+            "cpu_ms": cpu_seconds * 1000,
+            "db_ms": self.db_seconds * 1000,
+            "wait_ms": max(self.wall_seconds - cpu_seconds - self.db_seconds, 0) * 1000,
+            "db_statements": self.db_statements,
+            "samples": self.samples,
+            "stacks": render_collapsed([self]),
+        }
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    # co_qualname is new in Python 3.11.
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse_stack(frame) -> str:
+    labels = []
+    while frame is not None and frame.f_code is not LOOP_CALLBACK_CODE:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+class Sampler:
+    """Samples the event loop thread's stack on behalf of the requests being profiled."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles: Dict[asyncio.Task, Profile] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start sampling the running loop's thread; call from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def track(self, task: asyncio.Task, profile: Profile):
+        self._profiles[task] = profile
+
+    def untrack(self, task: asyncio.Task):
+        self._profiles.pop(task, None)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if self._profiles:
+                self.sample()
+
+    def sample(self):
+        task = asyncio.current_task(self._loop)
+        profile = self._profiles.get(task)
+        if profile is None:
+            return
+        frame = sys._current_frames().get(self._loop_thread_id)
+        # The loop may have switched tasks while the frames were read; drop the sample then.
+        if frame is None or asyncio.current_task(self._loop) is not task:
+            return
+        profile.stacks[collapse_stack(frame)] += 1
+        profile.samples += 1
+
+
+sampler = Sampler(interval=PROFILER_INTERVAL_MS / 1000)
+profiles: Deque[Profile] = deque(maxlen=PROFILER_MAX_PROFILES)
+_profile_ids = itertools.count(1)
+
+current_profile: contextvars.ContextVar[Optional[Profile]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+def render_collapsed(selected: Iterable[Profile]) -> str:
+    """Merge the stacks of `selected` into collapsed-stack lines."""
+    stacks: Counter = Counter()
+    for profile in selected:
+        stacks.update(profile.stacks)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def instrument_engine(async_engine):
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_profile.get() is not None:
+            conn.info.setdefault("profile_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = current_profile.get()
+        if profile is not None and conn.info.get("profile_query_started"):
+            profile.db_seconds += time.perf_counter() - conn.info["profile_query_started"].pop()
+            profile.db_statements += 1
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("profile_query_started"):
+            connection.info["profile_query_started"].pop()
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(next(_profile_ids), scope["method"], scope["path"])
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+            await send(message)
+
+        task = asyncio.current_task()
+        sampler.track(task, profile)
+        token = current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            profile.wall_seconds = time.perf_counter() - started
+            current_profile.reset(token)
+            sampler.untrack(task)
+
+            if profile.wall_seconds * 1000 >= PROFILER_SLOW_REQUEST_MS:
+                profile.reason = "slow"
+            elif random.random() < PROFILER_SAMPLE_RATE:
+                profile.reason = "sampled"
+            if profile.reason is not None:
+                route = scope.get("route")
+                profile.route = route.path if route is not None else None
+                profiles.append(profile)
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, PROFILER_ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token.")
+
+
+def find_profiles(profile_id: Optional[int] = None) -> List[Profile]:
+    selected = list(profiles)
+    if profile_id is not None:
+        selected = [profile for profile in selected if profile.id == profile_id]
+    return selected
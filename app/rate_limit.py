@@ -0,0 +1,171 @@
+"""Token-bucket rate limits for the expensive write and login routes.
+
+With RATE_LIMIT_ENABLED=true, each limited route gets a bucket per client: per user ID
+when the request carries a valid token, per client IP otherwise. Limits are set per
+route as RATE_LIMIT_<ROUTE>="<requests>/<seconds>", e.g. RATE_LIMIT_LOGIN=10/60 allows
+bursts of 10 logins and refills one token every 6 seconds; an empty value or 0 turns
+the route's limit off.
+
+Buckets are refilled lazily when they are next used, so a check is O(1). A bucket left
+alone long enough to refill completely holds no state worth keeping and is evicted.
+Buckets that are still refilling are never evicted, since that would hand their client a
+full bucket. When RATE_LIMIT_MAX_KEYS such buckets are held, further clients share one
+overflow bucket per route until room frees up.
+The check runs as a route dependency ahead of the session and user lookups, so a
+limited request is rejected with 429 and Retry-After before any database or password
+hashing work.
+
+The in-memory backend limits each worker separately. Anything with an async
+`take(key, capacity, refill_per_second)` can replace it to share limits between workers.
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, Request, status
+
+from . import metrics
+from .dependencies import oauth2_scheme, get_token_user_id
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+DEFAULT_LIMITS = {
+    "login": "10/60",
+    "signup": "5/60",
+    "create_link": "60/60",
+    "create_links_batch": "10/60",
+}
+
+RATE_LIMIT_REJECTED = metrics.register(metrics.Counter(
+    "rate_limit_rejected_total",
+    "Requests rejected with 429 by route.",
+    ("route",),
+))
+
+
+def parse_limit(value: str) -> Optional[Tuple[int, float]]:
+    """Parse "<requests>/<seconds>" into (capacity, seconds); None means unlimited."""
+    value = value.strip()
+    if not value or value == "0":
+        return None
+    requests, _, seconds = value.partition("/")
+    capacity, period = int(requests), float(seconds or "1")
+    if capacity <= 0 or period <= 0:
+        return None
+    return capacity, period
+
+
+OVERFLOW_CLIENT = "overflow"
+
+
+class MemoryBackend:
+    """Token buckets for one worker, least recently used first.
+
+    Keys are "<route>:<client>"; the route part picks the overflow bucket.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # key -> (tokens, updated_at, full_at)
+        self._buckets: "OrderedDict[str, tuple[float, float, float]]" = OrderedDict()
+        self.evictions = 0
+        self.overflows = 0
+
+    async def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        """Take a token; returns 0 if one was available, else the seconds until one is."""
+        now = time.monotonic()
+        self._evict(now)
+
+        bucket = self._buckets.pop(key, None)
+        if bucket is None and not self._make_room(now):
+            key = f"{key.partition(':')[0]}:{OVERFLOW_CLIENT}"
+            bucket = self._buckets.pop(key, None)
+            self.overflows += 1
+        if bucket is None:
+            tokens = float(capacity)
+        else:
+            tokens, updated_at, _ = bucket
+            tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / refill_per_second
+
+        self._buckets[key] = (tokens, now, now + (capacity - tokens) / refill_per_second)
+        return retry_after
+
+    def _evict(self, now: float):
+        # Refilled buckets are indistinguishable from new ones, so dropping them is free.
+        # Buckets are kept in use order, so this usually stops at the first entry.
+        while self._buckets:
+            key, (_, _, full_at) = next(iter(self._buckets.items()))
+            if full_at > now:
+                break
+            del self._buckets[key]
+            self.evictions += 1
+
+    def _make_room(self, now: float) -> bool:
+        """Evict refilled buckets in LRU order until a new one fits; False if none can go."""
+        # Routes refill at different rates, so a refilled bucket can sit behind one that
+        # is still refilling. Only a new client at capacity pays for this walk.
+        stale = []
+        for key, (_, _, full_at) in self._buckets.items():
+            if len(self._buckets) - len(stale) < self.max_keys:
+                break
+            if full_at <= now:
+                stale.append(key)
+        for key in stale:
+            del self._buckets[key]
+        self.evictions += len(stale)
+        return len(self._buckets) < self.max_keys
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+limiter_backend = MemoryBackend(max_keys=RATE_LIMIT_MAX_KEYS)
+
+metrics.add_collected(
+    "rate_limit_keys", "Clients with a rate limit bucket on this worker.",
+    lambda: len(limiter_backend)
+)
+metrics.add_collected(
+    "rate_limit_overflow_total", "Requests counted in a route's shared overflow bucket.",
+    lambda: limiter_backend.overflows, metric_type="counter"
+)
+
+
+class RateLimit:
+    """Route dependency enforcing the RATE_LIMIT_<ROUTE> limit."""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.limit = parse_limit(os.getenv(f"RATE_LIMIT_{route.upper()}", DEFAULT_LIMITS.get(route, "")))
+
+    async def __call__(self, request: Request, token: Optional[str] = Depends(oauth2_scheme)):
+        if not RATE_LIMIT_ENABLED or self.limit is None:
+            return
+
+        # The token is only decoded, not checked against the database.
+        user_id = get_token_user_id(token)
+        if user_id is not None:
+            client = f"user:{user_id}"
+        else:
+            client = f"ip:{request.client.host if request.client else 'unknown'}"
+
+        capacity, period = self.limit
+        retry_after = await limiter_backend.take(f"{self.route}:{client}", capacity, capacity / period)
+        if retry_after > 0:
+            RATE_LIMIT_REJECTED.inc((self.route,))
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please try again later.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
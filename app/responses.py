@@ -0,0 +1,43 @@
+"""Fast path for JSON responses built from trusted values.
+
+By default FastAPI validates whatever a route returns against its `response_model` and
+encodes it with the standard library's JSON encoder. With FAST_RESPONSES=true, the link
+and user routes instead return their values, read from the database or produced by the
+app, as-is in an orjson-encoded response. Routes keep their `response_model`, so the
+OpenAPI schema doesn't change.
+"""
+import os
+from typing import Any
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse
+
+load_dotenv()
+
+FAST_RESPONSES = os.getenv("FAST_RESPONSES", "false").lower() == "true"
+
+if FAST_RESPONSES:
+    try:
+        import orjson
+    except ImportError as exc:
+        raise RuntimeError("FAST_RESPONSES=true requires the orjson package") from exc
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        # UTC timestamps end in "Z", as they do when pydantic serializes them.
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+
+def respond(content: Any, status_code: int = 200) -> Any:
+    """Return `content` for FastAPI to validate, or send it straight away in fast mode.
+
+    `content` must already have the shape of the route's response_model.
+    """
+    if FAST_RESPONSES:
+        return FastJSONResponse(content, status_code=status_code)
+    return content
+
+
+def exclude_none(values: dict) -> dict:
+    """`values` without its None entries, as response_model_exclude_none would send it."""
+    return {key: value for key, value in values.items() if value is not None}
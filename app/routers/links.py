@@ -1,63 +1,235 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import RedirectResponse
+import csv
+import datetime
+import io
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import RedirectResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.status import HTTP_307_TEMPORARY_REDIRECT
-from typing import Optional
+from starlette.status import HTTP_307_TEMPORARY_REDIRECT, HTTP_308_PERMANENT_REDIRECT
+from typing import List, Literal, Optional
 
-from .. import crud, schemas, models
-from ..dependencies import get_db, get_current_user, get_current_active_user
+from .. import crud, schemas, clicks, events, shared_cache
+from ..responses import respond, exclude_none
+from ..database import ScanSessionLocal
+from ..dependencies import get_db, get_read_db, get_current_principal, get_current_active_principal, Principal
+from ..rate_limit import RateLimit
+from ..utils import as_utc
 
 router = APIRouter()
 
-@router.post("/", response_model=schemas.URLInfo)
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = ["id", "short_code", "short_url", "target_url", "clicks", "created_at"]
+
+def build_url_info(request: Request, db_url) -> dict:
+    """A link in the shape of schemas.URLInfo, validated by the route's response_model."""
+    base_url = str(request.base_url)
+    full_short_url = f"{base_url}links/{db_url.short_code}"
+
+    return {
+        "id": db_url.url_id,
+        "target_url": db_url.target_url,
+        "short_url": full_short_url,
+        "clicks": db_url.clicks,
+        "created_at": db_url.created_at,
+        "redirect_type": db_url.redirect_type,
+        "cache_max_age": db_url.cache_max_age,
+        "expires_at": db_url.expires_at
+    }
+
+def build_url_stats(db_url) -> dict:
+    """A link's fields of schemas.URLStats, without the click series."""
+    return {
+        "target_url": db_url.target_url,
+        "short_code": db_url.short_code,
+        "clicks": db_url.clicks,
+        "redirect_type": db_url.redirect_type,
+        "cache_max_age": db_url.cache_max_age,
+        "expires_at": db_url.expires_at,
+    }
+
+@router.post("/", response_model=schemas.URLInfo, dependencies=[Depends(RateLimit("create_link"))])
 async def create_short_url(
     url: schemas.URLCreate,
     request: Request,
     db: AsyncSession = Depends(get_db),
-    current_user: Optional[models.User] = Depends(get_current_user),
+    current_user: Optional[Principal] = Depends(get_current_principal),
 ):
     owner_id = None
     if current_user:
         owner_id = current_user.id
 
     db_url = await crud.create_db_url(
-        db, target_url=str(url.target_url), owner_id=owner_id
+        db,
+        target_url=str(url.target_url),
+        owner_id=owner_id,
+        redirect_type=url.redirect_type,
+        cache_max_age=url.cache_max_age,
+        expires_at=url.expires_at
     )
 
-    base_url = str(request.base_url)
-    full_short_url = f"{base_url}links/{db_url.short_code}"
+    return respond(build_url_info(request, db_url))
+
+@router.post(
+    "/batch",
+    response_model=List[schemas.URLInfo],
+    dependencies=[Depends(RateLimit("create_links_batch"))]
+)
+async def create_short_urls_batch(
+    urls: schemas.URLBatchCreate,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[Principal] = Depends(get_current_principal),
+):
+    if not urls:
+        return []
+
+    owner_id = None
+    if current_user:
+        owner_id = current_user.id
+
+    db_urls = await crud.create_db_urls_bulk(db, urls=urls, owner_id=owner_id)
+
+    return respond([build_url_info(request, db_url) for db_url in db_urls])
+
+@router.get("/mine", response_model=schemas.URLPage)
+async def list_my_urls(
+    request: Request,
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_principal)
+):
+    db_urls = await crud.get_urls_by_owner(
+        db, owner_id=current_user.id, after_id=cursor, limit=limit + 1
+    )
+
+    next_cursor = None
+    if len(db_urls) > limit:
+        db_urls = db_urls[:limit]
+        next_cursor = db_urls[-1].url_id
 
-    return schemas.URLInfo(
-        id=db_url.url_id,
-        target_url=db_url.target_url,
-        short_url=full_short_url,
-        clicks=db_url.clicks,
-        created_at=db_url.created_at
+    return respond({
+        "items": [build_url_info(request, db_url) for db_url in db_urls],
+        "next_cursor": next_cursor
+    })
+
+async def export_rows(owner_id: int, base_url: str, export_format: str):
+    if export_format == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+
+    async with ScanSessionLocal() as session:
+        async for rows in crud.stream_urls_by_owner(session, owner_id, chunk_size=EXPORT_CHUNK_SIZE):
+            records = [
+                [
+                    row.url_id,
+                    row.short_code,
+                    f"{base_url}links/{row.short_code}",
+                    row.target_url,
+                    row.clicks,
+                    row.created_at.isoformat(),
+                ]
+                for row in rows
+            ]
+
+            if export_format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(records)
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, record))) + "\n" for record in records)
+
+@router.get("/mine/export")
+async def export_my_urls(
+    request: Request,
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_active_principal)
+):
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+
+    # Sessions are only closed after the body has been sent. Hand back the connection the
+    # auth lookup used now, so an export holds just its scan connection while it streams.
+    await read_db.close()
+    await db.close()
+
+    return StreamingResponse(
+        export_rows(current_user.id, str(request.base_url), export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=links.{export_format}"}
     )
 
+# Declared before /{short_code}, which would match "top" too.
+@router.get("/top", response_model=List[schemas.URLInfo])
+async def list_my_top_urls(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    read_db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_active_principal)
+):
+    db_urls = await crud.get_top_urls_by_owner(read_db, owner_id=current_user.id, limit=limit)
+
+    return respond([build_url_info(request, db_url) for db_url in db_urls])
+
 @router.get("/{short_code}")
 async def redirect_to_original(
-    short_code: str, db: AsyncSession = Depends(get_db)
+    short_code: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
 ):
-    db_url = await crud.get_url_by_short_code_and_lock(db, short_code)
+    count_in_db = not shared_cache.SHARED_CACHE_CLICKS and not clicks.CLICK_AGGREGATION
+    cached_url = await crud.resolve_short_code(db, short_code, read_db=read_db, count_click=count_in_db)
 
-    if not db_url:
+    if not cached_url:
         raise HTTPException(status_code=404, detail="Link not found!")
 
-    await crud.increment_clicks(db, db_url)
-    await db.commit()
+    if count_in_db:
+        await db.commit()
+    elif shared_cache.SHARED_CACHE_CLICKS and await shared_cache.shared_cache.count_click(cached_url.url_id):
+        pass  # drained into the database by clicks.drain_shared_clicks
+    elif clicks.CLICK_AGGREGATION:
+        clicks.click_buffer.add(cached_url.url_id)
+    else:
+        await crud.increment_clicks_by_id(db, cached_url.url_id)
+        await db.commit()
+
+    if events.CLICK_EVENTS_ENABLED:
+        events.record_click_event(
+            short_code,
+            referrer=request.headers.get("referer"),
+            user_agent=request.headers.get("user-agent"),
+        )
+
+    if cached_url.redirect_type == "permanent":
+        return RedirectResponse(
+            url=cached_url.target_url,
+            status_code=HTTP_308_PERMANENT_REDIRECT,
+            headers={"Cache-Control": f"public, max-age={cached_url.cache_max_age}"}
+        )
 
     return RedirectResponse(
-        url=db_url.target_url, status_code=HTTP_307_TEMPORARY_REDIRECT
+        url=cached_url.target_url, status_code=HTTP_307_TEMPORARY_REDIRECT
     )
 
-@router.get("/clicks/{short_code}", response_model=schemas.URLStats)
+SERIES_DEFAULT_WINDOWS = {
+    "hour": datetime.timedelta(days=1),
+    "day": datetime.timedelta(days=30),
+}
+
+@router.get("/clicks/{short_code}", response_model=schemas.URLStats, response_model_exclude_none=True)
 async def get_num_clicks(
     short_code: str, 
+    interval: Optional[Literal["hour", "day"]] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    read_db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_active_principal)
 ):
-    db_url = await crud.get_url_by_short_code(db, short_code)
+    db_url = await crud.read_or_primary(read_db, db, crud.get_url_by_short_code, short_code)
 
     if not db_url:
         raise HTTPException(status_code=404, detail="Link not found!")
@@ -68,8 +240,37 @@ async def get_num_clicks(
             detail="You do not have permission to view stats for this link."
         )
 
-    return {
-        "target_url": db_url.target_url,
-        "short_code": db_url.short_code,
-        "clicks": db_url.clicks,
-    }
+    stats = build_url_stats(db_url)
+
+    if interval is not None:
+        end = as_utc(end) if end else datetime.datetime.now(datetime.timezone.utc)
+        start = as_utc(start) if start else end - SERIES_DEFAULT_WINDOWS[interval]
+        buckets = await crud.get_click_series(read_db, short_code, interval, start, end)
+        stats["series"] = [
+            {"bucket_start": bucket.bucket_start, "clicks": bucket.clicks} for bucket in buckets
+        ]
+
+    return respond(exclude_none(stats))
+
+@router.post("/clicks/batch", response_model=schemas.URLStatsBatch, response_model_exclude_none=True)
+async def get_num_clicks_batch(
+    body: schemas.URLStatsBatchRequest,
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_active_principal)
+):
+    short_codes = list(dict.fromkeys(body.short_codes))
+    db_urls = await crud.get_urls_by_owner_and_short_codes(read_db, current_user.id, short_codes)
+    found = {db_url.short_code: db_url for db_url in db_urls}
+
+    missing = [code for code in short_codes if code not in found]
+    if missing and read_db is not db:
+        # Same fallback as read_or_primary, for links the replica doesn't have yet.
+        await read_db.commit()
+        for db_url in await crud.get_urls_by_owner_and_short_codes(db, current_user.id, missing):
+            found[db_url.short_code] = db_url
+
+    return respond({
+        "items": [exclude_none(build_url_stats(found[code])) for code in short_codes if code in found],
+        "not_found": [code for code in short_codes if code not in found],
+    })
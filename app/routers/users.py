@@ -3,12 +3,19 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import models
 
-from .. import crud, schemas, password_utils, jwt_utils
-from ..dependencies import get_db, get_current_active_user
+from .. import accounts, crud, schemas, password_utils, jwt_utils
+from ..rate_limit import RateLimit
+from ..responses import respond
+from ..dependencies import get_db, get_read_db, get_current_active_user, get_token_subject
 
 router = APIRouter()
 
-@router.post("/signup", response_model=schemas.UserDisplay, status_code=status.HTTP_201_CREATED)
+@router.post(
+    "/signup",
+    response_model=schemas.UserDisplay,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(RateLimit("signup"))]
+)
 async def signup(user: schemas.UserAccount, db: AsyncSession = Depends(get_db)):
     db_user = await crud.get_user_by_email(db, email=user.email)
     if db_user:
@@ -17,17 +24,31 @@ async def signup(user: schemas.UserAccount, db: AsyncSession = Depends(get_db)):
             detail="An account with this email already exists."
         )
 
+    # Hand the connection back while the password hashes; on SQLite it's the only writer.
+    await db.commit()
+
     new_user = await crud.create_db_user(db, user=user)
     await db.commit()
     await db.refresh(new_user)
 
-    return new_user
+    return respond(
+        {"id": new_user.id, "username": new_user.username, "email": new_user.email},
+        status_code=status.HTTP_201_CREATED
+    )
 
-@router.post("/login", response_model=schemas.Token)
-async def login(login_info: schemas.UserLogin, db: AsyncSession = Depends(get_db)):
-    db_user = await crud.get_user_by_email(db, email=login_info.email)
+@router.post("/login", response_model=schemas.Token, dependencies=[Depends(RateLimit("login"))])
+async def login(
+    login_info: schemas.UserLogin,
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
+):
+    db_user = await crud.read_or_primary(read_db, db, crud.get_user_by_email, login_info.email)
 
-    if not db_user or not password_utils.verify_password(login_info.password, db_user.password):
+    if (
+        not db_user
+        or db_user.deleted_at is not None
+        or not await password_utils.verify_password(login_info.password, db_user.password)
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, 
             detail="Incorrect email or password",
@@ -38,12 +59,33 @@ async def login(login_info: schemas.UserLogin, db: AsyncSession = Depends(get_db
         data={"sub": str(db_user.id)}
     )
 
-    return {"access_token": access_token, "token_type": "bearer"}
+    return respond({"access_token": access_token, "token_type": "bearer"})
 
 @router.delete("/account/delete", status_code=status.HTTP_200_OK)
 async def delete_account(
     current_user: models.User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db)
 ):
+    user_id = current_user.id
     await crud.delete_db_user(db=db, user=current_user)
-    return {"detail": "Account deleted successfully"}
\ No newline at end of file
+    accounts.purge_requested.set()
+    # The account is locked out now; its links are handled in the background.
+    return {
+        "detail": "Account deleted successfully",
+        "job": {"id": user_id, "status": "pending", "links": accounts.ACCOUNT_DELETE_LINKS},
+    }
+
+@router.get("/account/delete/{job_id}", response_model=schemas.AccountDeletionJob)
+async def get_account_deletion(
+    job_id: int,
+    token_user_id: int = Depends(get_token_subject),
+    db: AsyncSession = Depends(get_db)
+):
+    # Only the token that requested the deletion can follow it; the account itself is gone.
+    job_status = None
+    if job_id == token_user_id:
+        job_status = await crud.get_account_deletion_status(db, job_id)
+    if job_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Deletion job not found.")
+
+    return respond({"id": job_id, "status": job_status, "links": accounts.ACCOUNT_DELETE_LINKS})
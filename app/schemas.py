@@ -1,9 +1,38 @@
 from pydantic import BaseModel, Field, HttpUrl, ConfigDict, EmailStr, model_validator
+from typing import Annotated, List, Literal, Optional
 import datetime
 
+from .utils import as_utc
+
+MAX_BATCH_SIZE = 10000
+MAX_STATS_BATCH_SIZE = 1000
+MAX_CACHE_MAX_AGE = 365 * 24 * 3600
+
+RedirectType = Literal["temporary", "permanent"]
+
 
 class URLCreate(BaseModel):
     target_url: HttpUrl
+    redirect_type: RedirectType = "temporary"
+    cache_max_age: Optional[int] = Field(None, ge=0, le=MAX_CACHE_MAX_AGE)
+    expires_at: Optional[datetime.datetime] = None
+
+    @model_validator(mode="after")
+    def max_age_only_for_permanent(self):
+        if self.cache_max_age is not None and self.redirect_type != "permanent":
+            raise ValueError("cache_max_age can only be set for permanent redirects.")
+        return self
+
+    @model_validator(mode="after")
+    def expiry_in_future(self):
+        if self.expires_at is not None:
+            self.expires_at = as_utc(self.expires_at)
+            if self.expires_at <= datetime.datetime.now(datetime.timezone.utc):
+                raise ValueError("expires_at must be in the future.")
+        return self
+
+
+URLBatchCreate = Annotated[List[URLCreate], Field(max_length=MAX_BATCH_SIZE)]
 
 
 class URLInfo(BaseModel):
@@ -12,9 +41,16 @@ class URLInfo(BaseModel):
     short_url: str
     clicks: int
     created_at: datetime.datetime
+    redirect_type: RedirectType = "temporary"
+    cache_max_age: Optional[int] = None
+    expires_at: Optional[datetime.datetime] = None
     
     model_config = ConfigDict(from_attributes=True)
 
+class URLPage(BaseModel):
+    items: List[URLInfo]
+    next_cursor: Optional[int] = None
+
 class UserAccount(BaseModel):
     username: str
     email: EmailStr
@@ -43,7 +79,29 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
+class AccountDeletionJob(BaseModel):
+    # The deleted account's user ID.
+    id: int
+    status: Literal["pending", "done"]
+    links: Literal["anonymize", "delete"]
+
+class ClickBucket(BaseModel):
+    bucket_start: datetime.datetime
+    clicks: int
+
 class URLStats(BaseModel):
     target_url: HttpUrl
     short_code: str
-    clicks: int
\ No newline at end of file
+    clicks: int
+    redirect_type: RedirectType = "temporary"
+    cache_max_age: Optional[int] = None
+    expires_at: Optional[datetime.datetime] = None
+    series: Optional[List[ClickBucket]] = None
+
+class URLStatsBatchRequest(BaseModel):
+    short_codes: List[str] = Field(..., min_length=1, max_length=MAX_STATS_BATCH_SIZE)
+
+class URLStatsBatch(BaseModel):
+    items: List[URLStats]
+    # Codes that don't exist or belong to someone else.
+    not_found: List[str]
@@ -0,0 +1,305 @@
+"""Cache and click counters shared by every node.
+
+With SHARED_CACHE_URL set, redirects that miss the worker's own caches look the code
+up in a shared key-value store before going to the database, and links read from the
+database are written back to it. Lookups issued by concurrent requests in the same
+event loop tick are sent as one pipelined multi-get.
+
+With SHARED_CACHE_CLICKS also enabled, redirects increment a shared per-link counter
+instead of touching the database. Every node periodically drains the counters into
+`urls_table.clicks`. A drain takes and clears the counters in one atomic step, so each
+increment is written exactly once, whichever node drains it.
+
+Removing links and deleting accounts are broadcast on a pub/sub channel. Every worker
+then drops its local copies (URL cache, shared index, user cache). New links are
+broadcast on the same channel, so every worker adds them to its Bloom filter and drops
+them from its negative cache instead of answering 404 until its next refresh. A removed link's key
+is overwritten with a marker for SHARED_CACHE_TTL_SECONDS rather than deleted. Links
+read from the database are only written to keys that don't exist yet, so a request
+that read the link just before it was removed can't put it back.
+
+Backends:
+    memory://            an in-process stand-in, for tests and single-process runs
+    redis://host:port/0  Redis (or anything speaking its protocol), needs the `redis` package
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional
+from dotenv import load_dotenv
+
+from . import bloom, jwt_utils, metrics, shared_index
+from .cache import negative_cache, url_cache, user_cache, CachedURL, DELETED_USER
+
+load_dotenv()
+
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL")
+SHARED_CACHE_PREFIX = os.getenv("SHARED_CACHE_PREFIX", "shorter-links:")
+SHARED_CACHE_TTL_SECONDS = int(os.getenv("SHARED_CACHE_TTL_SECONDS", "3600"))
+SHARED_CACHE_CLICKS = bool(SHARED_CACHE_URL) and os.getenv("SHARED_CACHE_CLICKS", "false").lower() == "true"
+SHARED_CACHE_CLICK_DRAIN_SECONDS = float(os.getenv("SHARED_CACHE_CLICK_DRAIN_SECONDS", "1"))
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_LOOKUPS = metrics.register(metrics.Counter(
+    "shared_cache_lookups_total",
+    "Shared cache short code lookups by result (hit, miss, error).",
+    ("result",),
+))
+SHARED_CACHE_BATCH_SIZE = metrics.register(metrics.Histogram(
+    "shared_cache_multiget_keys",
+    "Keys fetched per pipelined shared cache multi-get.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+))
+
+
+class MemoryBackend:
+    """In-process stand-in with the same semantics as RedisBackend."""
+
+    def __init__(self):
+        self._values: Dict[str, tuple] = {}
+        self._hashes: Dict[str, Dict[str, int]] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        now = time.monotonic()
+        values = []
+        for key in keys:
+            item = self._values.get(key)
+            if item is not None and item[0] < now:
+                del self._values[key]
+                item = None
+            values.append(item[1] if item is not None else None)
+        return values
+
+    async def set_many(self, items: Dict[str, str], ttl: int, only_new: bool = False):
+        now = time.monotonic()
+        for key, value in items.items():
+            item = self._values.get(key)
+            if only_new and item is not None and item[0] >= now:
+                continue
+            self._values[key] = (now + ttl, value)
+
+    async def hincrby_many(self, key: str, amounts: Dict[str, int]):
+        counters = self._hashes.setdefault(key, {})
+        for field, amount in amounts.items():
+            counters[field] = counters.get(field, 0) + amount
+
+    async def take_hash(self, key: str) -> Dict[str, int]:
+        return self._hashes.pop(key, {})
+
+    async def publish(self, channel: str, message: str):
+        for queue in self._subscribers.get(channel, []):
+            queue.put_nowait(message)
+
+    async def subscribe(self, channel: str) -> AsyncIterator[str]:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(channel, []).append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers[channel].remove(queue)
+
+    async def close(self):
+        pass
+
+
+# HGETALL and DEL in one step, so concurrent drains never see the same increments.
+TAKE_HASH_SCRIPT = """
+local values = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return values
+"""
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as exc:
+            raise RuntimeError("SHARED_CACHE_URL=redis://... requires the redis package") from exc
+        self._client = redis.from_url(url, decode_responses=True)
+        self._take_hash = self._client.register_script(TAKE_HASH_SCRIPT)
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        return await self._client.mget(keys)
+
+    async def set_many(self, items: Dict[str, str], ttl: int, only_new: bool = False):
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, value, ex=ttl, nx=only_new)
+            await pipe.execute()
+
+    async def hincrby_many(self, key: str, amounts: Dict[str, int]):
+        async with self._client.pipeline(transaction=False) as pipe:
+            for field, amount in amounts.items():
+                pipe.hincrby(key, field, amount)
+            await pipe.execute()
+
+    async def take_hash(self, key: str) -> Dict[str, int]:
+        values = await self._take_hash(keys=[key])
+        return {values[i]: int(values[i + 1]) for i in range(0, len(values), 2)}
+
+    async def publish(self, channel: str, message: str):
+        await self._client.publish(channel, message)
+
+    async def subscribe(self, channel: str) -> AsyncIterator[str]:
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(channel)
+        try:
+            async for message in pubsub.listen():
+                yield message["data"]
+        finally:
+            await pubsub.aclose()
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def create_backend(url: str):
+    if url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported SHARED_CACHE_URL scheme: {url}")
+
+
+# Stored under a removed link's key; read as a miss, and keeps set_url from writing the key.
+REMOVED = "removed"
+
+
+class SharedCache:
+    def __init__(self, backend, prefix: str, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        # Bump the version when CachedURL changes so old entries are ignored.
+        self._url_prefix = f"{prefix}url:v3:"
+        self._clicks_key = f"{prefix}clicks"
+        self._channel = f"{prefix}invalidate"
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._multigets: set = set()
+
+    async def get_url(self, short_code: str) -> Optional[CachedURL]:
+        """Look a code up, batching it with the other lookups made in this loop iteration."""
+        if not self._pending:
+            asyncio.get_running_loop().call_soon(self._start_multiget)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(short_code, []).append(future)
+        return await future
+
+    def _start_multiget(self):
+        pending, self._pending = self._pending, {}
+        task = asyncio.create_task(self._multiget(pending))
+        self._multigets.add(task)
+        task.add_done_callback(self._multigets.discard)
+
+    async def _multiget(self, pending: Dict[str, List[asyncio.Future]]):
+        codes = list(pending)
+        SHARED_CACHE_BATCH_SIZE.observe((), len(codes))
+        try:
+            try:
+                values = await self.backend.mget([self._url_prefix + code for code in codes])
+            except Exception:
+                # The database is the fallback; an unreachable cache only costs latency.
+                logger.exception("Shared cache lookup failed")
+                SHARED_CACHE_LOOKUPS.inc(("error",), len(codes))
+                return
+
+            for code, value in zip(codes, values):
+                cached_url = self._decode(code, value)
+                SHARED_CACHE_LOOKUPS.inc(("hit" if cached_url is not None else "miss",))
+                for future in pending[code]:
+                    if not future.done():
+                        future.set_result(cached_url)
+        finally:
+            # Whatever went wrong above, no lookup is left waiting; unresolved ones are misses.
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(None)
+
+    def _decode(self, code: str, value: Optional[str]) -> Optional[CachedURL]:
+        if value is None or value == REMOVED:
+            return None
+        try:
+            return CachedURL(*json.loads(value))
+        except Exception:
+            logger.warning("Ignoring unreadable shared cache entry for %s", code)
+            return None
+
+    async def set_url(self, short_code: str, cached_url: CachedURL):
+        """Cache a link read from the database, unless its key is taken, e.g. by REMOVED."""
+        try:
+            await self.backend.set_many(
+                {self._url_prefix + short_code: json.dumps(cached_url)}, self.ttl, only_new=True
+            )
+        except Exception:
+            logger.exception("Shared cache write failed")
+
+    async def add_clicks(self, deltas: Dict[int, int]):
+        await self.backend.hincrby_many(self._clicks_key, {str(url_id): count for url_id, count in deltas.items()})
+
+    async def count_click(self, url_id: int) -> bool:
+        """Count one click; returns False if the cache is unreachable, so it can be counted locally."""
+        try:
+            await self.add_clicks({url_id: 1})
+            return True
+        except Exception:
+            logger.exception("Shared click counter failed")
+            return False
+
+    async def take_clicks(self) -> Dict[int, int]:
+        return {int(url_id): count for url_id, count in (await self.backend.take_hash(self._clicks_key)).items()}
+
+    async def links_created(self, short_codes: List[str]):
+        try:
+            await self.backend.publish(self._channel, json.dumps({"created": short_codes}))
+        except Exception:
+            logger.exception("Shared cache invalidation failed")
+
+    async def links_removed(self, short_codes: List[str]):
+        try:
+            await self.backend.set_many({self._url_prefix + code: REMOVED for code in short_codes}, self.ttl)
+            await self.backend.publish(self._channel, json.dumps({"links": short_codes}))
+        except Exception:
+            logger.exception("Shared cache invalidation failed")
+
+    async def user_deleted(self, user_id: int):
+        try:
+            await self.backend.publish(self._channel, json.dumps({"user": user_id}))
+        except Exception:
+            logger.exception("Shared cache invalidation failed")
+
+    async def listen(self):
+        async for message in self.backend.subscribe(self._channel):
+            apply_invalidation(json.loads(message))
+
+    async def close(self):
+        await self.backend.close()
+
+
+def apply_invalidation(message: dict):
+    # New links, so this worker's Bloom filter and negative cache stop answering 404 for them.
+    for short_code in message.get("created", ()):
+        negative_cache.invalidate(short_code)
+        bloom.code_filter.add(short_code)
+
+    for short_code in message.get("links", ()):
+        url_cache.invalidate(short_code)
+        if shared_index.redirect_index is not None:
+            shared_index.redirect_index.remove(short_code)
+
+    user_id = message.get("user")
+    if user_id is not None:
+        url_cache.invalidate_where(lambda cached_url: cached_url.owned_by == user_id)
+        # Same tombstone the deleting worker keeps (see crud.delete_db_user).
+        user_cache.set(user_id, DELETED_USER, ttl=jwt_utils.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+shared_cache: Optional[SharedCache] = (
+    SharedCache(create_backend(SHARED_CACHE_URL), SHARED_CACHE_PREFIX, SHARED_CACHE_TTL_SECONDS)
+    if SHARED_CACHE_URL else None
+)
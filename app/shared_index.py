@@ -0,0 +1,431 @@
+"""Redirect index shared by all workers on a node through a memory-mapped file.
+
+With SHARED_INDEX_PATH set, every worker maps the same file and resolves short codes
+from it before going to the database. The file is an open-addressing hash table of
+fixed-width slots plus a blob of UTF-8 target URLs:
+
+    header (64 bytes)  magic, version, slot size, slot count, blob capacity, blob used, entries,
+                       exported-at f64
+    slots              code[8] | url_id u64 | owner i64 | url offset u64 | url length u32 | flags u32
+                       | max-age u32 | expires-at f64
+    blob               target URLs, back to back
+
+Slots are found by crc32(code) with linear probing; an all-zero code marks an empty
+slot. Readers take no locks. Writers hold an exclusive flock on the file and fill in a
+slot's payload before its code, so a reader either misses the slot or sees it complete.
+Removed links keep their slot with the DELETED flag set, so probe chains stay intact.
+Permanent redirects have the PERMANENT flag set and their cache max-age in its field.
+Expiring links store their expiry as a Unix timestamp; 0 means never.
+
+The file is created by exporting `urls_table`, either up front:
+
+    python -m app.shared_index export /dev/shm/shorter-links.idx
+
+or by the first worker that starts and finds no file. Links created on this node, and
+links found in the database after a miss, are added as they come. The table and blob
+never grow: once the file is full, new links are served from the database until the
+next export.
+
+Links removed on this node are flagged in the file right away. Links removed on other
+nodes are only flagged when the shared cache is enabled, as it passes removals on to
+every worker; without it, the file keeps serving them until the next export. The export
+time is kept in the header. Every SHARED_INDEX_CHECK_SECONDS, a worker re-exports the
+file once it is older than SHARED_INDEX_MAX_AGE_SECONDS, and switches to a newer file
+that another worker or the export command wrote. A worker that finds another one
+exporting skips the check rather than waiting for it. The links removed in the old file are
+flagged in the new one as well, since the export may have read them before their removal.
+"""
+import argparse
+import asyncio
+import contextlib
+import fcntl
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Iterable, Optional, Set
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+
+from . import metrics, models
+from .cache import CachedURL
+from .database import ScanSessionLocal
+from .utils import to_timestamp
+
+load_dotenv()
+
+SHARED_INDEX_PATH = os.getenv("SHARED_INDEX_PATH")
+# Room left for links created after the export.
+SHARED_INDEX_SPARE_LINKS = int(os.getenv("SHARED_INDEX_SPARE_LINKS", "100000"))
+# Re-export once the file is this old, to drop links removed elsewhere; 0 never does.
+SHARED_INDEX_MAX_AGE_SECONDS = float(os.getenv("SHARED_INDEX_MAX_AGE_SECONDS", "3600"))
+SHARED_INDEX_CHECK_SECONDS = float(os.getenv("SHARED_INDEX_CHECK_SECONDS", "60"))
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SLIDX\x00\x00\x01"
+VERSION = 4
+HEADER = struct.Struct("<8sIIQQQQd")
+HEADER_SIZE = 64
+SLOT = struct.Struct("<8sQqQIIId")
+PAYLOAD = struct.Struct("<QqQIIId")
+CODE_SIZE = 8
+EMPTY_CODE = bytes(CODE_SIZE)
+MAX_LOAD_FACTOR = 0.7
+SPARE_URL_BYTES = 128
+EXPORT_CHUNK_SIZE = 10000
+
+DELETED = 1
+PERMANENT = 2
+
+# Offset of the header's blob used and entries fields, updated together in place.
+COUNTERS_OFFSET = 32
+
+
+class IndexFull(Exception):
+    pass
+
+
+class SharedRedirectIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        if not _is_current_version(self._map[:HEADER.size]):
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} shared redirect index")
+        _, _, _, self.slot_count, self.blob_capacity, _, _, self.exported_at = HEADER.unpack_from(self._map, 0)
+
+        self._blob_start = HEADER_SIZE + self.slot_count * SLOT.size
+        self.full = 0
+
+    @classmethod
+    def create(
+        cls, path: str, slot_count: int, blob_capacity: int, exported_at: Optional[float] = None
+    ) -> "SharedRedirectIndex":
+        exported_at = time.time() if exported_at is None else exported_at
+        with open(path, "wb") as index_file:
+            index_file.truncate(HEADER_SIZE + slot_count * SLOT.size + blob_capacity)
+            index_file.write(HEADER.pack(MAGIC, VERSION, SLOT.size, slot_count, blob_capacity, 0, 0, exported_at))
+        return cls(path)
+
+    def _slots(self, code: bytes):
+        start = zlib.crc32(code) % self.slot_count
+        for probe in range(self.slot_count):
+            yield HEADER_SIZE + (start + probe) % self.slot_count * SLOT.size
+
+    def lookup(self, short_code: str) -> Optional[CachedURL]:
+        code = short_code.encode()
+        view = self._map
+        for slot in self._slots(code):
+            slot_code = view[slot:slot + CODE_SIZE]
+            if slot_code == EMPTY_CODE:
+                return None
+            if slot_code != code:
+                continue
+
+            url_id, owner, offset, length, flags, max_age, expires_at = PAYLOAD.unpack_from(view, slot + CODE_SIZE)
+            if flags & DELETED:
+                # A removed entry; the code may have been added again further along.
+                continue
+            start = self._blob_start + offset
+            return CachedURL(
+                url_id=url_id,
+                target_url=view[start:start + length].decode(),
+                owned_by=owner or None,
+                redirect_type="permanent" if flags & PERMANENT else "temporary",
+                cache_max_age=max_age if flags & PERMANENT else None,
+                expires_at=expires_at or None,
+            )
+        return None
+
+    def add(
+        self,
+        short_code: str,
+        url_id: int,
+        target_url: str,
+        owned_by: Optional[int],
+        redirect_type: str = "temporary",
+        cache_max_age: Optional[int] = None,
+        expires_at: Optional[float] = None,
+    ) -> bool:
+        """Add a link; returns False if the file has no room left for it."""
+        try:
+            with self._locked():
+                self._add(
+                    short_code.encode(), url_id, target_url.encode(), owned_by, redirect_type, cache_max_age, expires_at
+                )
+            return True
+        except IndexFull:
+            self.full += 1
+            return False
+
+    def _add(
+        self,
+        code: bytes,
+        url_id: int,
+        url: bytes,
+        owned_by: Optional[int],
+        redirect_type: str,
+        cache_max_age: Optional[int],
+        expires_at: Optional[float],
+    ):
+        _, _, _, _, _, blob_used, entries, _ = HEADER.unpack_from(self._map, 0)
+        if entries + 1 > self.slot_count * MAX_LOAD_FACTOR or blob_used + len(url) > self.blob_capacity:
+            raise IndexFull()
+
+        for slot in self._slots(code):
+            slot_code = self._map[slot:slot + CODE_SIZE]
+            if slot_code == code and not PAYLOAD.unpack_from(self._map, slot + CODE_SIZE)[4] & DELETED:
+                return
+            if slot_code == EMPTY_CODE:
+                break
+
+        start = self._blob_start + blob_used
+        self._map[start:start + len(url)] = url
+        flags = PERMANENT if redirect_type == "permanent" else 0
+        PAYLOAD.pack_into(
+            self._map, slot + CODE_SIZE, url_id, owned_by or 0, blob_used, len(url), flags,
+            cache_max_age or 0, expires_at or 0,
+        )
+        self._map[slot:slot + CODE_SIZE] = code
+        struct.pack_into("<QQ", self._map, COUNTERS_OFFSET, blob_used + len(url), entries + 1)
+
+    def remove(self, short_code: str):
+        with self._locked():
+            self._remove(short_code.encode())
+
+    def _remove(self, code: bytes):
+        for slot in self._slots(code):
+            slot_code = self._map[slot:slot + CODE_SIZE]
+            if slot_code == EMPTY_CODE:
+                return
+            if slot_code == code:
+                flags_offset = slot + SLOT.size - 16
+                flags, = struct.unpack_from("<I", self._map, flags_offset)
+                struct.pack_into("<I", self._map, flags_offset, flags | DELETED)
+
+    def removed_codes(self) -> Set[bytes]:
+        """Codes removed from this file and not added back."""
+        removed, present = set(), set()
+        for slot in range(HEADER_SIZE, self._blob_start, SLOT.size):
+            code = self._map[slot:slot + CODE_SIZE]
+            if code == EMPTY_CODE:
+                continue
+            flags, = struct.unpack_from("<I", self._map, slot + SLOT.size - 16)
+            (removed if flags & DELETED else present).add(code)
+        return removed - present
+
+    def remove_codes(self, codes: Iterable[bytes]):
+        with self._locked():
+            for code in codes:
+                self._remove(code)
+
+    def _locked(self):
+        return _flock(self._file.fileno())
+
+    def is_current(self) -> bool:
+        """Whether the path still names the file this index has open."""
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def stats(self) -> dict:
+        _, _, _, _, _, blob_used, entries, _ = HEADER.unpack_from(self._map, 0)
+        return {
+            "entries": entries,
+            "slots": self.slot_count,
+            "blob_used": blob_used,
+            "blob_capacity": self.blob_capacity,
+            "full": self.full,
+        }
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def _is_current_version(header: bytes) -> bool:
+    if len(header) < HEADER.size:
+        return False
+    magic, version, slot_size, *_ = HEADER.unpack_from(header, 0)
+    return magic == MAGIC and version == VERSION and slot_size == SLOT.size
+
+
+def _needs_export(path: str) -> bool:
+    try:
+        with open(path, "rb") as index_file:
+            header = index_file.read(HEADER.size)
+    except FileNotFoundError:
+        return True
+    if not _is_current_version(header):
+        return True
+    exported_at = HEADER.unpack(header)[-1]
+    return bool(SHARED_INDEX_MAX_AGE_SECONDS) and time.time() - exported_at >= SHARED_INDEX_MAX_AGE_SECONDS
+
+
+@contextlib.contextmanager
+def _flock(fd: int):
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextlib.asynccontextmanager
+async def _export_lock(path: str, wait: bool):
+    """Hold the node's export lock; yields False if `wait` is off and another process has it."""
+    with open(f"{path}.lock", "a") as lock_file:
+        fd = lock_file.fileno()
+        if wait:
+            # Another worker may hold it for a whole export: wait in a thread, not on the loop.
+            await asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX)
+        else:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+redirect_index: Optional[SharedRedirectIndex] = None
+
+if SHARED_INDEX_PATH:
+    metrics.add_collected(
+        "shared_index_entries", "Slots in use in the shared redirect index.",
+        lambda: redirect_index.stats()["entries"] if redirect_index is not None else 0
+    )
+    metrics.add_collected(
+        "shared_index_slots", "Slots in the shared redirect index.",
+        lambda: redirect_index.slot_count if redirect_index is not None else 0
+    )
+    metrics.add_collected(
+        "shared_index_blob_bytes", "Bytes of target URLs stored in the shared redirect index.",
+        lambda: redirect_index.stats()["blob_used"] if redirect_index is not None else 0
+    )
+    metrics.add_collected(
+        "shared_index_full_total", "Links this worker couldn't add because the index was full.",
+        lambda: redirect_index.full if redirect_index is not None else 0, metric_type="counter"
+    )
+
+
+async def export(path: str, spare_links: int = SHARED_INDEX_SPARE_LINKS):
+    """Write a snapshot of `urls_table` to `path`, replacing any existing file atomically."""
+    # Taken before the scan, so removals the scan may have missed are newer than it.
+    exported_at = time.time()
+    async with ScanSessionLocal() as db:
+        result = await db.execute(
+            select(func.count(models.URL.url_id), func.coalesce(func.sum(func.length(models.URL.target_url)), 0))
+        )
+        count, url_chars = result.one()
+
+        slot_count = max(math.ceil((count + spare_links) / MAX_LOAD_FACTOR), 8)
+        # Lengths are in characters; leave room for multi-byte ones.
+        blob_capacity = int(url_chars * 1.1) + spare_links * SPARE_URL_BYTES
+
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        index = SharedRedirectIndex.create(temporary_path, slot_count, blob_capacity, exported_at)
+        try:
+            result = await db.stream(
+                select(
+                    models.URL.url_id,
+                    models.URL.short_code,
+                    models.URL.target_url,
+                    models.URL.owned_by,
+                    models.URL.redirect_type,
+                    models.URL.cache_max_age,
+                    models.URL.expires_at,
+                )
+                .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+            )
+            async for rows in result.partitions():
+                for url_id, short_code, target_url, owned_by, redirect_type, cache_max_age, expires_at in rows:
+                    index._add(
+                        short_code.encode(), url_id, target_url.encode(), owned_by,
+                        redirect_type, cache_max_age, to_timestamp(expires_at),
+                    )
+            index._map.flush()
+        except BaseException:
+            index.close()
+            os.unlink(temporary_path)
+            raise
+
+    index.close()
+    os.replace(temporary_path, path)
+    return count
+
+
+async def open_index(path: str = SHARED_INDEX_PATH, wait: bool = True) -> SharedRedirectIndex:
+    """Open the node's index, exporting it first if it is missing or too old.
+
+    With `wait` off, an index that is already open is kept as it is while another
+    worker holds the export lock.
+    """
+    global redirect_index
+
+    async with _export_lock(path, wait=wait or redirect_index is None) as locked:
+        if not locked:
+            # Another worker is exporting; its file is picked up on a later check.
+            return redirect_index
+        if _needs_export(path):
+            count = await export(path)
+            logger.info("Exported %d links to shared redirect index %s", count, path)
+        if redirect_index is not None and redirect_index.is_current():
+            return redirect_index
+        index = SharedRedirectIndex(path)
+
+    if redirect_index is not None:
+        # The export may have read links that were removed while it ran. Links removed
+        # before it started aren't in it, so flagging them again changes nothing.
+        index.remove_codes(redirect_index.removed_codes())
+        redirect_index.close()
+    redirect_index = index
+    return redirect_index
+
+
+async def refresh_index():
+    """Re-export the node's index once it is too old, or switch to a newer export."""
+    await open_index(SHARED_INDEX_PATH, wait=False)
+
+
+def close_index():
+    global redirect_index
+    if redirect_index is not None:
+        redirect_index.close()
+        redirect_index = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the shared redirect index file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="write a snapshot of urls_table")
+    export_parser.add_argument("path")
+    export_parser.add_argument(
+        "--spare-links", type=int, default=SHARED_INDEX_SPARE_LINKS,
+        help="room to leave for links created after the export",
+    )
+    args = parser.parse_args()
+
+    async def run():
+        from .database import engine, scan_engine
+        try:
+            count = await export(args.path, args.spare_links)
+        finally:
+            await scan_engine.dispose()
+            await engine.dispose()
+        print(f"Exported {count} links to {args.path}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
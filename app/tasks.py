@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_tasks: List[asyncio.Task] = []
+
+
+def start_periodic(
+    func: Callable[[], Awaitable[None]],
+    interval: float,
+    wake_event: Optional[asyncio.Event] = None,
+):
+    """Run `func` every `interval` seconds, or sooner whenever `wake_event` is set."""
+
+    async def runner():
+        while True:
+            if wake_event is None:
+                await asyncio.sleep(interval)
+            else:
+                try:
+                    await asyncio.wait_for(wake_event.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+                wake_event.clear()
+
+            try:
+                await func()
+            except Exception:
+                logger.exception("Background task %s failed", func.__name__)
+
+    _tasks.append(asyncio.create_task(runner(), name=func.__name__))
+
+
+def start_forever(func: Callable[[], Awaitable[None]], retry_delay: float = 1):
+    """Run the long-lived coroutine `func`, restarting it `retry_delay` seconds after it fails."""
+
+    async def runner():
+        while True:
+            try:
+                await func()
+            except Exception:
+                logger.exception("Background task %s failed", func.__name__)
+            await asyncio.sleep(retry_delay)
+
+    _tasks.append(asyncio.create_task(runner(), name=func.__name__))
+
+
+async def stop_all():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
@@ -1,6 +1,54 @@
+import datetime
+import hashlib
 import string
 import secrets
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
 
 def generate_short_code(length: int = 8):
     chars = string.ascii_letters + string.digits
     return "".join(secrets.choice(chars) for _ in range(length))
+
+def generate_short_codes(count: int, length: int = 8):
+    codes = set()
+    while len(codes) < count:
+        codes.add(generate_short_code(length))
+    return list(codes)
+
+def is_valid_short_code(code: str, length: int = 8):
+    return len(code) == length and code.isascii() and code.isalnum()
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+
+    netloc = (parts.hostname or "").lower()
+    if ":" in netloc:
+        netloc = f"[{netloc}]"
+    if parts.port is not None and DEFAULT_PORTS.get(scheme) != parts.port:
+        netloc = f"{netloc}:{parts.port}"
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+def hash_url(url: str) -> bytes:
+    return hashlib.blake2b(normalize_url(url).encode(), digest_size=16).digest()
+
+def as_utc(moment: datetime.datetime) -> datetime.datetime:
+    # Naive times are taken to be UTC. SQLite stores the wall-clock time without its
+    # offset, so everything that reaches a query or a row has to be in UTC.
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(datetime.timezone.utc)
+
+def to_timestamp(moment: Optional[datetime.datetime]) -> Optional[float]:
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        # SQLite hands timestamps back without a zone; they are stored in UTC.
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
@@ -0,0 +1,258 @@
+"""In-process benchmarks for the redirect, create, login and stats hot paths.
+
+The FastAPI app runs in this process behind httpx's ASGI transport against a throwaway
+SQLite database, so no server or PostgreSQL instance is needed:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json --tolerance 0.2
+    python -m benchmarks.run --fast-responses --compare benchmarks/baseline.json
+
+With --compare, the run exits with status 1 if any scenario's throughput dropped, or its
+p99 latency rose, by more than the tolerance. The hot_link scenario also fails if the
+recorded click count doesn't match the number of redirects sent.
+
+--fast-responses runs the app with FAST_RESPONSES=true. Comparing its `cpu` column with a
+default run's shows what response validation and encoding cost per request.
+
+The `stmts` column is the number of SQL statements each request sent to the database,
+counted across the primary and read engines; each one is a round trip.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from sqlalchemy import event
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="requests in flight at once")
+    parser.add_argument("--login-requests", type=int, default=200, help="requests for the login scenario")
+    parser.add_argument("--links", type=int, default=100, help="distinct links used by the redirect scenario")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="BCRYPT_ROUNDS used for the run")
+    parser.add_argument("--scenarios", nargs="+", help="only run these scenarios")
+    parser.add_argument("--fast-responses", action="store_true", help="run with FAST_RESPONSES=true")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results against a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (default 0.2)")
+    return parser.parse_args()
+
+
+def configure_environment(args, database_path):
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{database_path}"
+    os.environ.pop("READ_DATABASE_URL", None)
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ["FAST_RESPONSES"] = "true" if args.fast_responses else "false"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+
+def summarize(latencies, wall_seconds, cpu_seconds, statements):
+    latencies = sorted(latencies)
+    cut_points = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / wall_seconds,
+        "p50_ms": cut_points[49] * 1000,
+        "p95_ms": cut_points[94] * 1000,
+        "p99_ms": cut_points[98] * 1000,
+        "cpu_ms_per_request": cpu_seconds * 1000 / len(latencies),
+        "statements_per_request": statements / len(latencies),
+    }
+
+
+class StatementCounter:
+    def __init__(self, engines):
+        self.count = 0
+        for engine in set(engines):
+            event.listen(engine.sync_engine, "before_cursor_execute", self.increment)
+
+    def increment(self, *args):
+        self.count += 1
+
+
+async def drive(total, concurrency, send, statement_counter):
+    """Call `send(i)` for i in range(total) with at most `concurrency` calls in flight."""
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            await send(i)
+            latencies.append(time.perf_counter() - started)
+
+    statements_before = statement_counter.count
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(
+        latencies,
+        time.perf_counter() - wall_started,
+        time.process_time() - cpu_started,
+        statement_counter.count - statements_before,
+    )
+
+
+def expect(response, status_code):
+    if response.status_code != status_code:
+        raise RuntimeError(
+            f"{response.request.method} {response.request.url} returned "
+            f"{response.status_code}: {response.text[:200]}"
+        )
+
+
+async def run_scenarios(args):
+    import httpx
+    from app import clicks, database, shared_cache
+    from app.main import app
+
+    results = {}
+    statement_counter = StatementCounter([database.engine, database.read_engine])
+    transport = httpx.ASGITransport(app=app)
+
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            email = f"{uuid.uuid4()}@example.com"
+            password = str(uuid.uuid4())
+            response = await client.post("/users/signup", json={
+                "username": "Bench", "email": email, "password": password, "password_confirmation": password,
+            })
+            expect(response, 201)
+            response = await client.post("/users/login", json={"email": email, "password": password})
+            expect(response, 200)
+            auth_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            response = await client.post("/links/batch", headers=auth_headers, json=[
+                {"target_url": f"https://example.com/bench/{i}"} for i in range(args.links)
+            ])
+            expect(response, 200)
+            short_codes = [link["short_url"].rsplit("/", 1)[-1] for link in response.json()]
+
+            async def redirect(i):
+                expect(await client.get(f"/links/{short_codes[i % len(short_codes)]}"), 307)
+
+            async def create(i):
+                expect(await client.post("/links/", json={"target_url": f"https://example.com/new/{i}"}), 200)
+
+            async def login(i):
+                expect(await client.post("/users/login", json={"email": email, "password": password}), 200)
+
+            async def stats(i):
+                response = await client.get(
+                    f"/links/clicks/{short_codes[i % len(short_codes)]}", headers=auth_headers
+                )
+                expect(response, 200)
+
+            hot_code = short_codes[0]
+
+            async def settle_clicks():
+                if clicks.CLICK_AGGREGATION:
+                    await clicks.flush_clicks()
+                if shared_cache.SHARED_CACHE_CLICKS:
+                    await clicks.drain_shared_clicks()
+
+            async def hot_link(i):
+                expect(await client.get(f"/links/{hot_code}"), 307)
+
+            scenarios = {
+                "redirect": (redirect, args.requests),
+                "create": (create, args.requests),
+                "login": (login, args.login_requests),
+                "stats": (stats, args.requests),
+                "hot_link": (hot_link, args.requests),
+            }
+
+            for name, (send, total) in scenarios.items():
+                if args.scenarios and name not in args.scenarios:
+                    continue
+
+                if name == "hot_link":
+                    await settle_clicks()
+                    response = await client.get(f"/links/clicks/{hot_code}", headers=auth_headers)
+                    clicks_before = response.json()["clicks"]
+
+                results[name] = await drive(total, args.concurrency, send, statement_counter)
+
+                if name == "hot_link":
+                    await settle_clicks()
+                    response = await client.get(f"/links/clicks/{hot_code}", headers=auth_headers)
+                    results[name]["lost_clicks"] = clicks_before + total - response.json()["clicks"]
+
+                print(format_result(name, results[name]), flush=True)
+
+    await database.engine.dispose()
+    await database.read_engine.dispose()
+    return results
+
+
+def format_result(name, result):
+    line = (
+        f"{name:<10} {result['throughput']:>9.1f} req/s  "
+        f"p50 {result['p50_ms']:>7.2f} ms  p95 {result['p95_ms']:>7.2f} ms  p99 {result['p99_ms']:>7.2f} ms  "
+        f"cpu {result['cpu_ms_per_request']:>6.3f} ms/req  stmts {result['statements_per_request']:>5.2f}"
+    )
+    if "lost_clicks" in result:
+        line += f"  lost clicks {result['lost_clicks']}"
+    return line
+
+
+def compare(results, baseline, tolerance):
+    failures = []
+    for name, result in results.items():
+        if result.get("lost_clicks"):
+            failures.append(f"{name}: {result['lost_clicks']} clicks were not counted")
+
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+
+        if result["throughput"] < expected["throughput"] * (1 - tolerance):
+            failures.append(
+                f"{name}: throughput {result['throughput']:.1f} req/s is below "
+                f"baseline {expected['throughput']:.1f} req/s"
+            )
+        if result["p99_ms"] > expected["p99_ms"] * (1 + tolerance):
+            failures.append(
+                f"{name}: p99 {result['p99_ms']:.2f} ms is above baseline {expected['p99_ms']:.2f} ms"
+            )
+    return failures
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(args, os.path.join(directory, "benchmark.db"))
+        results = asyncio.run(run_scenarios(args))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    failures = []
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            failures = compare(results, json.load(baseline_file), args.tolerance)
+    else:
+        failures = [
+            f"{name}: {result['lost_clicks']} clicks were not counted"
+            for name, result in results.items() if result.get("lost_clicks")
+        ]
+
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""Offline bulk import and export of links.
+
+    python manage.py import links.jsonl
+    python manage.py import links.csv --owner 42 --report conflicts.jsonl
+    python manage.py export links.csv --owner 42
+    python manage.py export - --format jsonl | gzip > links.jsonl.gz
+
+Files are JSON Lines or CSV with a header row, picked from the file extension or
+--format. Each record has a `target_url` and, optionally, `short_code`, `clicks`,
+`created_at`, `owned_by`, `redirect_type`, `cache_max_age` and `expires_at`, the
+columns export writes.
+
+Import reads the file in chunks of --chunk-size rows and writes each chunk in its own
+transaction, so memory use doesn't grow with the file. On PostgreSQL a chunk is COPY'd
+into a temporary staging table and moved into urls_table with one
+INSERT ... SELECT ... ON CONFLICT (short_code) DO NOTHING; other databases get a
+multi-row INSERT with the same conflict clause. Given short codes are kept. A row whose
+code is already taken is skipped and reported as a conflict. Rows without a code get one
+from the configured allocator, in bulk, before the chunk writes anything; codes that turn
+out to be taken are drawn again once the rows already in are committed. Invalid rows are
+skipped and reported too, as are rows owned by accounts that don't exist. An --owner
+that doesn't exist stops the import before any row is read.
+
+Running workers don't need to be told: their Bloom filters pick new codes up on the next
+refresh (for chunks that commit within BLOOM_FILTER_LOOKBACK_SECONDS), and negative
+cache entries expire within NEGATIVE_CACHE_TTL_SECONDS.
+
+Export streams urls_table, or one owner's links, in url_id order. CSV exports from
+PostgreSQL use COPY ... TO STDOUT.
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import sys
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud, models
+from app.allocator import code_allocator
+from app.database import AsyncSessionLocal, engine
+from app.schemas import MAX_CACHE_MAX_AGE
+from app.utils import hash_url, is_valid_short_code
+
+DEFAULT_CHUNK_SIZE = 50000
+MAX_ALLOCATION_ATTEMPTS = 5
+REPORTED_ON_STDERR = 20
+
+IMPORT_COLUMNS = (
+    "target_url", "url_hash", "short_code", "clicks", "created_at",
+    "owned_by", "redirect_type", "cache_max_age", "expires_at",
+)
+EXPORT_COLUMNS = (
+    "short_code", "target_url", "clicks", "created_at",
+    "owned_by", "redirect_type", "cache_max_age", "expires_at",
+)
+
+STAGING_TABLE = "urls_import"
+CREATE_STAGING_TABLE = f"""
+CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} (
+    target_url TEXT,
+    url_hash BYTEA,
+    short_code VARCHAR(8),
+    clicks INTEGER,
+    created_at TIMESTAMPTZ,
+    owned_by INTEGER,
+    redirect_type VARCHAR(10),
+    cache_max_age INTEGER,
+    expires_at TIMESTAMPTZ
+)
+"""
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+class ImportReport:
+    def __init__(self, report_path: Optional[str]):
+        self.imported = 0
+        self.conflicts = 0
+        self.invalid = 0
+        self._shown = 0
+        self._file = open(report_path, "w", encoding="utf-8") if report_path else None
+
+    def skipped(self, line: int, short_code: Optional[str], error: str):
+        if error == "conflict":
+            self.conflicts += 1
+        else:
+            self.invalid += 1
+
+        if self._file is not None:
+            self._file.write(json.dumps({"line": line, "short_code": short_code, "error": error}) + "\n")
+        if self._shown < REPORTED_ON_STDERR:
+            self._shown += 1
+            print(f"line {line}: {short_code or '-'}: {error}", file=sys.stderr)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def file_format_for(path: str, file_format: Optional[str]) -> str:
+    if file_format:
+        return file_format
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def read_records(path: str, file_format: str) -> Iterator[Tuple[int, object]]:
+    """Yield (line number, record) pairs; JSON Lines records are parsed by to_row."""
+    stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    with stream:
+        if file_format == "csv":
+            for line, record in enumerate(csv.DictReader(stream), start=2):
+                yield line, {key: value for key, value in record.items() if value != ""}
+        else:
+            for line, record in enumerate(stream, start=1):
+                if record.strip():
+                    yield line, record
+
+
+def parse_timestamp(value) -> Optional[datetime.datetime]:
+    if value is None:
+        return None
+    value = str(value)
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    elif len(value) > 3 and value[-3] in "+-" and value[-2:].isdigit():
+        # PostgreSQL writes whole-hour offsets as "+00".
+        value += ":00"
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=datetime.timezone.utc)
+    # SQLite drops the offset when storing, so convert to UTC first.
+    return moment.astimezone(datetime.timezone.utc)
+
+
+def parse_int(value) -> Optional[int]:
+    return None if value is None else int(value)
+
+
+def to_row(record, owner_id: Optional[int], now: datetime.datetime) -> dict:
+    try:
+        if isinstance(record, str):
+            record = json.loads(record)
+        if not isinstance(record, dict):
+            raise InvalidRecord("not an object")
+
+        target_url = record.get("target_url")
+        # A cheap check: hash_url parses the URL again anyway.
+        scheme, _, rest = target_url.partition("://") if isinstance(target_url, str) else ("", "", "")
+        if scheme.lower() not in ("http", "https") or not rest or rest[0] in "/?#":
+            raise InvalidRecord("target_url must be an http or https URL")
+
+        short_code = record.get("short_code") or None
+        if short_code is not None and not is_valid_short_code(short_code):
+            raise InvalidRecord("short_code must be 8 letters or digits")
+
+        redirect_type = record.get("redirect_type") or "temporary"
+        if redirect_type not in ("temporary", "permanent"):
+            raise InvalidRecord("redirect_type must be temporary or permanent")
+        cache_max_age = parse_int(record.get("cache_max_age"))
+        if cache_max_age is not None and (redirect_type != "permanent" or not 0 <= cache_max_age <= MAX_CACHE_MAX_AGE):
+            raise InvalidRecord("cache_max_age needs a permanent redirect and must be at most one year")
+
+        expires_at = parse_timestamp(record.get("expires_at"))
+        if expires_at is not None and expires_at <= now:
+            raise InvalidRecord("expired")
+
+        owned_by = owner_id if owner_id is not None else parse_int(record.get("owned_by"))
+        return {
+            "target_url": target_url,
+            "url_hash": hash_url(target_url),
+            "short_code": short_code,
+            "clicks": parse_int(record.get("clicks")) or 0,
+            "created_at": parse_timestamp(record.get("created_at")) or now,
+            "owned_by": owned_by,
+            "redirect_type": redirect_type,
+            "cache_max_age": crud.redirect_max_age(redirect_type, cache_max_age),
+            "expires_at": crud.link_expiry(owned_by, expires_at),
+        }
+    except (ValueError, TypeError) as exc:
+        raise InvalidRecord(str(exc) or type(exc).__name__) from exc
+
+
+async def insert_rows(db: AsyncSession, rows: List[dict]) -> List[str]:
+    """Insert `rows`, skipping taken short codes; returns the codes inserted."""
+    if not rows:
+        return []
+
+    if db.bind.dialect.name == "postgresql":
+        return await copy_rows(db, rows)
+
+    result = await db.execute(
+        crud.dialect_insert(db, models.URL)
+        .on_conflict_do_nothing(index_elements=[models.URL.short_code])
+        .returning(models.URL.short_code),
+        [{column: row[column] for column in IMPORT_COLUMNS} for row in rows],
+    )
+    return list(result.scalars())
+
+
+async def copy_rows(db: AsyncSession, rows: List[dict]) -> List[str]:
+    columns = ", ".join(IMPORT_COLUMNS)
+    await db.execute(text(CREATE_STAGING_TABLE))
+    await db.execute(text(f"TRUNCATE {STAGING_TABLE}"))
+
+    connection = await (await db.connection()).get_raw_connection()
+    async with connection.driver_connection.cursor() as cursor:
+        async with cursor.copy(f"COPY {STAGING_TABLE} ({columns}) FROM STDIN") as copy:
+            for row in rows:
+                await copy.write_row([row[column] for column in IMPORT_COLUMNS])
+
+    result = await db.execute(text(
+        f"INSERT INTO urls_table ({columns}) SELECT {columns} FROM {STAGING_TABLE} "
+        f"ON CONFLICT (short_code) DO NOTHING RETURNING short_code"
+    ))
+    return list(result.scalars())
+
+
+def split_inserted(rows: List[Tuple[int, dict]], inserted: List[str]):
+    """Split rows into those inserted and those whose code was taken, first come first served."""
+    remaining = set(inserted)
+    taken = []
+    for line, row in rows:
+        if row["short_code"] in remaining:
+            remaining.discard(row["short_code"])
+        else:
+            taken.append((line, row))
+    return len(rows) - len(taken), taken
+
+
+async def assign_codes(db: AsyncSession, rows: List[Tuple[int, dict]]):
+    if not rows:
+        return
+    codes = await code_allocator.allocate(db, len(rows))
+    for (_, row), code in zip(rows, codes):
+        row["short_code"] = code
+
+
+async def import_chunk(db: AsyncSession, chunk: List[Tuple[int, dict]], report: ImportReport):
+    # Rows for unknown owners would fail the foreign key and take the whole chunk with them.
+    owner_ids = list({row["owned_by"] for _, row in chunk if row["owned_by"] is not None})
+    if owner_ids:
+        existing = await crud.get_existing_user_ids(db, owner_ids)
+        for line, row in chunk:
+            if row["owned_by"] is not None and row["owned_by"] not in existing:
+                report.skipped(line, row["short_code"], f"owner {row['owned_by']} does not exist")
+        chunk = [(line, row) for line, row in chunk if row["owned_by"] is None or row["owned_by"] in existing]
+
+    given = [(line, row) for line, row in chunk if row["short_code"] is not None]
+    pending = [(line, row) for line, row in chunk if row["short_code"] is None]
+
+    # Codes are drawn before the chunk writes anything: on SQLite the sequence allocator
+    # reserves blocks on a connection of its own, which would wait on this write lock.
+    await assign_codes(db, pending)
+
+    imported, conflicts = split_inserted(given, await insert_rows(db, [row for _, row in given]))
+    for line, row in conflicts:
+        report.skipped(line, row["short_code"], "conflict")
+
+    for attempt in range(MAX_ALLOCATION_ATTEMPTS):
+        inserted, pending = split_inserted(pending, await insert_rows(db, [row for _, row in pending]))
+        imported += inserted
+        if not pending or attempt == MAX_ALLOCATION_ATTEMPTS - 1:
+            break
+        # Commit what's in before drawing replacements for taken codes, for the same reason.
+        await db.commit()
+        report.imported += imported
+        imported = 0
+        await assign_codes(db, pending)
+
+    if pending:
+        await db.rollback()
+        raise RuntimeError("Could not allocate unique short codes.")
+
+    await db.commit()
+    report.imported += imported
+
+
+async def import_links(path: str, file_format: str, owner_id: Optional[int], chunk_size: int, report: ImportReport):
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    async with AsyncSessionLocal() as db:
+        if owner_id is not None and not await crud.get_existing_user_ids(db, [owner_id]):
+            raise SystemExit(f"owner {owner_id} does not exist")
+
+        chunk = []
+        for line, record in read_records(path, file_format):
+            try:
+                chunk.append((line, to_row(record, owner_id, now)))
+            except InvalidRecord as exc:
+                report.skipped(line, None, str(exc))
+                continue
+
+            if len(chunk) >= chunk_size:
+                await import_chunk(db, chunk, report)
+                chunk = []
+
+        if chunk:
+            await import_chunk(db, chunk, report)
+
+
+def export_query(owner_id: Optional[int]):
+    query = select(*(getattr(models.URL, column) for column in EXPORT_COLUMNS)).order_by(models.URL.url_id)
+    if owner_id is not None:
+        query = query.where(models.URL.owned_by == owner_id)
+    return query
+
+
+def format_value(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+async def export_links(path: str, file_format: str, owner_id: Optional[int], chunk_size: int) -> int:
+    out = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+    count = 0
+    with out:
+        async with AsyncSessionLocal() as db:
+            query = export_query(owner_id)
+
+            if file_format == "csv" and db.bind.dialect.name == "postgresql":
+                sql = query.compile(dialect=db.bind.dialect, compile_kwargs={"literal_binds": True})
+                connection = await (await db.connection()).get_raw_connection()
+                async with connection.driver_connection.cursor() as cursor:
+                    async with cursor.copy(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+                        async for data in copy:
+                            out.write(bytes(data).decode())
+                    return cursor.rowcount
+
+            writer = csv.writer(out) if file_format == "csv" else None
+            if writer is not None:
+                writer.writerow(EXPORT_COLUMNS)
+
+            result = await db.stream(query.execution_options(yield_per=chunk_size))
+            async for rows in result.partitions():
+                if writer is not None:
+                    writer.writerows([format_value(value) for value in row] for row in rows)
+                else:
+                    out.write("".join(
+                        json.dumps({column: format_value(value) for column, value in zip(EXPORT_COLUMNS, row)}) + "\n"
+                        for row in rows
+                    ))
+                count += len(rows)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="load links from a JSON Lines or CSV file")
+    import_parser.add_argument("path", help="file to read, or - for stdin")
+    import_parser.add_argument("--report", metavar="PATH", help="write every skipped row to this JSON Lines file")
+
+    export_parser = subparsers.add_parser("export", help="write links to a JSON Lines or CSV file")
+    export_parser.add_argument("path", help="file to write, or - for stdout")
+
+    for subparser in (import_parser, export_parser):
+        subparser.add_argument("--format", choices=("jsonl", "csv"), help="default: from the file extension")
+        subparser.add_argument("--owner", type=int, help="import: owner of every link; export: only this owner's links")
+        subparser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per transaction or fetch")
+    args = parser.parse_args()
+    file_format = file_format_for(args.path, args.format)
+
+    async def run():
+        started = time.perf_counter()
+        try:
+            if args.command == "import":
+                report = ImportReport(args.report)
+                try:
+                    await import_links(args.path, file_format, args.owner, args.chunk_size, report)
+                finally:
+                    report.close()
+                elapsed = time.perf_counter() - started
+                print(
+                    f"Imported {report.imported} links in {elapsed:.1f}s "
+                    f"({report.imported / max(elapsed, 1e-9):.0f} rows/s); "
+                    f"skipped {report.conflicts} conflicts and {report.invalid} invalid rows",
+                    file=sys.stderr,
+                )
+            else:
+                count = await export_links(args.path, file_format, args.owner, args.chunk_size)
+                print(f"Exported {count} links in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
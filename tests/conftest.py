@@ -1,6 +1,16 @@
+import asyncio
+import os
+import tempfile
 import pytest
 import requests
 import uuid
+from sqlalchemy.ext.asyncio import create_async_engine
+
+# Lets the in-process tests import the app without a .env; they bring their own database.
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/tests.db")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 
 @pytest.fixture()
 def base_url():
@@ -53,3 +63,20 @@ def created_anonymous_link(base_url):
     response = requests.post(f'{base_url}/links/', json=payload)
 
     yield response.json()
+
+
+@pytest.fixture()
+def sqlite_database_url(tmp_path):
+    """URL of a fresh SQLite file with the app's tables, for tests that run app code in-process."""
+    from app.models import Base
+
+    database_url = f"sqlite+aiosqlite:///{tmp_path / 'test.db'}"
+
+    async def create_tables():
+        engine = create_async_engine(database_url)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await engine.dispose()
+
+    asyncio.run(create_tables())
+    yield database_url
@@ -10,3 +10,12 @@ def test_root_method_not_allowed(base_url):
     response = requests.post(base_url)
 
     assert response.status_code == 405
+
+def test_metrics_endpoint(base_url):
+    requests.get(base_url)
+
+    response = requests.get(f"{base_url}/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/",status="200"}' in response.text
@@ -1,4 +1,5 @@
 import pytest
+import time
 import uuid
 import requests
 from .schemas import *
@@ -113,7 +114,62 @@ def test_delete_account_success(base_url, authed_user):
 
     assert response.status_code == 401
 
+def test_delete_account_keeps_links(base_url, authed_user, created_link):
+    short_code = created_link["short_url"].split('/')[-1]
+
+    response = requests.delete(f'{base_url}/users/account/delete', headers=authed_user["auth_headers"])
+
+    assert response.status_code == 200
+    assert response.json()["job"]["status"] == "pending"
+
+    response = requests.get(f"{base_url}/links/clicks/{short_code}", headers=authed_user["auth_headers"])
+
+    assert response.status_code == 401
+
+    response = requests.get(f"{base_url}/links/{short_code}", allow_redirects=False)
+
+    assert response.status_code == 307
+
 def test_delete_account_no_auth(base_url):
     response = requests.delete(f'{base_url}/users/account/delete')
     
     assert response.status_code == 401
+
+def test_delete_account_job_status(base_url, authed_user, created_link):
+    response = requests.delete(f'{base_url}/users/account/delete', headers=authed_user["auth_headers"])
+    job_id = response.json()["job"]["id"]
+
+    response = requests.get(f'{base_url}/users/account/delete/{job_id}', headers=authed_user["auth_headers"])
+
+    assert response.status_code == 200
+    assert response.json()["id"] == job_id
+    assert response.json()["status"] in ("pending", "done")
+
+    # The purge starts right after the deletion.
+    for _ in range(50):
+        if response.json()["status"] == "done":
+            break
+        time.sleep(0.1)
+        response = requests.get(f'{base_url}/users/account/delete/{job_id}', headers=authed_user["auth_headers"])
+
+    assert response.json()["status"] == "done"
+
+def test_delete_account_job_status_other_user(base_url, authed_user):
+    unique_pass = str(uuid.uuid4())
+    email_address = f"{uuid.uuid4()}@example.com"
+    requests.post(f'{base_url}/users/signup', json={
+        "username": "Other", "email": email_address, "password": unique_pass, "password_confirmation": unique_pass
+    })
+    response = requests.post(f'{base_url}/users/login', json={"email": email_address, "password": unique_pass})
+    other_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = requests.delete(f'{base_url}/users/account/delete', headers=other_headers)
+    job_id = response.json()["job"]["id"]
+
+    response = requests.get(f'{base_url}/users/account/delete/{job_id}', headers=authed_user["auth_headers"])
+
+    assert response.status_code == 404
+
+def test_delete_account_job_status_no_auth(base_url):
+    response = requests.get(f'{base_url}/users/account/delete/1')
+
+    assert response.status_code == 401
@@ -2,6 +2,8 @@ import pytest
 import requests
 from .schemas import *
 import uuid 
+import datetime
+import time
 
 def test_create_link_authenticated(base_url, authed_user):
     payload = {"target_url": "https://github.com/AlShabiliBadia"}
@@ -39,6 +41,76 @@ def test_redirect_link(base_url, created_link):
     assert response.headers["Location"] == target_url
 
 
+def test_redirect_permanent_link(base_url, authed_user):
+    payload = {"target_url": "https://github.com/AlShabiliBadia", "redirect_type": "permanent", "cache_max_age": 3600}
+
+    created = requests.post(f'{base_url}/links/', headers=authed_user["auth_headers"], json=payload)
+
+    assert created.status_code == 200
+    assert created.json()["redirect_type"] == "permanent"
+    assert created.json()["cache_max_age"] == 3600
+
+    short_code = created.json()["short_url"].split('/')[-1]
+    response = requests.get(f"{base_url}/links/{short_code}", allow_redirects=False)
+
+    assert response.status_code == 308
+    assert response.headers["Location"] == created.json()["target_url"]
+    assert response.headers["Cache-Control"] == "public, max-age=3600"
+
+    stats = requests.get(f"{base_url}/links/clicks/{short_code}", headers=authed_user["auth_headers"])
+
+    assert stats.json()["redirect_type"] == "permanent"
+    assert stats.json()["cache_max_age"] == 3600
+
+def test_create_link_max_age_requires_permanent(base_url):
+    payload = {"target_url": "https://github.com/AlShabiliBadia", "cache_max_age": 3600}
+
+    response = requests.post(f'{base_url}/links/', json=payload)
+
+    assert response.status_code == 422
+
+def test_redirect_expired_link(base_url, authed_user):
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=1)
+    payload = {"target_url": "https://github.com/AlShabiliBadia", "expires_at": expires_at.isoformat()}
+
+    created = requests.post(f'{base_url}/links/', headers=authed_user["auth_headers"], json=payload)
+
+    assert created.status_code == 200
+    assert created.json()["expires_at"] is not None
+
+    short_code = created.json()["short_url"].split('/')[-1]
+    assert requests.get(f"{base_url}/links/{short_code}", allow_redirects=False).status_code == 307
+
+    time.sleep(1.5)
+    response = requests.get(f"{base_url}/links/{short_code}", allow_redirects=False)
+
+    assert response.status_code == 404
+
+def test_redirect_link_expiring_with_offset(base_url, authed_user):
+    offset = datetime.timezone(datetime.timedelta(hours=-5))
+    expires_at = datetime.datetime.now(offset) + datetime.timedelta(hours=1)
+    payload = {"target_url": "https://github.com/AlShabiliBadia", "expires_at": expires_at.isoformat()}
+
+    created = requests.post(f'{base_url}/links/', headers=authed_user["auth_headers"], json=payload)
+
+    assert created.status_code == 200
+    returned = datetime.datetime.fromisoformat(created.json()["expires_at"].replace("Z", "+00:00"))
+    if returned.tzinfo is None:
+        # SQLite hands timestamps back without an offset; they are UTC.
+        returned = returned.replace(tzinfo=datetime.timezone.utc)
+    assert abs((returned - expires_at).total_seconds()) < 1
+
+    short_code = created.json()["short_url"].split('/')[-1]
+    assert requests.get(f"{base_url}/links/{short_code}", allow_redirects=False).status_code == 307
+
+def test_create_link_expired(base_url, authed_user):
+    expires_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=1)
+    payload = {"target_url": "https://github.com/AlShabiliBadia", "expires_at": expires_at.isoformat()}
+
+    response = requests.post(f'{base_url}/links/', headers=authed_user["auth_headers"], json=payload)
+
+    assert response.status_code == 422
+
 def test_redirect_not_found(base_url):
     
     response = requests.get(f"{base_url}/links/non-existent-code")
@@ -47,6 +119,15 @@ def test_redirect_not_found(base_url):
 
     assert response.json()["detail"] == "Link not found!"
 
+def test_redirect_not_found_repeated(base_url):
+
+    for _ in range(2):
+        response = requests.get(f"{base_url}/links/Zz9Zz9Zz", allow_redirects=False)
+
+        assert response.status_code == 404
+
+        assert response.json()["detail"] == "Link not found!"
+
 def test_link_click_counter(base_url, authed_user, created_link):
     auth_headers = authed_user["auth_headers"]
     short_code = created_link["short_url"].split('/')[-1]
@@ -108,3 +189,125 @@ def test_get_stats_anonymous_link(base_url, authed_user, created_anonymous_link)
 
     assert response.status_code == 403
 
+
+
+def test_create_links_batch(base_url, authed_user):
+    payload = [{"target_url": f"https://github.com/AlShabiliBadia?page={i}"} for i in range(25)]
+
+    response = requests.post(f'{base_url}/links/batch', headers=authed_user["auth_headers"], json=payload)
+
+    assert response.status_code == 200
+
+    links = response.json()
+    assert len(links) == len(payload)
+    for link, sent in zip(links, payload):
+        URLInfo.model_validate(link)
+        assert link["target_url"] == sent["target_url"]
+
+    assert len({link["short_url"] for link in links}) == len(payload)
+
+def test_create_links_batch_invalid_url(base_url):
+    payload = [{"target_url": "https://github.com/AlShabiliBadia"}, {"target_url": "not-a-url"}]
+
+    response = requests.post(f'{base_url}/links/batch', json=payload)
+
+    assert response.status_code == 422
+
+@pytest.mark.parametrize("interval", ["hour", "day"])
+def test_get_stats_time_series(base_url, authed_user, created_link, interval):
+    short_code = created_link["short_url"].split('/')[-1]
+
+    response = requests.get(
+        f"{base_url}/links/clicks/{short_code}",
+        params={"interval": interval},
+        headers=authed_user["auth_headers"],
+    )
+
+    assert response.status_code == 200
+
+    URLStats.model_validate(response.json())
+    assert isinstance(response.json()["series"], list)
+
+def test_get_stats_invalid_interval(base_url, authed_user, created_link):
+    short_code = created_link["short_url"].split('/')[-1]
+
+    response = requests.get(
+        f"{base_url}/links/clicks/{short_code}",
+        params={"interval": "minute"},
+        headers=authed_user["auth_headers"],
+    )
+
+    assert response.status_code == 422
+
+def test_list_my_links_paginated(base_url, authed_user):
+    payload = [{"target_url": f"https://github.com/AlShabiliBadia?page={i}"} for i in range(5)]
+    created = requests.post(f'{base_url}/links/batch', headers=authed_user["auth_headers"], json=payload).json()
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+
+        response = requests.get(f"{base_url}/links/mine", params=params, headers=authed_user["auth_headers"])
+
+        assert response.status_code == 200
+
+        page = response.json()
+        assert len(page["items"]) <= 2
+        for link in page["items"]:
+            URLInfo.model_validate(link)
+        seen.extend(link["short_url"] for link in page["items"])
+
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == [link["short_url"] for link in created]
+
+def test_list_my_links_not_authenticated(base_url):
+    response = requests.get(f"{base_url}/links/mine")
+
+    assert response.status_code == 401
+
+@pytest.mark.parametrize("export_format", ["ndjson", "csv"])
+def test_export_my_links(base_url, authed_user, created_link, export_format):
+    response = requests.get(
+        f"{base_url}/links/mine/export",
+        params={"format": export_format},
+        headers=authed_user["auth_headers"],
+    )
+
+    assert response.status_code == 200
+
+    lines = response.text.strip().splitlines()
+    if export_format == "csv":
+        assert lines[0].split(",")[0] == "id"
+        lines = lines[1:]
+
+    assert len(lines) == 1
+    assert created_link["short_url"].split('/')[-1] in lines[0]
+
+def test_link_stats_batch(base_url, authed_user, created_link, created_anonymous_link):
+    short_code = created_link["short_url"].split('/')[-1]
+    anonymous_code = created_anonymous_link["short_url"].split('/')[-1]
+    payload = {"short_codes": [short_code, anonymous_code, "zzzzzzzz"]}
+
+    response = requests.post(f"{base_url}/links/clicks/batch", headers=authed_user["auth_headers"], json=payload)
+
+    assert response.status_code == 200
+    assert [item["short_code"] for item in response.json()["items"]] == [short_code]
+    assert response.json()["not_found"] == [anonymous_code, "zzzzzzzz"]
+
+def test_top_links(base_url, authed_user, created_link):
+    short_code = created_link["short_url"].split('/')[-1]
+    payload = {"target_url": "https://github.com/AlShabiliBadia?top"}
+    requests.post(f'{base_url}/links/', headers=authed_user["auth_headers"], json=payload)
+
+    requests.get(f"{base_url}/links/{short_code}", allow_redirects=False)
+
+    response = requests.get(f"{base_url}/links/top?limit=1", headers=authed_user["auth_headers"])
+
+    assert response.status_code == 200
+    assert [link["id"] for link in response.json()] == [created_link["id"]]
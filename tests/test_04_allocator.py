@@ -0,0 +1,177 @@
+import asyncio
+import random
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app import crud, models, schemas
+from app.allocator import (
+    ALPHABET, CODE_LENGTH, CODE_SPACE, FeistelPermutation, RandomCodeAllocator, SequenceCodeAllocator,
+    decode_base62, encode_base62,
+)
+from app.database import create_engine_from_url
+
+TAKEN_CODE = "takenCde"
+
+
+def test_base62_round_trip():
+    for number in [0, 1, 61, 62, CODE_SPACE - 1] + random.sample(range(CODE_SPACE), 1000):
+        code = encode_base62(number)
+
+        assert len(code) == CODE_LENGTH
+        assert set(code) <= set(ALPHABET)
+        assert decode_base62(code) == number
+
+
+def test_base62_edges():
+    assert encode_base62(0) == ALPHABET[0] * CODE_LENGTH
+    assert encode_base62(CODE_SPACE - 1) == ALPHABET[-1] * CODE_LENGTH
+
+
+def test_feistel_permutation_round_trip():
+    permutation = FeistelPermutation("test-key")
+
+    for number in [0, 1, CODE_SPACE - 1] + random.sample(range(CODE_SPACE), 1000):
+        permuted = permutation.permute(number)
+
+        assert 0 <= permuted < CODE_SPACE
+        assert permutation.invert(permuted) == number
+
+
+def test_feistel_permutation_is_distinct():
+    permutation = FeistelPermutation("test-key")
+
+    permuted = [permutation.permute(number) for number in range(20000)]
+
+    assert len(set(permuted)) == len(permuted)
+
+
+def test_feistel_permutation_depends_on_key():
+    first = FeistelPermutation("first-key")
+    second = FeistelPermutation("second-key")
+
+    assert [first.permute(n) for n in range(100)] != [second.permute(n) for n in range(100)]
+
+
+async def allocate_from_two_workers(database_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(models.short_code_block_counter.create)
+
+    permutation = FeistelPermutation("test-key")
+    workers = [SequenceCodeAllocator(permutation, block_size=10) for _ in range(2)]
+    codes = []
+    try:
+        async with AsyncSession(engine) as db:
+            # Odd sizes so requests straddle block boundaries.
+            for count in [3, 7, 15, 1, 24, 10]:
+                for worker in workers:
+                    codes.extend(await worker.allocate(db, count))
+                    await db.commit()
+    finally:
+        await engine.dispose()
+        for worker in workers:
+            await worker.close()
+    return permutation, codes
+
+
+def test_sequence_allocator_reserves_distinct_blocks(tmp_path):
+    permutation, codes = asyncio.run(allocate_from_two_workers(tmp_path / "allocator.db"))
+
+    assert len(codes) == 2 * (3 + 7 + 15 + 1 + 24 + 10)
+    assert len(set(codes)) == len(codes)
+
+    ids = [permutation.invert(decode_base62(code)) for code in codes]
+    # Block 0 is never handed out, so no ID is below the block size.
+    assert min(ids) >= 10
+    # Between them the workers use up every block they reserved.
+    assert sorted(ids) == list(range(10, 10 + len(ids)))
+
+
+async def allocate_around_a_rollback(database_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(models.short_code_block_counter.create)
+
+    permutation = FeistelPermutation("test-key")
+    first_worker, second_worker = (SequenceCodeAllocator(permutation, block_size=10) for _ in range(2))
+    try:
+        async with AsyncSession(engine) as db:
+            rolled_back = await first_worker.allocate(db, 5)
+            await db.rollback()
+        async with AsyncSession(engine) as db:
+            # The first worker keeps using its block after the rollback; the second needs its own.
+            rolled_back += await first_worker.allocate(db, 5)
+            later = await second_worker.allocate(db, 10)
+            await db.commit()
+    finally:
+        await engine.dispose()
+        await first_worker.close()
+        await second_worker.close()
+    return permutation, rolled_back, later
+
+
+def test_sequence_allocator_blocks_survive_a_rollback(tmp_path):
+    permutation, rolled_back, later = asyncio.run(allocate_around_a_rollback(tmp_path / "allocator.db"))
+
+    first_ids = {permutation.invert(decode_base62(code)) for code in rolled_back}
+    later_ids = {permutation.invert(decode_base62(code)) for code in later}
+    assert first_ids == set(range(10, 20))
+    assert later_ids == set(range(20, 30))
+
+
+class FirstBatchClashes:
+    """Puts a taken code second in the first batch it hands out, and records batch sizes."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counts = []
+
+    async def allocate(self, db, count):
+        self.counts.append(count)
+        codes = await super().allocate(db, count)
+        if len(self.counts) == 1:
+            codes[1] = TAKEN_CODE
+        return codes
+
+
+class ClashingRandomAllocator(FirstBatchClashes, RandomCodeAllocator):
+    pass
+
+
+class ClashingSequenceAllocator(FirstBatchClashes, SequenceCodeAllocator):
+    pass
+
+
+async def create_batch_after_a_clash(database_url, allocator):
+    engine = create_engine_from_url(database_url)
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            db.add(models.URL(short_code=TAKEN_CODE, target_url="https://example.com/taken"))
+            await db.commit()
+            links = await crud.create_db_urls_bulk(
+                db, [schemas.URLCreate(target_url=f"https://example.com/{number}") for number in range(3)]
+            )
+            return [link.short_code for link in links]
+    finally:
+        await engine.dispose()
+        await allocator.close()
+
+
+@pytest.mark.parametrize(
+    "allocator, counts",
+    [
+        # Only the row whose code was taken gets a new one.
+        (ClashingRandomAllocator(), [3, 1]),
+        # On SQLite the sequence allocator can't run while the batch holds the write lock,
+        # so the batch starts over.
+        (ClashingSequenceAllocator(FeistelPermutation("test-key"), block_size=10), [3, 3]),
+    ],
+)
+def test_bulk_create_redraws_taken_codes(sqlite_database_url, monkeypatch, allocator, counts):
+    monkeypatch.setattr(crud, "code_allocator", allocator)
+
+    codes = asyncio.run(create_batch_after_a_clash(sqlite_database_url, allocator))
+
+    assert allocator.counts == counts
+    assert len(set(codes)) == 3
+    assert TAKEN_CODE not in codes
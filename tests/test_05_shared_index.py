@@ -0,0 +1,287 @@
+import asyncio
+import datetime
+import fcntl
+import time
+import zlib
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import models, shared_index
+from app.shared_index import DELETED, PAYLOAD, SLOT, IndexFull, SharedRedirectIndex
+
+
+def colliding_codes(slot_count, count):
+    """Codes that all hash to the same first slot, so they share one probe chain."""
+    codes = []
+    number = 0
+    while len(codes) < count:
+        code = f"c{number:07d}"
+        if zlib.crc32(code.encode()) % slot_count == 0:
+            codes.append(code)
+        number += 1
+    return codes
+
+
+def test_add_and_lookup(tmp_path):
+    index = SharedRedirectIndex.create(str(tmp_path / "links.idx"), slot_count=64, blob_capacity=4096)
+    expires_at = datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+    assert index.add("aaaaaaaa", 1, "https://example.com/temporary", owned_by=None)
+    assert index.add("bbbbbbbb", 2, "https://example.com/permanent", 7, "permanent", 3600, expires_at)
+
+    temporary = index.lookup("aaaaaaaa")
+    assert temporary.url_id == 1
+    assert temporary.target_url == "https://example.com/temporary"
+    assert temporary.owned_by is None
+    assert temporary.redirect_type == "temporary"
+    assert temporary.cache_max_age is None
+    assert temporary.expires_at is None
+
+    permanent = index.lookup("bbbbbbbb")
+    assert permanent.url_id == 2
+    assert permanent.owned_by == 7
+    assert permanent.redirect_type == "permanent"
+    assert permanent.cache_max_age == 3600
+    assert permanent.expires_at == expires_at
+
+    assert index.lookup("cccccccc") is None
+    assert index.stats()["entries"] == 2
+    index.close()
+
+
+def test_entries_are_visible_to_other_mappings(tmp_path):
+    path = str(tmp_path / "links.idx")
+    writer = SharedRedirectIndex.create(path, slot_count=64, blob_capacity=4096)
+    reader = SharedRedirectIndex(path)
+
+    writer.add("aaaaaaaa", 1, "https://example.com/", owned_by=None)
+
+    assert reader.lookup("aaaaaaaa").url_id == 1
+    writer.close()
+    reader.close()
+
+
+def test_remove_sets_only_the_deleted_flag(tmp_path):
+    index = SharedRedirectIndex.create(str(tmp_path / "links.idx"), slot_count=64, blob_capacity=4096)
+    index.add("aaaaaaaa", 1, "https://example.com/", 7, "permanent", 3600, 1893456000.0)
+    slot = next(
+        slot for slot in index._slots(b"aaaaaaaa") if index._map[slot:slot + 8] == b"aaaaaaaa"
+    )
+    before = PAYLOAD.unpack_from(index._map, slot + 8)
+
+    index.remove("aaaaaaaa")
+
+    after = PAYLOAD.unpack_from(index._map, slot + 8)
+    # The flags field, fifth in the payload, is the one remove() writes at SLOT.size - 16.
+    assert SLOT.size - 16 == 8 + PAYLOAD.size - 16
+    assert after[4] == before[4] | DELETED
+    assert after[:4] + after[5:] == before[:4] + before[5:]
+    assert index.lookup("aaaaaaaa") is None
+    index.close()
+
+
+def test_removed_entries_keep_probe_chains_intact(tmp_path):
+    index = SharedRedirectIndex.create(str(tmp_path / "links.idx"), slot_count=16, blob_capacity=4096)
+    first, second, third = colliding_codes(16, 3)
+    for url_id, code in enumerate([first, second, third], start=1):
+        index.add(code, url_id, f"https://example.com/{code}", owned_by=None)
+
+    index.remove(first)
+    index.remove(second)
+
+    assert index.lookup(first) is None
+    assert index.lookup(second) is None
+    # Past two removed slots at the head of its chain.
+    assert index.lookup(third).url_id == 3
+    index.close()
+
+
+def test_readd_after_remove(tmp_path):
+    index = SharedRedirectIndex.create(str(tmp_path / "links.idx"), slot_count=16, blob_capacity=4096)
+    first, second = colliding_codes(16, 2)
+    index.add(first, 1, "https://example.com/old", owned_by=None)
+    index.add(second, 2, "https://example.com/other", owned_by=None)
+
+    index.remove(first)
+    assert index.add(first, 3, "https://example.com/new", owned_by=None)
+
+    assert index.lookup(first).url_id == 3
+    assert index.lookup(first).target_url == "https://example.com/new"
+    assert index.lookup(second).url_id == 2
+
+    # Adding a code that is already present leaves it alone.
+    assert index.add(first, 4, "https://example.com/newer", owned_by=None)
+    assert index.lookup(first).url_id == 3
+    index.close()
+
+
+def test_full_index_refuses_new_links(tmp_path):
+    index = SharedRedirectIndex.create(str(tmp_path / "links.idx"), slot_count=8, blob_capacity=4096)
+
+    # 0.7 of 8 slots.
+    for url_id in range(5):
+        assert index.add(f"code{url_id:04d}", url_id, "https://example.com/", owned_by=None)
+
+    assert not index.add("code0005", 5, "https://example.com/", owned_by=None)
+    assert index.full == 1
+    assert index.lookup("code0005") is None
+    try:
+        index._add(b"code0005", 5, b"https://example.com/", None, "temporary", None, None)
+    except IndexFull:
+        pass
+    else:
+        raise AssertionError("IndexFull was not raised")
+    index.close()
+
+
+def test_full_blob_refuses_new_links(tmp_path):
+    index = SharedRedirectIndex.create(str(tmp_path / "links.idx"), slot_count=64, blob_capacity=32)
+
+    assert index.add("aaaaaaaa", 1, "https://example.com/short", owned_by=None)
+    assert not index.add("bbbbbbbb", 2, "https://example.com/too-long-for-the-rest", owned_by=None)
+    assert index.full == 1
+    index.close()
+
+
+async def export_links(engine, path):
+    async with engine.begin() as conn:
+        await conn.execute(
+            models.URL.__table__.insert(),
+            [
+                {
+                    "short_code": "aaaaaaaa", "target_url": "https://example.com/a", "redirect_type": "temporary",
+                    "cache_max_age": None, "expires_at": None,
+                },
+                {
+                    "short_code": "bbbbbbbb", "target_url": "https://example.com/b", "redirect_type": "permanent",
+                    "cache_max_age": 60,
+                    "expires_at": datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc),
+                },
+            ],
+        )
+    try:
+        return await shared_index.export(path, spare_links=10)
+    finally:
+        await engine.dispose()
+
+
+def test_export(tmp_path, sqlite_database_url, monkeypatch):
+    path = str(tmp_path / "links.idx")
+    engine = create_async_engine(sqlite_database_url)
+    monkeypatch.setattr(shared_index, "ScanSessionLocal", async_sessionmaker(bind=engine, expire_on_commit=False))
+
+    count = asyncio.run(export_links(engine, path))
+
+    assert count == 2
+    assert not list(tmp_path.glob("*.tmp"))
+    index = SharedRedirectIndex(path)
+    assert index.stats()["entries"] == 2
+    assert index.lookup("aaaaaaaa").target_url == "https://example.com/a"
+    permanent = index.lookup("bbbbbbbb")
+    assert permanent.redirect_type == "permanent"
+    assert permanent.cache_max_age == 60
+    assert permanent.expires_at == datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+    # Room was left for the spare links.
+    assert index.add("cccccccc", 3, "https://example.com/c", owned_by=None)
+    index.close()
+
+
+def open_with_database(tmp_path, sqlite_database_url, monkeypatch):
+    """Point shared_index at a database with links aaaaaaaa and bbbbbbbb; returns the index path."""
+    engine = create_async_engine(sqlite_database_url)
+    monkeypatch.setattr(shared_index, "ScanSessionLocal", async_sessionmaker(bind=engine, expire_on_commit=False))
+    monkeypatch.setattr(shared_index, "redirect_index", None)
+
+    async def add_links():
+        async with engine.begin() as conn:
+            await conn.execute(
+                models.URL.__table__.insert(),
+                [{"short_code": code, "target_url": f"https://example.com/{code}"} for code in ["aaaaaaaa", "bbbbbbbb"]],
+            )
+
+    asyncio.run(add_links())
+    return str(tmp_path / "links.idx"), engine
+
+
+def test_open_index_reexports_a_stale_file(tmp_path, sqlite_database_url, monkeypatch):
+    path, engine = open_with_database(tmp_path, sqlite_database_url, monkeypatch)
+    monkeypatch.setattr(shared_index, "SHARED_INDEX_MAX_AGE_SECONDS", 3600)
+
+    async def run():
+        try:
+            # Fresh enough: kept as it is, though it doesn't have the links.
+            SharedRedirectIndex.create(path, slot_count=64, blob_capacity=4096).close()
+            fresh = await shared_index.open_index(path)
+            fresh_lookup = fresh.lookup("aaaaaaaa")
+            shared_index.close_index()
+
+            stale = SharedRedirectIndex.create(path, slot_count=64, blob_capacity=4096, exported_at=time.time() - 7200)
+            stale.add("cccccccc", 3, "https://example.com/removed", owned_by=None)
+            stale.close()
+            reexported = await shared_index.open_index(path)
+            return fresh_lookup, reexported.lookup("aaaaaaaa"), reexported.lookup("cccccccc")
+        finally:
+            shared_index.close_index()
+            await engine.dispose()
+
+    fresh_lookup, exported_link, removed_link = asyncio.run(run())
+
+    assert fresh_lookup is None
+    assert exported_link.target_url == "https://example.com/aaaaaaaa"
+    assert removed_link is None
+
+
+def test_refresh_switches_to_a_new_export(tmp_path, sqlite_database_url, monkeypatch):
+    path, engine = open_with_database(tmp_path, sqlite_database_url, monkeypatch)
+    monkeypatch.setattr(shared_index, "SHARED_INDEX_PATH", path)
+    monkeypatch.setattr(shared_index, "SHARED_INDEX_MAX_AGE_SECONDS", 3600)
+
+    async def run():
+        try:
+            old = await shared_index.open_index(path)
+            # Another worker removes bbbbbbbb while the export below has already read it.
+            other_worker = SharedRedirectIndex(path)
+            other_worker.remove("bbbbbbbb")
+            other_worker.close()
+            await shared_index.export(path)
+            await shared_index.refresh_index()
+            current = shared_index.redirect_index
+            return old is current, current.lookup("aaaaaaaa"), current.lookup("bbbbbbbb"), current.is_current()
+        finally:
+            shared_index.close_index()
+            await engine.dispose()
+
+    same, kept, removed, is_current = asyncio.run(run())
+
+    assert not same
+    assert is_current
+    assert kept.target_url == "https://example.com/aaaaaaaa"
+    assert removed is None
+
+
+def test_refresh_skips_while_another_worker_exports(tmp_path, sqlite_database_url, monkeypatch):
+    path, engine = open_with_database(tmp_path, sqlite_database_url, monkeypatch)
+    monkeypatch.setattr(shared_index, "SHARED_INDEX_PATH", path)
+    monkeypatch.setattr(shared_index, "SHARED_INDEX_MAX_AGE_SECONDS", 3600)
+
+    async def run():
+        try:
+            old = await shared_index.open_index(path)
+            # From here on, every check finds the file too old.
+            monkeypatch.setattr(shared_index, "SHARED_INDEX_MAX_AGE_SECONDS", 0.001)
+            # Another worker holds the export lock: the refresh must neither wait nor export.
+            with open(f"{path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                await asyncio.wait_for(shared_index.refresh_index(), timeout=1)
+                skipped = shared_index.redirect_index
+            await shared_index.refresh_index()
+            refreshed = shared_index.redirect_index
+            return old, skipped, refreshed, refreshed.lookup("aaaaaaaa")
+        finally:
+            shared_index.close_index()
+            await engine.dispose()
+
+    old, skipped, refreshed, link = asyncio.run(run())
+
+    assert skipped is old
+    assert refreshed is not old
+    assert link.target_url == "https://example.com/aaaaaaaa"
@@ -0,0 +1,86 @@
+import asyncio
+import datetime
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import crud, events, models
+from app.events import ClickEvent
+
+UTC = datetime.timezone.utc
+
+
+def click(occurred_at, short_code="aaaaaaaa"):
+    return ClickEvent(occurred_at=occurred_at, short_code=short_code, referrer=None, user_agent=None)
+
+
+def as_utc(moment):
+    # SQLite hands timestamps back without a zone; they are stored in UTC.
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=UTC)
+
+
+async def write_and_read_series(sessions, batches, short_code, granularity, start, end):
+    for batch in batches:
+        await events.write_click_events(batch)
+
+    async with sessions() as db:
+        series = await crud.get_click_series(db, short_code, granularity, start, end)
+        raw_count = (await db.execute(select(func.count()).select_from(models.click_events))).scalar_one()
+    return [(as_utc(bucket), clicks) for bucket, clicks in series], raw_count
+
+
+def run_series(sqlite_database_url, monkeypatch, batches, short_code, granularity, start, end):
+    engine = create_async_engine(sqlite_database_url)
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+    monkeypatch.setattr(events, "AsyncSessionLocal", sessions)
+
+    async def run():
+        try:
+            return await write_and_read_series(sessions, batches, short_code, granularity, start, end)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_hourly_buckets(sqlite_database_url, monkeypatch):
+    day = datetime.datetime(2030, 1, 1, tzinfo=UTC)
+    batches = [
+        [
+            click(day.replace(hour=9, minute=0)),
+            click(day.replace(hour=9, minute=59, second=59)),
+            click(day.replace(hour=11, minute=30)),
+            click(day.replace(hour=9, minute=15), short_code="bbbbbbbb"),
+        ],
+        # A later flush adds to the buckets already written.
+        [click(day.replace(hour=9, minute=45)), click(day.replace(hour=12))],
+    ]
+
+    series, raw_count = run_series(
+        sqlite_database_url, monkeypatch, batches, "aaaaaaaa", "hour", day, day + datetime.timedelta(days=1)
+    )
+
+    assert series == [
+        (day.replace(hour=9), 3),
+        (day.replace(hour=11), 1),
+        (day.replace(hour=12), 1),
+    ]
+    assert raw_count == 6
+
+
+def test_daily_buckets(sqlite_database_url, monkeypatch):
+    day = datetime.datetime(2030, 1, 1, tzinfo=UTC)
+    batches = [
+        [click(day.replace(hour=0)), click(day.replace(hour=23, minute=59))],
+        [click(day + datetime.timedelta(days=1, hours=5))],
+        [click(day + datetime.timedelta(days=3))],
+    ]
+
+    series, _ = run_series(
+        sqlite_database_url, monkeypatch, batches, "aaaaaaaa", "day", day, day + datetime.timedelta(days=3)
+    )
+
+    # The range's end is exclusive.
+    assert series == [
+        (day, 2),
+        (day + datetime.timedelta(days=1), 1),
+    ]
@@ -0,0 +1,45 @@
+import asyncio
+import json
+import httpx
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app import dependencies, jwt_utils, models
+from app.main import app
+from app.routers import links
+
+
+async def export_links(engine, sessions):
+    try:
+        async with sessions() as db:
+            user = models.User(username="Tester", email="export@example.com", password="x")
+            db.add(user)
+            await db.flush()
+            db.add_all(
+                models.URL(short_code=f"code{number:04d}", target_url=f"https://example.com/{number}", owned_by=user.id)
+                for number in range(3)
+            )
+            await db.commit()
+            token = jwt_utils.create_access_token(data={"sub": str(user.id)})
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/links/mine/export", headers={"Authorization": f"Bearer {token}"})
+    finally:
+        await engine.dispose()
+
+
+def test_export_holds_one_connection(sqlite_database_url, monkeypatch):
+    # PostgreSQL-style wiring without a replica: the auth lookup and the scan share one pool.
+    engine = create_async_engine(sqlite_database_url, pool_size=1, max_overflow=0, pool_timeout=2)
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+    monkeypatch.setattr(dependencies, "AUTH_MODE", "database")
+    monkeypatch.setattr(dependencies, "AsyncSessionLocal", sessions)
+    monkeypatch.setattr(dependencies, "engine", engine)
+    monkeypatch.setattr(dependencies, "read_engine", engine)
+    monkeypatch.setattr(links, "ScanSessionLocal", sessions)
+
+    response = asyncio.run(export_links(engine, sessions))
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["short_code"] for row in rows] == ["code0000", "code0001", "code0002"]
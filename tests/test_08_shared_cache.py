@@ -0,0 +1,146 @@
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app import clicks, models
+from app.cache import CachedURL, DELETED_USER, url_cache, user_cache
+from app.shared_cache import MemoryBackend, SharedCache
+
+LINK = CachedURL(url_id=1, target_url="https://example.com/", owned_by=None)
+
+
+class CountingBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.mget_calls = []
+
+    async def mget(self, keys):
+        self.mget_calls.append(keys)
+        return await super().mget(keys)
+
+
+class BrokenBackend(MemoryBackend):
+    async def mget(self, keys):
+        raise ConnectionError("cache is down")
+
+    async def set_many(self, items, ttl, only_new=False):
+        raise ConnectionError("cache is down")
+
+    async def hincrby_many(self, key, amounts):
+        raise ConnectionError("cache is down")
+
+
+def test_lookups_are_batched():
+    backend = CountingBackend()
+    cache = SharedCache(backend, "test:", ttl=60)
+
+    async def run():
+        await cache.set_url("aaaaaaaa", LINK)
+        return await asyncio.gather(
+            cache.get_url("aaaaaaaa"), cache.get_url("bbbbbbbb"), cache.get_url("aaaaaaaa")
+        )
+
+    assert asyncio.run(run()) == [LINK, None, LINK]
+    assert backend.mget_calls == [["test:url:v3:aaaaaaaa", "test:url:v3:bbbbbbbb"]]
+
+
+def test_unreadable_entry_is_a_miss_for_its_code_only():
+    backend = MemoryBackend()
+    cache = SharedCache(backend, "test:", ttl=60)
+
+    async def run():
+        await cache.set_url("aaaaaaaa", LINK)
+        await backend.set_many({"test:url:v3:bbbbbbbb": "[not json"}, 60)
+        await backend.set_many({"test:url:v3:cccccccc": '["too", "few"]'}, 60)
+        return await asyncio.wait_for(
+            asyncio.gather(cache.get_url("bbbbbbbb"), cache.get_url("aaaaaaaa"), cache.get_url("cccccccc")),
+            timeout=5,
+        )
+
+    assert asyncio.run(run()) == [None, LINK, None]
+
+
+def test_unreachable_backend_falls_back():
+    cache = SharedCache(BrokenBackend(), "test:", ttl=60)
+
+    async def run():
+        lookups = await asyncio.wait_for(
+            asyncio.gather(cache.get_url("aaaaaaaa"), cache.get_url("bbbbbbbb")), timeout=5
+        )
+        await cache.set_url("aaaaaaaa", LINK)
+        return lookups, await cache.count_click(1)
+
+    lookups, counted = asyncio.run(run())
+
+    assert lookups == [None, None]
+    # Not counted in the shared cache, so the caller counts it locally.
+    assert counted is False
+
+
+def test_removed_link_is_not_cached_again():
+    cache = SharedCache(MemoryBackend(), "test:", ttl=60)
+
+    async def run():
+        await cache.set_url("aaaaaaaa", LINK)
+        await cache.links_removed(["aaaaaaaa"])
+        # A request that read the link from the database before it was removed.
+        await cache.set_url("aaaaaaaa", LINK)
+        return await cache.get_url("aaaaaaaa")
+
+    assert asyncio.run(run()) is None
+
+
+def test_invalidations_reach_every_node():
+    backend = MemoryBackend()
+    first_node = SharedCache(backend, "test:", ttl=60)
+    second_node = SharedCache(backend, "test:", ttl=60)
+    url_cache.set("aaaaaaaa", LINK)
+    url_cache.set("bbbbbbbb", LINK._replace(url_id=2, owned_by=42))
+
+    async def run():
+        listener = asyncio.create_task(first_node.listen())
+        # Let the listener subscribe before anything is published.
+        await asyncio.sleep(0)
+        await second_node.links_removed(["aaaaaaaa"])
+        await second_node.user_deleted(42)
+        await asyncio.sleep(0)
+        listener.cancel()
+
+    try:
+        asyncio.run(run())
+
+        assert url_cache.get("aaaaaaaa") is None
+        assert url_cache.get("bbbbbbbb") is None
+        assert user_cache.get(42) is DELETED_USER
+    finally:
+        url_cache.invalidate("aaaaaaaa")
+        url_cache.invalidate("bbbbbbbb")
+        user_cache.invalidate(42)
+
+
+def test_clicks_are_drained_once(sqlite_database_url, monkeypatch):
+    engine = create_async_engine(sqlite_database_url)
+    cache = SharedCache(MemoryBackend(), "test:", ttl=60)
+    monkeypatch.setattr(clicks, "AsyncSessionLocal", async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession))
+    monkeypatch.setattr(clicks, "shared_cache", cache)
+
+    async def run():
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    models.URL.__table__.insert(),
+                    [{"url_id": 1, "short_code": "aaaaaaaa", "target_url": "https://example.com/", "clicks": 0}],
+                )
+            for _ in range(5):
+                assert await cache.count_click(1)
+            # Two nodes draining at the same moment.
+            await asyncio.gather(clicks.drain_shared_clicks(), clicks.drain_shared_clicks())
+            await cache.count_click(1)
+            await clicks.drain_shared_clicks()
+            async with engine.connect() as conn:
+                return (await conn.execute(select(models.URL.clicks))).scalar_one()
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(run()) == 6
+    assert asyncio.run(cache.take_clicks()) == {}
@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app import rate_limit
+from app.rate_limit import MemoryBackend, RateLimit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    yield clock
+
+
+def take(backend, key, capacity=3, refill_per_second=1.0):
+    return asyncio.run(backend.take(key, capacity, refill_per_second))
+
+
+def test_burst_then_refill(clock):
+    backend = MemoryBackend(max_keys=100)
+
+    assert [take(backend, "login:ip:a") for _ in range(3)] == [0, 0, 0]
+    assert take(backend, "login:ip:a") == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert take(backend, "login:ip:a") == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert take(backend, "login:ip:a") == 0
+    # Other clients have their own buckets.
+    assert take(backend, "login:ip:b") == 0
+
+
+def test_refilled_buckets_are_evicted(clock):
+    backend = MemoryBackend(max_keys=100)
+    take(backend, "login:ip:a")
+    take(backend, "login:ip:b")
+    take(backend, "login:ip:b")
+
+    # a is full again after one second, b only after two.
+    clock.now += 1.5
+    take(backend, "login:ip:c")
+
+    assert len(backend) == 2
+    assert backend.evictions == 1
+
+
+def test_throttled_buckets_are_kept_at_capacity(clock):
+    backend = MemoryBackend(max_keys=2)
+    for _ in range(4):
+        take(backend, "login:user:victim")
+    take(backend, "login:ip:attacker")
+
+    # A stream of new clients doesn't push the victim's throttled bucket out.
+    for number in range(10):
+        take(backend, f"login:ip:{number}")
+
+    assert take(backend, "login:user:victim") > 0
+    assert backend.evictions == 0
+
+
+def test_refilled_bucket_behind_a_refilling_one_makes_room(clock):
+    backend = MemoryBackend(max_keys=2)
+    take(backend, "signup:ip:a", capacity=1, refill_per_second=0.1)
+    take(backend, "login:ip:b", capacity=1, refill_per_second=1.0)
+
+    # b is full again, a is older but still refilling.
+    clock.now += 1.5
+    assert take(backend, "login:ip:c", capacity=1) == 0
+
+    assert backend.overflows == 0
+    assert backend.evictions == 1
+    assert len(backend) == 2
+    # a kept its bucket.
+    assert take(backend, "signup:ip:a", capacity=1, refill_per_second=0.1) > 0
+
+
+def test_clients_beyond_capacity_share_a_bucket(clock):
+    backend = MemoryBackend(max_keys=1)
+    take(backend, "login:ip:a")
+
+    assert [take(backend, f"login:ip:new-{number}") for number in range(3)] == [0, 0, 0]
+    assert take(backend, "login:ip:new-3") > 0
+    assert backend.overflows == 4
+    # Other routes overflow into their own bucket.
+    assert take(backend, "signup:ip:new-4") == 0
+
+
+def test_retry_after_header(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "limiter_backend", MemoryBackend(max_keys=100))
+    monkeypatch.setenv("RATE_LIMIT_LOGIN", "10/60")
+    limit = RateLimit("login")
+    request = Request({"type": "http", "client": ("192.0.2.1", 50000), "headers": []})
+
+    for _ in range(10):
+        asyncio.run(limit(request, token=None))
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(limit(request, token=None))
+
+    assert rejected.value.status_code == 429
+    # One token comes back every 6 seconds.
+    assert rejected.value.headers["Retry-After"] == "6"
+
+    clock.now += 6
+    asyncio.run(limit(request, token=None))
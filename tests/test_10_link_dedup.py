@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud, models, schemas
+from app.database import create_engine_from_url
+
+UTC = datetime.timezone.utc
+EXPIRY = datetime.datetime(2030, 1, 1, tzinfo=UTC)
+
+
+@pytest.fixture()
+def run_with_session(sqlite_database_url, monkeypatch):
+    """Runs `scenario(db, owner_id)` against a fresh database with link dedup on."""
+    monkeypatch.setattr(crud, "LINK_DEDUP_ENABLED", True)
+
+    def run(scenario):
+        async def main():
+            engine = create_engine_from_url(sqlite_database_url)
+            try:
+                async with AsyncSession(engine, expire_on_commit=False) as db:
+                    user = models.User(username="Tester", email="dedup@example.com", password="x")
+                    db.add(user)
+                    await db.commit()
+                    return await scenario(db, user.id)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    yield run
+
+
+def test_repeat_submission_returns_the_same_link(run_with_session):
+    async def scenario(db, owner_id):
+        first = await crud.create_db_url(db, "https://example.com/page", owner_id=owner_id)
+        second = await crud.create_db_url(db, "https://example.com/page", owner_id=owner_id)
+        return first.short_code, second.short_code
+
+    first, second = run_with_session(scenario)
+
+    assert first == second
+
+
+def test_equivalent_urls_are_deduplicated(run_with_session):
+    async def scenario(db, owner_id):
+        first = await crud.create_db_url(db, "https://example.com/page?q=1", owner_id=owner_id)
+        return [
+            (await crud.create_db_url(db, target_url, owner_id=owner_id)).short_code == first.short_code
+            for target_url in [
+                "HTTPS://Example.COM/page?q=1",
+                "https://example.com:443/page?q=1",
+                "http://example.com/page?q=1",
+                "https://example.com:8443/page?q=1",
+                "https://example.com/Page?q=1",
+            ]
+        ]
+
+    # Scheme and host case and the default port don't matter; the scheme itself, other
+    # ports and path case do.
+    assert run_with_session(scenario) == [True, True, False, False, False]
+
+
+def test_empty_path_matches_root(run_with_session):
+    async def scenario(db, owner_id):
+        first = await crud.create_db_url(db, "https://example.com", owner_id=owner_id)
+        second = await crud.create_db_url(db, "https://example.com/", owner_id=owner_id)
+        return first.short_code, second.short_code
+
+    first, second = run_with_session(scenario)
+
+    assert first == second
+
+
+def test_different_policy_is_a_new_link(run_with_session):
+    async def scenario(db, owner_id):
+        target_url = "https://example.com/page"
+        plain = await crud.create_db_url(db, target_url, owner_id=owner_id)
+        permanent = await crud.create_db_url(db, target_url, owner_id=owner_id, redirect_type="permanent")
+        expiring = await crud.create_db_url(db, target_url, owner_id=owner_id, expires_at=EXPIRY)
+        return [
+            plain.short_code,
+            permanent.short_code,
+            expiring.short_code,
+            (await crud.create_db_url(db, target_url, owner_id=owner_id, redirect_type="permanent")).short_code,
+            (await crud.create_db_url(db, target_url, owner_id=owner_id, expires_at=EXPIRY)).short_code,
+        ]
+
+    plain, permanent, expiring, permanent_again, expiring_again = run_with_session(scenario)
+
+    assert len({plain, permanent, expiring}) == 3
+    assert permanent_again == permanent
+    assert expiring_again == expiring
+
+
+def test_anonymous_links_are_never_deduplicated(run_with_session):
+    async def scenario(db, owner_id):
+        first = await crud.create_db_url(db, "https://example.com/page")
+        second = await crud.create_db_url(db, "https://example.com/page")
+        batch = await crud.create_db_urls_bulk(
+            db, [schemas.URLCreate(target_url="https://example.com/page")] * 2
+        )
+        return [first.short_code, second.short_code] + [row.short_code for row in batch]
+
+    assert len(set(run_with_session(scenario))) == 4
+
+
+def test_batch_collapses_repeats_and_reuses_existing_links(run_with_session):
+    async def scenario(db, owner_id):
+        existing = await crud.create_db_url(db, "https://example.com/existing", owner_id=owner_id)
+        batch = await crud.create_db_urls_bulk(
+            db,
+            [
+                schemas.URLCreate(target_url="https://example.com/new"),
+                schemas.URLCreate(target_url="https://EXAMPLE.com:443/new"),
+                schemas.URLCreate(target_url="https://example.com/existing"),
+                schemas.URLCreate(target_url="https://example.com/new", redirect_type="permanent"),
+            ],
+            owner_id=owner_id,
+        )
+        return existing.short_code, [row.short_code for row in batch]
+
+    existing, (new, new_again, existing_again, permanent) = run_with_session(scenario)
+
+    assert new == new_again
+    assert existing_again == existing
+    assert len({new, existing, permanent}) == 3
@@ -0,0 +1,149 @@
+import csv
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+LINKS = [
+    {"short_code": "aaaaaaaa", "target_url": "https://example.com/a", "clicks": 3,
+     "created_at": "2024-05-01T12:00:00+00:00"},
+    {"target_url": "https://example.com/b", "owned_by": 1},
+    {"short_code": "cccccccc", "target_url": "https://example.com/c", "redirect_type": "permanent",
+     "cache_max_age": 600, "expires_at": "2030-01-01T02:00:00+02:00"},
+]
+
+
+def manage(database_url, *args, **env_overrides):
+    env = dict(os.environ, DATABASE_URL=database_url, **env_overrides)
+    return subprocess.run(
+        [sys.executable, "manage.py", *args], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+    )
+
+
+def database_path(database_url):
+    return database_url.split("///", 1)[1]
+
+
+def add_user(database_url):
+    with sqlite3.connect(database_path(database_url)) as conn:
+        return conn.execute(
+            "INSERT INTO users_table (username, email, password) VALUES ('Tester', 'manage@example.com', 'x')"
+        ).lastrowid
+
+
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    return str(path)
+
+
+def read_jsonl(path):
+    return [json.loads(line) for line in Path(path).read_text().splitlines()]
+
+
+def test_jsonl_and_csv_round_trip(sqlite_database_url, tmp_path):
+    add_user(sqlite_database_url)
+    result = manage(sqlite_database_url, "import", write_jsonl(tmp_path / "links.jsonl", LINKS))
+    assert result.returncode == 0, result.stderr
+    assert "Imported 3 links" in result.stderr
+
+    assert manage(sqlite_database_url, "export", str(tmp_path / "first.jsonl")).returncode == 0
+    exported = read_jsonl(tmp_path / "first.jsonl")
+
+    # Rows that bring their own code are inserted before rows that need one allocated.
+    by_target = {link["target_url"]: link for link in exported}
+    assert sorted(by_target) == [link["target_url"] for link in LINKS]
+    first, second, third = (by_target[link["target_url"]] for link in LINKS)
+    assert first["short_code"] == "aaaaaaaa"
+    assert first["clicks"] == 3
+    assert first["created_at"].startswith("2024-05-01T12:00:00")
+    # A code was allocated for the row without one.
+    assert len(second["short_code"]) == 8
+    assert second["owned_by"] == 1
+    assert third["redirect_type"] == "permanent"
+    assert third["cache_max_age"] == 600
+    # Stored in UTC.
+    assert third["expires_at"].startswith("2030-01-01T00:00:00")
+
+    # Through CSV into a second database and back out.
+    assert manage(sqlite_database_url, "export", str(tmp_path / "links.csv")).returncode == 0
+    with open(tmp_path / "links.csv", newline="") as csv_file:
+        assert len(list(csv.DictReader(csv_file))) == 3
+    other_database_url = f"sqlite+aiosqlite:///{tmp_path / 'other.db'}"
+    manage(other_database_url, "import", write_jsonl(tmp_path / "nothing.jsonl", []))
+    add_user(other_database_url)
+    result = manage(other_database_url, "import", str(tmp_path / "links.csv"))
+    assert result.returncode == 0, result.stderr
+    assert manage(other_database_url, "export", str(tmp_path / "second.jsonl")).returncode == 0
+
+    assert read_jsonl(tmp_path / "second.jsonl") == exported
+
+
+def test_conflicts_and_invalid_rows_are_reported(sqlite_database_url, tmp_path):
+    manage(sqlite_database_url, "import", write_jsonl(tmp_path / "first.jsonl", LINKS[:1]))
+    records = [
+        {"short_code": "aaaaaaaa", "target_url": "https://example.com/taken"},
+        {"short_code": "dddddddd", "target_url": "https://example.com/d"},
+        {"target_url": "ftp://example.com/file"},
+        {"short_code": "eeeeeeee", "target_url": "https://example.com/e", "owned_by": 999},
+        {"short_code": "dddddddd", "target_url": "https://example.com/repeat"},
+    ]
+
+    result = manage(
+        sqlite_database_url, "import", write_jsonl(tmp_path / "second.jsonl", records),
+        "--report", str(tmp_path / "report.jsonl"),
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert "Imported 1 links" in result.stderr
+    assert "skipped 2 conflicts and 2 invalid rows" in result.stderr
+    report = sorted(read_jsonl(tmp_path / "report.jsonl"), key=lambda entry: entry["line"])
+    assert [(entry["line"], entry["short_code"]) for entry in report] == [
+        (1, "aaaaaaaa"), (3, None), (4, "eeeeeeee"), (5, "dddddddd")
+    ]
+    assert report[0]["error"] == "conflict"
+    assert "http" in report[1]["error"]
+    assert report[2]["error"] == "owner 999 does not exist"
+    assert report[3]["error"] == "conflict"
+    with sqlite3.connect(database_path(sqlite_database_url)) as conn:
+        assert conn.execute("SELECT target_url FROM urls_table WHERE short_code = 'aaaaaaaa'").fetchone() == (
+            "https://example.com/a",
+        )
+
+
+def test_owner_option(sqlite_database_url, tmp_path):
+    path = write_jsonl(tmp_path / "links.jsonl", LINKS)
+
+    result = manage(sqlite_database_url, "import", path, "--owner", "999")
+
+    assert result.returncode != 0
+    assert "owner 999 does not exist" in result.stderr
+
+    owner_id = add_user(sqlite_database_url)
+    result = manage(sqlite_database_url, "import", path, "--owner", str(owner_id))
+    assert result.returncode == 0, result.stderr
+    assert manage(sqlite_database_url, "export", str(tmp_path / "mine.jsonl"), "--owner", str(owner_id)).returncode == 0
+
+    assert [link["owned_by"] for link in read_jsonl(tmp_path / "mine.jsonl")] == [owner_id] * 3
+
+
+def test_sequence_codes_with_given_codes_in_one_chunk(sqlite_database_url, tmp_path):
+    # The SQLite block counter commits on its own connection, so it must not be asked for
+    # codes after the chunk has started writing.
+    records = [
+        {"short_code": "aaaaaaaa", "target_url": "https://example.com/a"},
+        {"target_url": "https://example.com/b"},
+    ]
+
+    result = manage(
+        sqlite_database_url, "import", write_jsonl(tmp_path / "links.jsonl", records),
+        SHORT_CODE_STRATEGY="sequence", SQLITE_BUSY_TIMEOUT_MS="100",
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert "Imported 2 links" in result.stderr
+    with sqlite3.connect(database_path(sqlite_database_url)) as conn:
+        assert conn.execute("SELECT count(*) FROM urls_table").fetchone() == (2,)
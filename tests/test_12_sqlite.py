@@ -0,0 +1,112 @@
+import asyncio
+import datetime
+import pytest
+from sqlalchemy import exc, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud, models
+from app.database import create_engine_from_url
+from app.dependencies import Principal
+from app.routers import links
+
+UTC = datetime.timezone.utc
+
+
+async def add_link(engine, **columns):
+    async with AsyncSession(engine, expire_on_commit=False) as db:
+        db_url = models.URL(short_code="aaaaaaaa", target_url="https://example.com/", **columns)
+        db.add(db_url)
+        await db.commit()
+        return db_url
+
+
+def test_concurrent_writes_queue_instead_of_failing(sqlite_database_url):
+    async def run():
+        writer = create_engine_from_url(sqlite_database_url)
+        reader = create_engine_from_url(sqlite_database_url, sqlite_role="reader")
+        try:
+            link = await add_link(writer)
+
+            async def write(number):
+                async with AsyncSession(writer, expire_on_commit=False) as db:
+                    await crud.create_db_url(db, f"https://example.com/{number}")
+                    await crud.increment_clicks_by_id(db, link.url_id)
+                    await db.commit()
+
+            async def read():
+                async with AsyncSession(reader) as db:
+                    return (await db.execute(select(models.URL.clicks).filter_by(url_id=link.url_id))).scalar_one()
+
+            results = await asyncio.gather(*(write(number) for number in range(50)), *(read() for _ in range(10)))
+            async with AsyncSession(reader) as db:
+                count = (await db.execute(select(models.URL.url_id))).all()
+                clicks = (await db.execute(select(models.URL.clicks).filter_by(url_id=link.url_id))).scalar_one()
+            return results, len(count), clicks
+        finally:
+            await writer.dispose()
+            await reader.dispose()
+
+    # Any "database is locked" error would have been raised out of gather.
+    results, links_count, clicks = asyncio.run(run())
+
+    assert results[:50] == [None] * 50
+    assert links_count == 51
+    assert clicks == 50
+
+
+def test_scan_connections_are_read_only(sqlite_database_url):
+    async def run():
+        writer = create_engine_from_url(sqlite_database_url)
+        reader = create_engine_from_url(sqlite_database_url, sqlite_role="reader")
+        try:
+            link = await add_link(writer)
+            async with AsyncSession(writer) as write_db, AsyncSession(reader) as read_db:
+                # A write in progress doesn't hold up readers, who see the last commit.
+                await write_db.execute(update(models.URL).filter_by(url_id=link.url_id).values(clicks=5))
+                seen = (await read_db.execute(select(models.URL.clicks))).scalar_one()
+                await write_db.commit()
+
+                with pytest.raises(exc.OperationalError, match="readonly"):
+                    await read_db.execute(update(models.URL).values(clicks=0))
+            return seen
+        finally:
+            await writer.dispose()
+            await reader.dispose()
+
+    assert asyncio.run(run()) == 0
+
+
+def test_click_series_window_is_compared_in_utc(sqlite_database_url):
+    async def run():
+        engine = create_engine_from_url(sqlite_database_url)
+        try:
+            async with AsyncSession(engine, expire_on_commit=False) as db:
+                user = models.User(username="Tester", email="series@example.com", password="x")
+                db.add(user)
+                await db.flush()
+                db.add(models.URL(short_code="aaaaaaaa", target_url="https://example.com/", owned_by=user.id))
+                db.add_all(
+                    models.ClickRollup(
+                        short_code="aaaaaaaa", granularity="hour",
+                        bucket_start=datetime.datetime(2024, 5, 1, hour, tzinfo=UTC), clicks=hour,
+                    )
+                    for hour in range(10, 16)
+                )
+                await db.commit()
+
+                # 14:00-16:00 at UTC+2 is 12:00-14:00 UTC.
+                return await links.get_num_clicks(
+                    "aaaaaaaa",
+                    interval="hour",
+                    start=datetime.datetime.fromisoformat("2024-05-01T14:00:00+02:00"),
+                    end=datetime.datetime.fromisoformat("2024-05-01T16:00:00+02:00"),
+                    db=db,
+                    read_db=db,
+                    current_user=Principal(user.id),
+                )
+        finally:
+            await engine.dispose()
+
+    stats = asyncio.run(run())
+
+    assert [bucket["clicks"] for bucket in stats["series"]] == [12, 13]
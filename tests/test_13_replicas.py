@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app import crud, models
+from app.cache import negative_cache, url_cache
+from app.database import create_engine_from_url
+
+
+@pytest.fixture()
+def replica_database_url(tmp_path):
+    """A second SQLite file standing in for the read replica; nothing replicates to it."""
+    database_url = f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}"
+
+    async def create_tables():
+        engine = create_async_engine(database_url)
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        await engine.dispose()
+
+    asyncio.run(create_tables())
+    yield database_url
+
+
+@pytest.fixture()
+def run_with_sessions(sqlite_database_url, replica_database_url):
+    """Runs `scenario(db, read_db, primary, replica)` with a session on each database."""
+
+    def run(scenario):
+        async def main():
+            primary = create_engine_from_url(sqlite_database_url)
+            replica = create_engine_from_url(replica_database_url)
+            try:
+                async with AsyncSession(primary, expire_on_commit=False) as db, \
+                        AsyncSession(replica, expire_on_commit=False) as read_db:
+                    return await scenario(db, read_db, primary, replica)
+            finally:
+                await primary.dispose()
+                await replica.dispose()
+
+        url_cache.clear()
+        negative_cache.clear()
+        try:
+            return asyncio.run(main())
+        finally:
+            url_cache.clear()
+            negative_cache.clear()
+
+    yield run
+
+
+async def add_link(engine, short_code, target_url):
+    async with AsyncSession(engine) as db:
+        db.add(models.URL(short_code=short_code, target_url=target_url))
+        await db.commit()
+
+
+async def link_clicks(engine, short_code):
+    async with AsyncSession(engine) as db:
+        result = await db.execute(select(models.URL.clicks).filter_by(short_code=short_code))
+        return result.scalar_one_or_none()
+
+
+def test_reads_go_to_the_replica(run_with_sessions):
+    async def scenario(db, read_db, primary, replica):
+        # The two copies differ, so the answer shows which database it came from.
+        await add_link(primary, "aaaaaaaa", "https://example.com/primary")
+        await add_link(replica, "aaaaaaaa", "https://example.com/replica")
+        link = await crud.resolve_short_code(db, "aaaaaaaa", read_db=read_db)
+        return link.target_url
+
+    assert run_with_sessions(scenario) == "https://example.com/replica"
+
+
+def test_link_missing_on_the_replica_falls_back_to_the_primary(run_with_sessions):
+    async def scenario(db, read_db, primary, replica):
+        await add_link(primary, "aaaaaaaa", "https://example.com/primary")
+        link = await crud.resolve_short_code(db, "aaaaaaaa", read_db=read_db)
+        missing = await crud.resolve_short_code(db, "bbbbbbbb", read_db=read_db)
+        return link.target_url, missing
+
+    target_url, missing = run_with_sessions(scenario)
+
+    assert target_url == "https://example.com/primary"
+    assert missing is None
+
+
+def test_writes_go_to_the_primary(run_with_sessions):
+    async def scenario(db, read_db, primary, replica):
+        await add_link(primary, "aaaaaaaa", "https://example.com/primary")
+        await add_link(replica, "aaaaaaaa", "https://example.com/replica")
+        created = await crud.create_db_url(db, "https://example.com/new")
+        # Counting a click skips the replica, even though it has the link.
+        await crud.resolve_short_code(db, "aaaaaaaa", read_db=read_db, count_click=True)
+        await db.commit()
+        return (
+            await link_clicks(primary, created.short_code),
+            await link_clicks(replica, created.short_code),
+            await link_clicks(primary, "aaaaaaaa"),
+            await link_clicks(replica, "aaaaaaaa"),
+        )
+
+    new_on_primary, new_on_replica, primary_clicks, replica_clicks = run_with_sessions(scenario)
+
+    assert new_on_primary == 0
+    assert new_on_replica is None
+    assert primary_clicks == 1
+    assert replica_clicks == 0
@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app import clicks, models
+
+
+class FailingCommitSession(AsyncSession):
+    async def commit(self):
+        raise ConnectionError("database went away")
+
+
+@pytest.fixture()
+def engine_with_links(sqlite_database_url, monkeypatch):
+    """An engine on a database with links 1 to 3, and a fresh click buffer flushed into it."""
+    # Each step runs in its own event loop, so connections aren't kept between them.
+    engine = create_async_engine(sqlite_database_url, poolclass=NullPool)
+
+    async def add_links():
+        async with engine.begin() as conn:
+            await conn.execute(
+                models.URL.__table__.insert(),
+                [
+                    {"url_id": url_id, "short_code": f"link{url_id:04d}", "target_url": "https://example.com/", "clicks": 0}
+                    for url_id in range(1, 4)
+                ],
+            )
+
+    asyncio.run(add_links())
+    monkeypatch.setattr(clicks, "click_buffer", clicks.ClickBuffer(batch_size=3))
+    monkeypatch.setattr(clicks, "AsyncSessionLocal", async_sessionmaker(bind=engine, expire_on_commit=False))
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+async def link_clicks(engine):
+    async with engine.connect() as conn:
+        result = await conn.execute(select(models.URL.url_id, models.URL.clicks).order_by(models.URL.url_id))
+        return dict(result.all())
+
+
+def test_buffered_clicks_are_flushed_as_totals(engine_with_links):
+    for url_id in [1, 1, 2, 1]:
+        clicks.click_buffer.add(url_id)
+    clicks.click_buffer.add(2, count=3)
+
+    asyncio.run(clicks.flush_clicks())
+
+    assert asyncio.run(link_clicks(engine_with_links)) == {1: 3, 2: 4, 3: 0}
+    assert len(clicks.click_buffer) == 0
+    # Nothing pending: the next flush doesn't touch the database.
+    asyncio.run(clicks.flush_clicks())
+    assert asyncio.run(link_clicks(engine_with_links)) == {1: 3, 2: 4, 3: 0}
+
+
+def test_batch_size_requests_an_early_flush():
+    buffer = clicks.ClickBuffer(batch_size=2)
+
+    buffer.add(1)
+    buffer.add(1)
+    assert not buffer.flush_requested.is_set()
+    buffer.add(2)
+    assert buffer.flush_requested.is_set()
+
+
+def test_failed_flush_keeps_the_clicks(engine_with_links, monkeypatch):
+    working_sessions = clicks.AsyncSessionLocal
+    monkeypatch.setattr(
+        clicks, "AsyncSessionLocal",
+        async_sessionmaker(bind=engine_with_links, expire_on_commit=False, class_=FailingCommitSession),
+    )
+    clicks.click_buffer.add(1, count=2)
+    clicks.click_buffer.add(2)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(clicks.flush_clicks())
+
+    assert asyncio.run(link_clicks(engine_with_links)) == {1: 0, 2: 0, 3: 0}
+    assert len(clicks.click_buffer) == 2
+
+    # Clicks made after the failure are added to the ones put back.
+    clicks.click_buffer.add(1)
+    clicks.click_buffer.add(3)
+    monkeypatch.setattr(clicks, "AsyncSessionLocal", working_sessions)
+    asyncio.run(clicks.flush_clicks())
+
+    assert asyncio.run(link_clicks(engine_with_links)) == {1: 3, 2: 1, 3: 1}
+    assert len(clicks.click_buffer) == 0
@@ -0,0 +1,169 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app import bloom, crud, models, shared_cache
+from app.cache import negative_cache, url_cache
+from app.dependencies import LazySession
+from app.routers import links
+
+
+def code(url_id):
+    return f"link{url_id:04d}"
+
+
+async def add_links(engine, url_ids):
+    async with engine.begin() as conn:
+        await conn.execute(
+            models.URL.__table__.insert(),
+            [{"url_id": url_id, "short_code": code(url_id), "target_url": "https://example.com/"} for url_id in url_ids],
+        )
+
+
+@pytest.fixture()
+def run_with_filter(sqlite_database_url, monkeypatch):
+    """Runs `scenario(engine, code_filter)` with a fresh filter that scans a fresh database."""
+    code_filter = bloom.ShortCodeFilter()
+    monkeypatch.setattr(bloom, "code_filter", code_filter)
+    monkeypatch.setattr(crud, "code_filter", code_filter)
+
+    def run(scenario):
+        async def main():
+            engine = create_async_engine(sqlite_database_url)
+            monkeypatch.setattr(bloom, "ScanSessionLocal", async_sessionmaker(bind=engine, expire_on_commit=False))
+            try:
+                return await scenario(engine, code_filter)
+            finally:
+                await engine.dispose()
+
+        url_cache.clear()
+        negative_cache.clear()
+        try:
+            return asyncio.run(main())
+        finally:
+            url_cache.clear()
+            negative_cache.clear()
+
+    yield run
+
+
+def test_unknown_code_gets_404_without_a_query(run_with_filter):
+    async def scenario(engine, code_filter):
+        await add_links(engine, [1, 2, 3])
+        await bloom.rebuild_code_filter()
+
+        statements = []
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+        async with LazySession(sessions) as db:
+            with pytest.raises(HTTPException) as exc_info:
+                await links.redirect_to_original("unknown1", request=None, db=db, read_db=db)
+            return exc_info.value.status_code, statements, db._session, code_filter.rejected
+
+    status_code, statements, session, rejected = run_with_filter(scenario)
+
+    assert status_code == 404
+    assert statements == []
+    # The request never even created a session.
+    assert session is None
+    assert rejected == 1
+
+
+def test_refresh_rescans_the_lookback(run_with_filter, monkeypatch):
+    async def scenario(engine, code_filter):
+        await add_links(engine, [1, 2, 3])
+        await bloom.rebuild_code_filter()
+        await add_links(engine, [10])
+        await bloom.refresh_code_filter()
+        # A batch that drew its IDs before link 10 but committed after the last refresh.
+        await add_links(engine, [5])
+
+        monkeypatch.setattr(bloom, "BLOOM_FILTER_LOOKBACK_SECONDS", 0)
+        await bloom.refresh_code_filter()
+        without_lookback = code_filter.might_contain(code(5))
+
+        monkeypatch.setattr(bloom, "BLOOM_FILTER_LOOKBACK_SECONDS", 60)
+        await bloom.rebuild_code_filter()
+        await add_links(engine, [20])
+        await bloom.refresh_code_filter()
+        await add_links(engine, [15])
+        await bloom.refresh_code_filter()
+        return without_lookback, code_filter.might_contain(code(10)), code_filter.might_contain(code(15))
+
+    without_lookback, seen_before, late_commit = run_with_filter(scenario)
+
+    assert not without_lookback
+    assert seen_before
+    assert late_commit
+
+
+async def create_link(engine):
+    async with async_sessionmaker(bind=engine, expire_on_commit=False)() as db:
+        return (await crud.create_db_url(db, "https://example.com/new")).short_code
+
+
+def test_other_workers_miss_a_new_code_until_they_refresh(run_with_filter, monkeypatch):
+    # The fixture's filter belongs to the worker that serves the redirect.
+    creating_worker = bloom.ShortCodeFilter()
+    monkeypatch.setattr(crud, "code_filter", creating_worker)
+    monkeypatch.setattr(crud, "shared_cache", None)
+
+    async def scenario(engine, code_filter):
+        await add_links(engine, [1])
+        await bloom.rebuild_code_filter()
+        # An empty filter, so the creating worker only knows the code from creating it.
+        creating_worker.bloom = bloom.BloomFilter(100, 0.001)
+        short_code = await create_link(engine)
+        before_refresh = code_filter.might_contain(short_code)
+        await bloom.refresh_code_filter()
+        return creating_worker.might_contain(short_code), before_refresh, code_filter.might_contain(short_code)
+
+    on_creating_worker, before_refresh, after_refresh = run_with_filter(scenario)
+
+    assert on_creating_worker
+    assert not before_refresh
+    assert after_refresh
+
+
+def test_new_codes_reach_other_workers_through_the_shared_cache(run_with_filter, monkeypatch):
+    backend = shared_cache.MemoryBackend()
+    creating_worker = bloom.ShortCodeFilter()
+    monkeypatch.setattr(crud, "code_filter", creating_worker)
+    monkeypatch.setattr(crud, "shared_cache", shared_cache.SharedCache(backend, "test:", ttl=60))
+    listening_worker = shared_cache.SharedCache(backend, "test:", ttl=60)
+
+    async def scenario(engine, code_filter):
+        await add_links(engine, [1])
+        await bloom.rebuild_code_filter()
+        listener = asyncio.create_task(listening_worker.listen())
+        # Let the listener subscribe before anything is published.
+        await asyncio.sleep(0)
+        short_code = await create_link(engine)
+        await asyncio.sleep(0)
+        listener.cancel()
+        return code_filter.might_contain(short_code)
+
+    # No refresh ran on the listening worker.
+    assert run_with_filter(scenario)
+
+
+def test_watermarks_advance_past_the_lookback():
+    code_filter = bloom.ShortCodeFilter()
+    assert code_filter.rescan_from(now=0, lookback=60) == 0
+
+    code_filter.record_scan(0, 10)
+    code_filter.record_scan(30, 20)
+    # A scan that saw nothing newer doesn't move the watermark back.
+    code_filter.record_scan(70, 15)
+    assert list(code_filter.watermarks) == [(0, 10), (30, 20), (70, 20)]
+
+    # Nothing after time 0 is 60 seconds old yet, so the scan starts from the first one.
+    assert code_filter.rescan_from(now=80, lookback=60) == 10
+    # At 95 the watermark from 30 is old enough; the one from 0 is dropped.
+    assert code_filter.rescan_from(now=95, lookback=60) == 20
+    assert list(code_filter.watermarks) == [(30, 20), (70, 20)]
+    # The last watermark is always kept, however old.
+    assert code_filter.rescan_from(now=1000, lookback=60) == 20
+    assert list(code_filter.watermarks) == [(70, 20)]
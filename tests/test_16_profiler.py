@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import Counter, deque
+from pathlib import Path
+
+from app import profiler
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Run in a subprocess: the app only adds the profiler and its endpoint when the
+# settings are there at import.
+ADMIN_REQUESTS = """
+import json
+from fastapi.testclient import TestClient
+from app.main import app
+
+client = TestClient(app)
+client.get("/")
+client.get("/")
+results = {}
+for name, headers, query in [
+    ("missing", {}, ""),
+    ("wrong", {"X-Admin-Token": "wrong"}, ""),
+    ("json", {"X-Admin-Token": "secret"}, ""),
+    ("collapsed", {"X-Admin-Token": "secret"}, "?format=collapsed"),
+    ("unknown_id", {"X-Admin-Token": "secret"}, "?id=999"),
+]:
+    response = client.get("/admin/profiles" + query, headers=headers)
+    results[name] = [response.status_code, response.headers["content-type"], response.text]
+print(json.dumps(results))
+"""
+
+
+async def call(app, path="/"):
+    scope = {"type": "http", "method": "GET", "path": path}
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+def make_app(delays):
+    """An ASGI app that answers each path after `delays[path]` seconds."""
+    async def app(scope, receive, send):
+        await asyncio.sleep(delays.get(scope["path"], 0))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    return profiler.ProfilerMiddleware(app)
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_only_slow_or_sampled_requests_are_kept(monkeypatch):
+    monkeypatch.setattr(profiler, "profiles", deque(maxlen=10))
+    monkeypatch.setattr(profiler, "PROFILER_SLOW_REQUEST_MS", 50)
+    monkeypatch.setattr(profiler, "PROFILER_SAMPLE_RATE", 0)
+    app = make_app({"/slow": 0.06})
+
+    async def run():
+        await call(app, "/fast")
+        await call(app, "/slow")
+        monkeypatch.setattr(profiler, "PROFILER_SAMPLE_RATE", 1)
+        await call(app, "/fast")
+
+    asyncio.run(run())
+
+    assert [(profile.path, profile.reason) for profile in profiler.profiles] == [
+        ("/slow", "slow"), ("/fast", "sampled")
+    ]
+    slow = profiler.profiles[0].summary()
+    assert slow["status"] == 200
+    assert slow["wall_ms"] >= 50
+
+
+def test_only_the_last_profiles_are_kept(monkeypatch):
+    monkeypatch.setattr(profiler, "profiles", deque(maxlen=3))
+    monkeypatch.setattr(profiler, "PROFILER_SLOW_REQUEST_MS", 0)
+    app = make_app({})
+
+    async def run():
+        for number in range(5):
+            await call(app, f"/{number}")
+
+    asyncio.run(run())
+
+    assert [profile.path for profile in profiler.profiles] == ["/2", "/3", "/4"]
+
+
+def test_samples_are_charged_to_the_request_in_collapsed_format(monkeypatch):
+    monkeypatch.setattr(profiler, "profiles", deque(maxlen=10))
+    monkeypatch.setattr(profiler, "PROFILER_SLOW_REQUEST_MS", 0)
+    sampler = profiler.Sampler(interval=0.001)
+    monkeypatch.setattr(profiler, "sampler", sampler)
+
+    async def busy_app(scope, receive, send):
+        busy(0.2)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    async def run():
+        sampler.start()
+        try:
+            await call(profiler.ProfilerMiddleware(busy_app))
+        finally:
+            sampler.stop()
+
+    asyncio.run(run())
+
+    profile, = profiler.profiles
+    assert profile.samples > 0
+    lines = profiler.render_collapsed([profile]).splitlines()
+    assert all(re.fullmatch(r"\S+ \d+", line) for line in lines)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == profile.samples
+    assert any(f"{__name__}:busy" in line for line in lines)
+
+
+def test_collapsed_stacks_are_merged_most_common_first():
+    first = profiler.Profile(1, "GET", "/")
+    first.stacks = Counter({"main;handler;query": 2})
+    second = profiler.Profile(2, "GET", "/")
+    second.stacks = Counter({"main;handler;query": 1, "main;handler;hash": 5})
+
+    assert profiler.render_collapsed([first, second]) == "main;handler;hash 5\nmain;handler;query 3\n"
+
+
+def test_admin_endpoint_needs_the_token(sqlite_database_url):
+    env = dict(
+        os.environ, DATABASE_URL=sqlite_database_url, PROFILER_ENABLED="true",
+        PROFILER_ADMIN_TOKEN="secret", PROFILER_SLOW_REQUEST_MS="0",
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", ADMIN_REQUESTS], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    results = json.loads(result.stdout)
+
+    assert results["missing"][0] == 403
+    assert results["wrong"][0] == 403
+    status_code, _, body = results["json"]
+    assert status_code == 200
+    # Newest first; the rejected calls to the endpoint are profiled too.
+    kept = [(profile["path"], profile["reason"]) for profile in json.loads(body)]
+    assert kept == [("/admin/profiles", "slow")] * 2 + [("/", "slow")] * 2
+    ids = [profile["id"] for profile in json.loads(body)]
+    assert ids == sorted(ids, reverse=True)
+    status_code, content_type, _ = results["collapsed"]
+    assert status_code == 200
+    assert content_type.startswith("text/plain")
+    assert results["unknown_id"][0] == 404
@@ -0,0 +1,127 @@
+import asyncio
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import clicks, crud, models
+from app.cache import CachedURL, negative_cache, url_cache
+from app.dependencies import LazySession
+from app.routers import links
+
+LINK = CachedURL(url_id=1, target_url="https://example.com/", owned_by=None)
+
+
+@pytest.fixture()
+def run_counting_statements(sqlite_database_url):
+    """Runs `scenario(sessions)` on a database holding LINK as aaaaaaaa. Returns what it
+    returned, the statements it ran, its connection checkouts and the link's clicks."""
+
+    def run(scenario):
+        async def main():
+            engine = create_async_engine(sqlite_database_url)
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(
+                        models.URL.__table__.insert(),
+                        [{"url_id": 1, "short_code": "aaaaaaaa", "target_url": LINK.target_url, "clicks": 0}],
+                    )
+
+                statements, checkouts = [], []
+
+                def record_statement(conn, cursor, statement, *args):
+                    statements.append(statement)
+
+                def record_checkout(*args):
+                    checkouts.append(args)
+
+                event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+                event.listen(engine.sync_engine.pool, "checkout", record_checkout)
+                try:
+                    result = await scenario(async_sessionmaker(bind=engine, expire_on_commit=False))
+                finally:
+                    event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+                    event.remove(engine.sync_engine.pool, "checkout", record_checkout)
+
+                async with engine.connect() as conn:
+                    link_clicks = (await conn.execute(select(models.URL.clicks))).scalar_one()
+                return result, statements, len(checkouts), link_clicks
+            finally:
+                await engine.dispose()
+
+        url_cache.clear()
+        negative_cache.clear()
+        try:
+            return asyncio.run(main())
+        finally:
+            url_cache.clear()
+            negative_cache.clear()
+
+    yield run
+
+
+async def redirect(sessions, short_code="aaaaaaaa"):
+    async with LazySession(sessions) as db:
+        response = await links.redirect_to_original(short_code, request=None, db=db, read_db=db)
+        return response.status_code, response.headers["location"]
+
+
+def test_cached_redirect_with_buffered_clicks_opens_no_connection(run_counting_statements, monkeypatch):
+    monkeypatch.setattr(clicks, "CLICK_AGGREGATION", True)
+    monkeypatch.setattr(clicks, "click_buffer", clicks.ClickBuffer(batch_size=1000))
+
+    async def scenario(sessions):
+        url_cache.set("aaaaaaaa", LINK)
+        return await redirect(sessions)
+
+    response, statements, checkouts, _ = run_counting_statements(scenario)
+
+    assert response == (307, LINK.target_url)
+    assert statements == []
+    assert checkouts == 0
+    assert len(clicks.click_buffer) == 1
+
+
+def test_cached_redirect_counts_the_click_in_one_update(run_counting_statements):
+    async def scenario(sessions):
+        url_cache.set("aaaaaaaa", LINK)
+        return await redirect(sessions)
+
+    response, statements, checkouts, link_clicks = run_counting_statements(scenario)
+
+    assert response == (307, LINK.target_url)
+    assert len(statements) == 1
+    assert statements[0].startswith("UPDATE urls_table")
+    assert checkouts == 1
+    assert link_clicks == 1
+
+
+def test_uncached_lookup_counts_the_click_in_the_same_statement(run_counting_statements):
+    async def scenario(sessions):
+        async with sessions() as db:
+            found = await crud.resolve_short_code(db, "aaaaaaaa", count_click=True)
+            await db.commit()
+        return found, url_cache.get("aaaaaaaa")
+
+    (found, cached), statements, checkouts, link_clicks = run_counting_statements(scenario)
+
+    assert found == LINK
+    assert len(statements) == 1
+    assert statements[0].startswith("UPDATE urls_table")
+    assert "RETURNING" in statements[0]
+    assert checkouts == 1
+    assert link_clicks == 1
+    # The next redirect is served from the cache.
+    assert cached == LINK
+
+
+def test_unknown_code_is_one_statement_and_then_cached(run_counting_statements):
+    async def scenario(sessions):
+        async with sessions() as db:
+            first = await crud.resolve_short_code(db, "bbbbbbbb", count_click=True)
+            again = await crud.resolve_short_code(db, "bbbbbbbb", count_click=True)
+        return first, again
+
+    (first, again), statements, _, _ = run_counting_statements(scenario)
+
+    assert first is None and again is None
+    assert len(statements) == 1
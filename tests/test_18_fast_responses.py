@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Run in a subprocess: orjson is only imported with FAST_RESPONSES set, and the OpenAPI
+# schema has to be compared between apps imported with and without it. With it set, the
+# script also sends the same read-only requests in both modes.
+REQUESTS = """
+import json
+import time
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from app import responses, schemas
+from app.main import app
+
+
+def default_body(model, body):
+    # What FastAPI sends when a route returns the content of `body` and validates it.
+    adapter = TypeAdapter(model)
+    return JSONResponse(adapter.dump_python(adapter.validate_json(body), mode="json")).body.decode()
+
+
+def in_both_modes(method, path, **kwargs):
+    bodies = []
+    for fast in (False, True):
+        responses.FAST_RESPONSES = fast
+        response = client.request(method, path, **kwargs)
+        assert response.status_code < 300, response.text
+        bodies.append(response.content.decode())
+    responses.FAST_RESPONSES = True
+    return bodies
+
+
+results = {"openapi": app.openapi(), "fast": responses.FAST_RESPONSES}
+if not responses.FAST_RESPONSES:
+    print(json.dumps(results))
+    raise SystemExit
+
+with TestClient(app) as client:
+    responses.FAST_RESPONSES = True
+    account = {"username": "T\\u00ebster", "email": "fast@example.com", "password": "password123"}
+    signup = client.post("/users/signup", json={**account, "password_confirmation": account["password"]})
+    login = client.post("/users/login", json={"email": account["email"], "password": account["password"]})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    link = client.post(
+        "/links/", headers=headers,
+        json={"target_url": "https://example.com/caf\\u00e9?q=1", "redirect_type": "permanent",
+              "expires_at": "2030-01-01T02:00:00+02:00"},
+    )
+    batch = client.post("/links/batch", headers=headers, json=[{"target_url": "https://example.com/b"}] * 2)
+    short_code = link.json()["short_url"].rsplit("/", 1)[1]
+    client.get(f"/links/{short_code}", follow_redirects=False)
+    # Gives the click event writer time to fill the series.
+    time.sleep(0.5)
+
+    results["created"] = {
+        "signup": [signup.status_code, signup.text, default_body(schemas.UserDisplay, signup.text)],
+        "login": [login.status_code, login.text, default_body(schemas.Token, login.text)],
+        "link": [link.status_code, link.text, default_body(schemas.URLInfo, link.text)],
+        "batch": [batch.status_code, batch.text, default_body(list[schemas.URLInfo], batch.text)],
+    }
+    results["same"] = {
+        "mine": in_both_modes("GET", "/links/mine?limit=2", headers=headers),
+        "top": in_both_modes("GET", "/links/top", headers=headers),
+        "stats": in_both_modes("GET", f"/links/clicks/{short_code}", headers=headers),
+        "series": in_both_modes("GET", f"/links/clicks/{short_code}?interval=hour", headers=headers),
+        "stats_batch": in_both_modes(
+            "POST", "/links/clicks/batch", headers=headers, json={"short_codes": [short_code, "missing1"]}
+        ),
+    }
+    user_id = signup.json()["id"]
+    client.delete("/users/account/delete", headers=headers)
+    # Compare once the background purge is over, so the status doesn't change in between.
+    for _ in range(50):
+        if client.get(f"/users/account/delete/{user_id}", headers=headers).json()["status"] == "done":
+            break
+        time.sleep(0.1)
+    results["same"]["deletion"] = in_both_modes("GET", f"/users/account/delete/{user_id}", headers=headers)
+print(json.dumps(results))
+"""
+
+
+def run_requests(database_url, fast):
+    env = dict(
+        os.environ, DATABASE_URL=database_url, FAST_RESPONSES=fast, BCRYPT_ROUNDS="4",
+        CLICK_EVENTS_ENABLED="true", CLICK_EVENTS_FLUSH_INTERVAL_SECONDS="0.1",
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", REQUESTS], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout)
+
+
+def test_openapi_schema_is_the_same_in_both_modes(tmp_path):
+    default = run_requests(f"sqlite+aiosqlite:///{tmp_path / 'default.db'}", "false")
+    fast = run_requests(f"sqlite+aiosqlite:///{tmp_path / 'fast.db'}", "true")
+
+    assert not default["fast"] and fast["fast"]
+    assert fast["openapi"] == default["openapi"]
+
+
+def test_fast_responses_match_the_default_path(tmp_path):
+    fast = run_requests(f"sqlite+aiosqlite:///{tmp_path / 'fast.db'}", "true")
+
+    for name, (status_code, body, expected) in fast["created"].items():
+        assert status_code < 300, (name, body)
+        assert body == expected, name
+    for name, (default_body, fast_body) in fast["same"].items():
+        assert fast_body == default_body, name
+    assert json.loads(fast["same"]["series"][1])["series"]
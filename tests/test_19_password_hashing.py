@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+
+from app import password_utils
+from app.password_utils import BoundedExecutor
+
+
+def test_saturated_executor_answers_503():
+    executor = BoundedExecutor(workers=1, max_pending=2)
+    release = threading.Event()
+
+    async def run():
+        # One call runs and one waits for the thread, which fills the executor.
+        blocked = [asyncio.create_task(executor.run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        saturated = executor.stats()
+        with pytest.raises(HTTPException) as exc_info:
+            await executor.run(release.wait, 5)
+        release.set()
+        await asyncio.gather(*blocked)
+        # Room again once the calls are done.
+        await executor.run(release.wait, 5)
+        return saturated, exc_info.value, executor.stats()
+
+    saturated, rejection, drained = asyncio.run(run())
+
+    assert rejection.status_code == 503
+    assert rejection.headers == {"Retry-After": "1"}
+    assert saturated["in_flight"] == 1
+    assert saturated["queued"] == 1
+    assert drained["in_flight"] == 0
+    assert drained["queued"] == 0
+    assert drained["rejected"] == 1
+    assert drained["completed"] == 3
+
+
+def test_cancelled_call_stays_pending_until_its_thread_is_done():
+    executor = BoundedExecutor(workers=1, max_pending=1)
+    release = threading.Event()
+
+    async def run():
+        call = asyncio.create_task(executor.run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        # The client went away, but bcrypt keeps running on the thread.
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        cancelled = executor.stats()
+        with pytest.raises(HTTPException) as exc_info:
+            await executor.run(release.wait, 5)
+        release.set()
+        # The single thread only picks this up once the cancelled call is done.
+        await asyncio.wrap_future(executor._executor.submit(lambda: None))
+        return cancelled, exc_info.value, executor.stats()
+
+    cancelled, rejection, finished = asyncio.run(run())
+
+    assert cancelled["in_flight"] == 1
+    assert rejection.status_code == 503
+    assert finished["in_flight"] == 0
+    assert finished["completed"] == 1
+
+
+def test_hashing_runs_off_the_event_loop(monkeypatch):
+    executor = BoundedExecutor(workers=2, max_pending=4)
+    monkeypatch.setattr(password_utils, "hashing_executor", executor)
+    threads = []
+
+    def record_thread(*args):
+        threads.append(threading.current_thread().name)
+        return True
+
+    monkeypatch.setattr(password_utils.pwd_context, "verify", record_thread)
+
+    async def run():
+        return await password_utils.verify_password("password123", "hash"), threading.current_thread().name
+
+    verified, loop_thread = asyncio.run(run())
+
+    assert verified is True
+    assert threads[0].startswith("password-hash")
+    assert threads[0] != loop_thread
+
+
+def test_hash_and_verify_round_trip():
+    async def run():
+        hashed = await password_utils.hash_password("password123")
+        return (
+            await password_utils.verify_password("password123", hashed),
+            await password_utils.verify_password("wrong-password", hashed),
+        )
+
+    assert asyncio.run(run()) == (True, False)
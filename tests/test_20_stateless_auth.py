@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import crud, dependencies, jwt_utils, models
+from app.cache import DELETED_USER, user_cache
+from app.database import create_engine_from_url
+from app.dependencies import LazySession, Principal
+
+
+@pytest.fixture()
+def run_with_user(sqlite_database_url):
+    """Runs `scenario(sessions, user_id, statements)` on a database with one user;
+    `statements` collects every statement run from then on."""
+
+    def run(scenario):
+        async def main():
+            engine = create_engine_from_url(sqlite_database_url)
+            try:
+                sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+                async with sessions() as db:
+                    user = models.User(username="Tester", email="stateless@example.com", password="x")
+                    db.add(user)
+                    await db.commit()
+
+                statements = []
+
+                def record_statement(conn, cursor, statement, *args):
+                    statements.append(statement)
+
+                event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+                return await scenario(sessions, user.id, statements)
+            finally:
+                await engine.dispose()
+
+        user_cache.clear()
+        try:
+            return asyncio.run(main())
+        finally:
+            user_cache.clear()
+
+    yield run
+
+
+def token_for(user_id):
+    return jwt_utils.create_access_token(data={"sub": str(user_id)})
+
+
+async def principal_for(sessions, token):
+    async with LazySession(sessions) as db:
+        principal = await dependencies.get_current_principal(token=token, db=db, read_db=db)
+        return principal, db._session
+
+
+def test_stateless_principal_needs_no_query(run_with_user, monkeypatch):
+    monkeypatch.setattr(dependencies, "AUTH_MODE", "stateless")
+
+    async def scenario(sessions, user_id, statements):
+        principal, session = await principal_for(sessions, token_for(user_id))
+        missing, _ = await principal_for(sessions, None)
+        invalid, _ = await principal_for(sessions, "not-a-token")
+        return user_id, principal, session, missing, invalid, statements
+
+    user_id, principal, session, missing, invalid, statements = run_with_user(scenario)
+
+    assert principal == Principal(user_id)
+    # The request never even created a session.
+    assert session is None
+    assert statements == []
+    assert missing is None
+    assert invalid is None
+
+
+def test_deleted_account_is_rejected_without_a_query(run_with_user, monkeypatch):
+    monkeypatch.setattr(dependencies, "AUTH_MODE", "stateless")
+
+    async def scenario(sessions, user_id, statements):
+        user_cache.set(user_id, DELETED_USER)
+        principal, _ = await principal_for(sessions, token_for(user_id))
+        return principal, statements
+
+    principal, statements = run_with_user(scenario)
+
+    assert principal is None
+    assert statements == []
+
+
+def test_database_mode_loads_the_user(run_with_user, monkeypatch):
+    monkeypatch.setattr(dependencies, "AUTH_MODE", "database")
+
+    async def scenario(sessions, user_id, statements):
+        user, _ = await principal_for(sessions, token_for(user_id))
+        gone, _ = await principal_for(sessions, token_for(user_id + 1))
+        return user_id, user, gone, statements
+
+    user_id, user, gone, statements = run_with_user(scenario)
+
+    assert isinstance(user, models.User)
+    assert user.id == user_id
+    assert gone is None
+    assert len(statements) == 2
+
+
+def test_link_for_a_purged_owner_answers_401(run_with_user):
+    # A stateless token still verifies after its account was purged on another worker.
+    async def scenario(sessions, user_id, statements):
+        async with sessions() as db:
+            with pytest.raises(HTTPException) as exc_info:
+                await crud.create_db_url(db, "https://example.com/", owner_id=user_id + 1)
+        return exc_info.value, user_cache.get(user_id + 1)
+
+    rejection, cached = run_with_user(scenario)
+
+    assert rejection.status_code == 401
+    # Later requests with that token are turned away without touching the database.
+    assert cached is DELETED_USER
@@ -0,0 +1,65 @@
+import asyncio
+import datetime
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import crud, expiry, models
+from app.cache import CachedURL, url_cache
+
+UTC = datetime.timezone.utc
+
+
+def test_sweeper_deletes_expired_links_in_batches(sqlite_database_url, monkeypatch):
+    engine = create_async_engine(sqlite_database_url)
+    monkeypatch.setattr(expiry, "AsyncSessionLocal", async_sessionmaker(bind=engine, expire_on_commit=False))
+    monkeypatch.setattr(expiry, "LINK_SWEEP_BATCH_SIZE", 2)
+    now = datetime.datetime.now(UTC)
+    links = (
+        [(f"expired{number}", now - datetime.timedelta(minutes=number + 1)) for number in range(5)]
+        + [("upcoming", now + datetime.timedelta(hours=1)), ("forever0", None)]
+    )
+
+    async def run():
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    models.URL.__table__.insert(),
+                    [
+                        {"short_code": short_code, "target_url": "https://example.com/", "expires_at": expires_at}
+                        for short_code, expires_at in links
+                    ],
+                )
+            commits = []
+            event.listen(engine.sync_engine, "commit", lambda conn: commits.append(conn))
+            url_cache.set("expired0", CachedURL(url_id=1, target_url="https://example.com/", owned_by=None))
+
+            deleted = await expiry.sweep_expired_links()
+
+            async with engine.connect() as conn:
+                remaining = (await conn.execute(select(models.URL.short_code).order_by(models.URL.short_code))).scalars()
+                return deleted, len(commits), list(remaining), url_cache.get("expired0")
+        finally:
+            url_cache.invalidate("expired0")
+            await engine.dispose()
+
+    deleted, commits, remaining, cached = asyncio.run(run())
+
+    assert deleted == 5
+    # Two full batches, then a short one that ends the sweep.
+    assert commits == 3
+    assert remaining == ["forever0", "upcoming"]
+    assert cached is None
+
+
+def test_expired_link_is_not_served_from_the_cache():
+    expired = CachedURL(
+        url_id=1, target_url="https://example.com/", owned_by=None,
+        expires_at=(datetime.datetime.now(UTC) - datetime.timedelta(seconds=1)).timestamp(),
+    )
+    url_cache.set("expired0", expired)
+
+    try:
+        # The sweeper hasn't deleted it yet; the redirect still 404s.
+        assert asyncio.run(crud.resolve_short_code(None, "expired0")) is None
+    finally:
+        url_cache.invalidate("expired0")